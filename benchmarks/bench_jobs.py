@@ -0,0 +1,69 @@
+"""Job queue benchmarks: throughput and round-trips per call of the job API."""
+import json
+import uaimodal.api.job as job
+from uaimodal.api.scheduler import JobScheduler
+
+
+def benchCreateJob(context):
+    return lambda i: job.createJob("bench", "user", json.dumps({"i": i}), "")
+
+def benchCreateJobMemoized(context):
+    # Every request repeats, so after the first call each call is an index hit on a finished job
+    first = job.createJob("bench", "user", json.dumps({"i": 0}), "", memoize=True)
+    job.updateJobResult(first["id"], {"output": 0}, job.claimJob(first["id"]))
+    return lambda i: job.createJob("bench", "user", json.dumps({"i": 0}), "", memoize=True)
+
+def benchFindJob(context):
+    jobs = [job.createJob("bench", "user", "{}", "") for i in range(context["setupJobs"])]
+    return lambda i: job.findJob(jobs[i % len(jobs)]["id"])
+
+def benchFindFinishedJob(context):
+    jobs = [job.createJob("bench", "user", "{}", "") for i in range(context["setupJobs"])]
+    for job_ in jobs:
+        job.setJobFinished(job_["id"], job_)
+    return lambda i: job.findJob(jobs[i % len(jobs)]["id"])
+
+def benchSetJob(context):
+    jobs = [job.createJob("bench", "user", "{}", "") for i in range(context["setupJobs"])]
+    return lambda i: job.setJob(jobs[i % len(jobs)]["id"], jobs[i % len(jobs)], "running")
+
+def benchUpdateJobResult(context):
+    jobs = []
+    def setup(count):
+        for i in range(count):
+            job_ = job.createJob("bench", "user", "{}", "")
+            jobs.append(job.claimJob(job_["id"]))
+    context["setup"] = setup
+    return lambda i: job.updateJobResult(jobs[i]["id"], {"output": i}, jobs[i])
+
+def benchClaimJob(context):
+    jobs = []
+    def setup(count):
+        jobs.extend(job.createJob("bench", "user", "{}", "") for i in range(count))
+    context["setup"] = setup
+    return lambda i: job.claimJob(jobs[i]["id"])
+
+def benchSchedulerNextJob(context):
+    scheduler = JobScheduler(refreshInterval=60.0)
+    def setup(count):
+        for i in range(count):
+            job.createJob("bench", f"user{i % 4}", "{}", "", priority=["interactive", "normal", "batch"][i % 3])
+    context["setup"] = setup
+    return lambda i: scheduler.nextJob(names=["bench"])
+
+def benchGetJobs(context):
+    for i in range(context["setupJobs"]):
+        job.createJob("bench", "user", "{}", "")
+    return lambda i: job.getJobs()
+
+benchmarks = {
+    "createJob": benchCreateJob,
+    "createJob.memoized": benchCreateJobMemoized,
+    "findJob.pending": benchFindJob,
+    "findJob.finished": benchFindFinishedJob,
+    "setJob": benchSetJob,
+    "updateJobResult": benchUpdateJobResult,
+    "claimJob": benchClaimJob,
+    "scheduler.nextJob": benchSchedulerNextJob,
+    "getJobs": benchGetJobs,
+}
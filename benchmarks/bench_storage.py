@@ -0,0 +1,62 @@
+"""Storage and encoding benchmarks: MB/s of the storage helpers and the base64 helpers in uaimodal.utils."""
+import os
+import tempfile
+import uaimodal.api.firebase as firebase
+import uaimodal.api.sync as sync
+from uaimodal.utils import BytesToBase64, Base64ToBytes
+
+
+def benchSaveBytesToStorage(context):
+    data = os.urandom(context["payloadBytes"])
+    context["bytesPerCall"] = len(data)
+    return lambda i: firebase.saveBytesToStorage(data, f"bench/save/{i}.b64")
+
+def benchSaveStringToStorage(context):
+    data = os.urandom(context["payloadBytes"])
+    context["bytesPerCall"] = len(data)
+    return lambda i: firebase.saveStringToStorage(data, f"bench/string/{i}", public=False)
+
+def benchSaveContentToStorage(context):
+    payloads = [os.urandom(context["payloadBytes"]) for i in range(4)]
+    context["bytesPerCall"] = len(payloads[0])
+    return lambda i: firebase.saveContentToStorage(payloads[i % len(payloads)], ".bin", prefix="bench/content", signed=True)
+
+def benchSyncDirToStorage(context):
+    directory = tempfile.mkdtemp(prefix="uaimodal-bench-")
+    for i in range(32):
+        with open(os.path.join(directory, f"frame{i:04d}.png"), "wb") as f:
+            f.write(os.urandom(context["payloadBytes"] // 32))
+    sync.syncDirToStorage(directory, "bench/sync")
+    context["bytesPerCall"] = context["payloadBytes"]
+    # Rewrites one frame per call, so each sync uploads one file and skips the others without hashing them
+    def run(i):
+        with open(os.path.join(directory, f"frame{i % 32:04d}.png"), "wb") as f:
+            f.write(os.urandom(context["payloadBytes"] // 32))
+        sync.syncDirToStorage(directory, "bench/sync")
+    return run
+
+def benchGetStorageBytes(context):
+    data = os.urandom(context["payloadBytes"])
+    context["bytesPerCall"] = len(data)
+    firebase.saveStringToStorage(data, "bench/get", public=False)
+    return lambda i: firebase.getStorageBytes("bench/get")
+
+def benchBytesToBase64(context):
+    data = os.urandom(context["payloadBytes"])
+    context["bytesPerCall"] = len(data)
+    return lambda i: BytesToBase64(data)
+
+def benchBase64ToBytes(context):
+    data = BytesToBase64(os.urandom(context["payloadBytes"]))
+    context["bytesPerCall"] = len(data)
+    return lambda i: Base64ToBytes(data)
+
+benchmarks = {
+    "saveBytesToStorage": benchSaveBytesToStorage,
+    "saveStringToStorage": benchSaveStringToStorage,
+    "saveContentToStorage.repeat": benchSaveContentToStorage,
+    "syncDirToStorage.oneChanged": benchSyncDirToStorage,
+    "getStorageBytes": benchGetStorageBytes,
+    "utils.BytesToBase64": benchBytesToBase64,
+    "utils.Base64ToBytes": benchBase64ToBytes,
+}
@@ -0,0 +1,139 @@
+"""
+Runs the uaimodal benchmarks against a local MemoryBackend with a simulated round-trip time.
+
+    python benchmarks/run.py --rtt 0.005 --output results.json
+    python benchmarks/run.py --rtt 0.005 --compare results.json
+
+Results are written as JSON. With --compare, the run fails (exit code 1) if any benchmark makes more
+round-trips per call than the baseline, or if its throughput drops by more than --threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from uaimodal.api.backend import MemoryBackend, setBackend
+import bench_jobs
+import bench_storage
+
+suites = {
+    "jobs": bench_jobs.benchmarks,
+    "storage": bench_storage.benchmarks,
+}
+
+
+def runBenchmark(name, factory, rtt, iterations, setupJobs, payloadBytes) -> dict:
+    """
+    Runs one benchmark on a fresh backend.
+
+    Args:
+        name (str): The benchmark name.
+        factory (callable): Builds the benchmark. Called with a context dict and returns a callable taking the iteration index.
+        rtt (float): Simulated round-trip time in seconds.
+        iterations (int): Number of timed calls.
+        setupJobs (int): Number of jobs created before timing, for benchmarks that need a populated queue.
+        payloadBytes (int): Payload size for storage and encoding benchmarks.
+
+    Returns:
+        dict: The benchmark result.
+    """
+    # Setup runs without latency so only the timed calls pay for round-trips
+    backend = setBackend(MemoryBackend())
+    context = {"setupJobs": setupJobs, "payloadBytes": payloadBytes}
+    call = factory(context)
+    if "setup" in context:
+        context["setup"](iterations)
+    backend.latency = rtt
+    before = backend.calls.copy()
+    start = time.perf_counter()
+    for i in range(iterations):
+        call(i)
+    elapsed = time.perf_counter() - start
+    calls = backend.calls - before
+    result = {
+        "name": name,
+        "iterations": iterations,
+        "seconds": elapsed,
+        "opsPerSec": iterations / elapsed if elapsed > 0 else float("inf"),
+        "roundTripsPerCall": sum(calls.values()) / iterations,
+        "roundTrips": {key: value / iterations for key, value in sorted(calls.items())},
+    }
+    if "bytesPerCall" in context:
+        result["mbPerSec"] = context["bytesPerCall"] * iterations / elapsed / 1e6 if elapsed > 0 else float("inf")
+    return result
+
+def compareResults(results, baseline, threshold) -> list:
+    """
+    Compares results with a baseline run.
+
+    Args:
+        results (dict): The current results.
+        baseline (dict): The baseline results.
+        threshold (float): Allowed relative throughput drop, for example 0.2 for 20%.
+
+    Returns:
+        list: A description of each regression. Empty if there are none.
+    """
+    regressions = []
+    previous = {result["name"]: result for result in baseline["results"]}
+    for result in results["results"]:
+        if result["name"] not in previous:
+            continue
+        old = previous[result["name"]]
+        if result["roundTripsPerCall"] > old["roundTripsPerCall"]:
+            regressions.append(f"{result['name']}: {old['roundTripsPerCall']:.2f} -> {result['roundTripsPerCall']:.2f} round-trips per call")
+        if result["opsPerSec"] < old["opsPerSec"] * (1 - threshold):
+            regressions.append(f"{result['name']}: {old['opsPerSec']:.1f} -> {result['opsPerSec']:.1f} ops/sec")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the uaimodal job queue and storage paths.")
+    parser.add_argument("--suite", choices=list(suites), action="append", help="Suites to run. Defaults to all.")
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this string.")
+    parser.add_argument("--rtt", type=float, default=0.005, help="Simulated round-trip time in seconds.")
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--setup-jobs", type=int, default=100, help="Jobs created before timing queue benchmarks.")
+    parser.add_argument("--payload-bytes", type=int, default=1024 * 1024)
+    parser.add_argument("--output", help="Write the results as JSON to this path.")
+    parser.add_argument("--compare", help="Compare with a baseline results file and exit 1 on regression.")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative throughput drop when comparing.")
+    args = parser.parse_args()
+
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "rtt": args.rtt,
+        "iterations": args.iterations,
+        "results": [],
+    }
+    for suite in args.suite or list(suites):
+        for name, factory in suites[suite].items():
+            if args.filter not in name:
+                continue
+            result = runBenchmark(name, factory, args.rtt, args.iterations, args.setup_jobs, args.payload_bytes)
+            results["results"].append(result)
+            line = f"{name:<28} {result['opsPerSec']:>10.1f} ops/s {result['roundTripsPerCall']:>6.2f} rt/call"
+            if "mbPerSec" in result:
+                line += f" {result['mbPerSec']:>10.1f} MB/s"
+            print(line)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compareResults(results, baseline, args.threshold)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
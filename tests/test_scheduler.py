@@ -0,0 +1,26 @@
+from uaimodal.api.backend import MemoryBackend, setBackend
+from uaimodal.api import job
+from uaimodal.api.scheduler import JobScheduler
+
+
+def test_large_backlog_does_not_starve_other_users():
+    setBackend(MemoryBackend(latency=0))
+    for i in range(200):
+        job.createJob("render", "heavy", "{}", "")
+    for i in range(3):
+        job.createJob("render", "light", "{}", "")
+    scheduler = JobScheduler(fetchSize=50)
+    claimed = [scheduler.nextJob(names=["render"])["user"] for i in range(20)]
+    assert claimed.count("light") == 3
+    # Fair share alternates between the users while both have pending jobs
+    assert claimed[:6].count("light") == 3
+
+def test_user_weights_apply_behind_a_large_backlog():
+    setBackend(MemoryBackend(latency=0))
+    for i in range(200):
+        job.createJob("render", "heavy", "{}", "")
+    for i in range(50):
+        job.createJob("render", "studio", "{}", "")
+    scheduler = JobScheduler(fetchSize=50, userWeights={"studio": 3})
+    claimed = [scheduler.nextJob()["user"] for i in range(40)]
+    assert claimed.count("studio") == 30
@@ -1,3 +1,4 @@
 # from uaimodal import uaimodal, constants, datasets
 from .deploy import *
-from .api import *
\ No newline at end of file
+from .api import *
+from .worker import *
\ No newline at end of file
@@ -0,0 +1,106 @@
+"""
+Command line tools for uaimodal.
+
+    python -m uaimodal catalog list
+    python -m uaimodal catalog warm [--name NAME] [--rebuild]
+    python -m uaimodal catalog warm --python 3.11 --cuda 12.4 --no-ffmpeg
+    python -m uaimodal dockerfile app.py [--name uModal] [--output Dockerfile] [--allow-unexported]
+    python -m uaimodal jobs archive [--days 30] [--include-unstamped]
+    python -m uaimodal jobs stats [--window 3600] [--prometheus]
+    python -m uaimodal jobs metrics [--port 9100]
+    python -m uaimodal jobs rebuild-counters
+"""
+import argparse
+import json
+
+
+def catalogCommand(args):
+    from uaimodal.deploy import baseImageCatalog, registerBaseImage, warmBaseImages
+    names = args.name or None
+    if args.cuda is not None:
+        names = (names or []) + [registerBaseImage(python_version=args.python, cudaVersion=args.cuda, ffmpeg=not args.no_ffmpeg, firebase=not args.no_firebase)]
+    if args.action == "list":
+        for name in names or baseImageCatalog:
+            print(name, json.dumps(baseImageCatalog[name]))
+    elif args.action == "warm":
+        warmBaseImages(names, rebuild=args.rebuild)
+
+def dockerfileCommand(args):
+    import runpy
+    from uaimodal.deploy import UAIModal
+    namespace = runpy.run_path(args.app)
+    recipes = {name: value for name, value in namespace.items() if isinstance(value, UAIModal)}
+    if args.name is not None:
+        if args.name not in recipes:
+            raise SystemExit(f"{args.app} has no UAIModal object named {args.name}. Found {list(recipes)}")
+        uModal = recipes[args.name]
+    elif len(recipes) == 1:
+        uModal = list(recipes.values())[0]
+    else:
+        raise SystemExit(f"{args.app} defines {len(recipes)} UAIModal objects {list(recipes)}. Choose one with --name")
+    if args.output == "-":
+        print(uModal.toDockerfile(strict=not args.allow_unexported), end="")
+    else:
+        uModal.saveDockerfile(args.output, strict=not args.allow_unexported)
+        print(f"Wrote {args.output}. Build it with: DOCKER_BUILDKIT=1 docker build -f {args.output} .")
+
+def jobsCommand(args):
+    from uaimodal.api.archive import archiveFinishedJobs
+    from uaimodal.api.metrics import queueStats, formatPrometheus, startMetricsServer, rebuildQueueCounters
+    if args.action == "archive":
+        result = archiveFinishedJobs(retentionDays=args.days, batchSize=args.batch_size, includeUnstamped=args.include_unstamped)
+        print(f"Archived {result['archived']} jobs into {len(result['bundles'])} bundles")
+    elif args.action == "stats":
+        stats = queueStats(window=args.window)
+        if args.prometheus:
+            print(formatPrometheus(stats), end="")
+        else:
+            print(json.dumps(stats, indent=4))
+    elif args.action == "metrics":
+        import threading
+        server = startMetricsServer(port=args.port, window=args.window)
+        print(f"Serving queue metrics at http://localhost:{args.port}/metrics")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+    elif args.action == "rebuild-counters":
+        print(json.dumps(rebuildQueueCounters()))
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m uaimodal", description="uaimodal command line tools.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    catalog = commands.add_parser("catalog", help="List or build the shared base images.")
+    catalog.add_argument("action", choices=["list", "warm"])
+    catalog.add_argument("--name", action="append", help="Only this base image. Can be repeated. Defaults to the whole catalog.")
+    catalog.add_argument("--rebuild", action="store_true", help="Rebuild the images even if they are cached.")
+    catalog.add_argument("--python", default="3.11", help="Python version of an image to add to the catalog, used with --cuda.")
+    catalog.add_argument("--cuda", type=float, help="CUDA version of an image to add to the catalog, 0 for CPU.")
+    catalog.add_argument("--no-ffmpeg", action="store_true", help="Leave FFmpeg out of the image added with --cuda.")
+    catalog.add_argument("--no-firebase", action="store_true", help="Leave firebase_admin out of the image added with --cuda.")
+    catalog.set_defaults(handler=catalogCommand)
+
+    dockerfile = commands.add_parser("dockerfile", help="Export a UAIModal recipe as a Dockerfile with BuildKit cache mounts.")
+    dockerfile.add_argument("app", help="The Python file that builds the UAIModal object. Local paths are relative to the current directory.")
+    dockerfile.add_argument("--name", help="The variable holding the UAIModal object. Defaults to the only one in the file.")
+    dockerfile.add_argument("--output", "-o", default="Dockerfile", help="The Dockerfile path, or - for stdout.")
+    dockerfile.add_argument("--allow-unexported", action="store_true", help="Write the Dockerfile even if some steps, such as user functions, cannot be exported. They are left as comments.")
+    dockerfile.set_defaults(handler=dockerfileCommand)
+
+    jobs = commands.add_parser("jobs", help="Maintain the job collections.")
+    jobs.add_argument("action", choices=["archive", "stats", "metrics", "rebuild-counters"])
+    jobs.add_argument("--days", type=float, default=30, help="Archive finished jobs older than this many days.")
+    jobs.add_argument("--batch-size", type=int, default=240, help="Jobs per bundle upload and batched write.")
+    jobs.add_argument("--include-unstamped", action="store_true", help="Also archive jobs that finished before finishedAt was recorded.")
+    jobs.add_argument("--window", type=float, default=3600, help="Seconds of finished jobs that latencies and throughput are computed from.")
+    jobs.add_argument("--prometheus", action="store_true", help="Print the statistics in the Prometheus text format.")
+    jobs.add_argument("--port", type=int, default=9100, help="Port of the Prometheus /metrics endpoint.")
+    jobs.set_defaults(handler=jobsCommand)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
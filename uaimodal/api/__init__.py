@@ -1,2 +1,7 @@
 from .firebase import *
-from .job import *
\ No newline at end of file
+from .job import *
+from .batch import *
+from .archive import *
+from .scheduler import *
+from .metrics import *
+from .sync import *
\ No newline at end of file
@@ -0,0 +1,168 @@
+from uaimodal.api.firebase import getDoc, getCollection, queryCollection, batchWrite, getStorageBytes, saveFileObjectToStorage, maxBatchWrites
+from uaimodal.api.instrumentation import traced
+from uaimodal.api.job import getCounterOperations
+import io
+import gzip
+import json
+import time
+import uuid
+import datetime
+import functools
+
+# Where archive bundles are stored in the bucket, partitioned by the day the jobs finished
+archivePrefix = "archive/jobs"
+
+
+def getArchivePath(day, prefix=archivePrefix) -> str:
+    """
+    Returns a new bundle path for jobs that finished on `day`.
+
+    Args:
+        day (str): The day, as YYYY-MM-DD, or "unknown" for jobs without `finishedAt`.
+        prefix (str, optional): The bucket prefix. Defaults to archivePrefix.
+
+    Returns:
+        str: The bundle path, for example "archive/jobs/date=2024-05-01/<uuid>.jsonl.gz".
+    """
+    return f"{prefix}/date={day}/{uuid.uuid4().hex}.jsonl.gz"
+
+def encodeBundle(jobs) -> bytes:
+    """
+    Encodes jobs as gzipped JSON lines, one job per line.
+
+    Args:
+        jobs (list): The jobs.
+
+    Returns:
+        bytes: The bundle.
+    """
+    lines = "".join(json.dumps(job, separators=(",", ":"), default=str) + "\n" for job in jobs)
+    return gzip.compress(lines.encode("utf-8"))
+
+@functools.lru_cache(maxsize=8)
+def readArchiveBundle(path) -> tuple:
+    """
+    Downloads and decodes an archive bundle. The most recently read bundles are cached in memory, since
+    lookups of jobs that finished around the same time usually hit the same bundle.
+
+    Args:
+        path (str): The bundle path.
+
+    Returns:
+        tuple: The jobs of the bundle, in line order.
+    """
+    data = gzip.decompress(getStorageBytes(path))
+    return tuple(json.loads(line) for line in data.decode("utf-8").splitlines() if line != "")
+
+@traced
+def getArchivedJob(jobId) -> dict:
+    """
+    Retrieves an archived job from its bundle, using the `jobs_archived` index.
+
+    Args:
+        jobId (str): The ID of the job.
+
+    Returns:
+        dict: The job, or None if it was not archived.
+    """
+    entry = getDoc("jobs_archived", jobId)
+    if entry is None:
+        return None
+    return dict(readArchiveBundle(entry["bundle"])[entry["line"]])
+
+@traced
+def archiveFinishedJobs(retentionDays=30, batchSize=240, prefix=archivePrefix, includeUnstamped=False) -> dict:
+    """
+    Moves finished jobs older than the retention window out of `jobs_finished` into gzipped JSON lines
+    bundles in Storage, partitioned by the day the jobs finished.
+
+    Jobs are archived in batches of `batchSize`: one bundle upload per day in the batch, then one batched
+    write that removes the jobs from `jobs_finished` and adds a small `jobs_archived` index entry per job
+    (id, name, user, status, finishedAt and the bundle location). `getJobResults` reads archived jobs
+    back through that index. Bundles are uploaded before the jobs are removed, so an interrupted run
+    never loses a job; rerunning it archives the remaining jobs again.
+
+    Jobs are removed by their document ID, which differs from their `id` for jobs created by older versions.
+
+    Run it periodically, for example from a scheduled Modal function or `python -m uaimodal jobs archive`.
+
+    Args:
+        retentionDays (float, optional): Days a finished job stays in `jobs_finished`. Defaults to 30.
+        batchSize (int, optional): Jobs per batch. Firestore allows 500 writes per atomic batch, and each job takes 2,
+            plus one counter update per job name. Larger batches are written in several batches. Defaults to 240.
+        prefix (str, optional): The bucket prefix of the bundles. Defaults to archivePrefix.
+        includeUnstamped (bool, optional): Also archive jobs without `finishedAt`, which finished before it was recorded.
+            Reads the whole collection once. Defaults to False.
+
+    Returns:
+        dict: The number of archived jobs and the bundle paths.
+    """
+    cutoff = time.time() - retentionDays * 86400
+    archived = 0
+    bundles = []
+    while True:
+        jobs = queryCollection("jobs_finished", "finishedAt", "<", cutoff, orderBy="finishedAt", limit=batchSize, includeDocId=True)
+        if len(jobs) == 0:
+            break
+        bundles += archiveJobs(jobs, prefix)
+        archived += len(jobs)
+        if len(jobs) < batchSize:
+            break
+    if includeUnstamped:
+        jobs = [job for job in getCollection("jobs_finished", includeDocId=True) if "finishedAt" not in job]
+        for start in range(0, len(jobs), batchSize):
+            bundles += archiveJobs(jobs[start:start + batchSize], prefix)
+            archived += len(jobs[start:start + batchSize])
+    return {"archived": archived, "bundles": bundles}
+
+def archiveJobs(jobs, prefix=archivePrefix) -> list:
+    """
+    Archives a batch of finished jobs, see `archiveFinishedJobs`. The index entries, deletes and counter updates
+    are written in atomic batches of at most `maxBatchWrites`, after every bundle is uploaded.
+
+    Args:
+        jobs (list): The finished jobs, with their document ID in "docId". Defaults to the job's `id` if missing.
+        prefix (str, optional): The bucket prefix of the bundles. Defaults to archivePrefix.
+
+    Returns:
+        list: The bundle paths.
+    """
+    days = {}
+    for job in jobs:
+        job = dict(job)
+        docId = job.pop("docId", job["id"])
+        day = "unknown"
+        if "finishedAt" in job:
+            day = datetime.datetime.fromtimestamp(job["finishedAt"], datetime.timezone.utc).strftime("%Y-%m-%d")
+        days.setdefault(day, []).append((docId, job))
+    batches = [[]]
+    names = set()
+    bundles = []
+    for day, dayJobs in days.items():
+        path = getArchivePath(day, prefix)
+        saveFileObjectToStorage(io.BytesIO(encodeBundle([job for docId, job in dayJobs])), path, public=False)
+        bundles.append(path)
+        for line, (docId, job) in enumerate(dayJobs):
+            # Each job takes 2 writes, and each job name at most one counter update
+            if len(batches[-1]) > 0 and 2 * (len(batches[-1]) + 1) + len(names | {job.get("name", "")}) > maxBatchWrites:
+                batches.append([])
+                names = set()
+            batches[-1].append((docId, job, path, line))
+            names.add(job.get("name", ""))
+    for batch in batches:
+        operations = []
+        for docId, job, path, line in batch:
+            operations.append(("set", "jobs_archived", job["id"], {
+                "id": job["id"],
+                "name": job.get("name", ""),
+                "user": job.get("user", ""),
+                "status": job.get("status", ""),
+                "finishedAt": job.get("finishedAt", 0),
+                "bundle": path,
+                "line": line,
+            }))
+            operations.append(("delete", "jobs_finished", docId))
+        operations += getCounterOperations([(job.get("name", ""), "finished", None) for docId, job, path, line in batch])
+        if len(operations) > 0:
+            batchWrite(operations)
+    return bundles
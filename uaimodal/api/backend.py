@@ -0,0 +1,708 @@
+import os
+import copy
+import time
+import random
+import base64
+import hashlib
+import mimetypes
+import threading
+import uuid
+from collections import Counter
+from uaimodal.api.instrumentation import instrumented
+
+backend = None
+
+# Writes Firestore applies in one atomic batch
+maxBatchWrites = 500
+
+
+class Backend():
+    """
+    The storage interface used by `uaimodal.api.firebase`.
+
+    Every method maps to a single round-trip to the database or the storage bucket, except the transactional
+    ones noted below, so a backend can be swapped for a local stand-in without changing how many calls each
+    helper makes.
+
+    The round-trip methods of every subclass are wrapped automatically so they report to the hooks in
+    `uaimodal.api.instrumentation`.
+    """
+    # Round-trip methods and whether they read, write or delete
+    operationKinds = {
+        "getDoc": "read",
+        "getCollection": "read",
+        "queryCollection": "read",
+        "setDoc": "write",
+        "updateDoc": "write",
+        "incrementField": "write",
+        "unionField": "write",
+        "addDoc": "write",
+        "deleteDoc": "delete",
+        "moveDoc": "write",
+        "batchWrite": "write",
+        "uploadBlob": "write",
+        "downloadBlob": "read",
+        "downloadBlobToFile": "read",
+        "blobExists": "read",
+        "listBlobs": "read",
+        "deleteBlob": "delete",
+        "makeBlobPublic": "write",
+    }
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for name, kind in Backend.operationKinds.items():
+            if name in cls.__dict__:
+                setattr(cls, name, instrumented(name, kind)(cls.__dict__[name]))
+
+    def getDoc(self, collection, doc) -> dict:
+        """
+        Returns the document as a dict, or None if it does not exist.
+        """
+        raise NotImplementedError
+
+    def setDoc(self, collection, doc, data):
+        """
+        Replaces the document with `data`.
+        """
+        raise NotImplementedError
+
+    def updateDoc(self, collection, doc, data) -> bool:
+        """
+        Merges `data` into the fields of an existing document. Returns False, without creating it, if the document does not exist.
+        """
+        raise NotImplementedError
+
+    def incrementField(self, collection, doc, field, amount=1) -> int:
+        """
+        Atomically adds `amount` to a numeric field of an existing document, treating a missing field as 0.
+        Returns the new value, or None, without creating it, if the document does not exist. Concurrent
+        increments never get the same new value. Firestore runs it as a transaction: a read and a commit, two
+        round-trips, retried under contention.
+        """
+        raise NotImplementedError
+
+    def unionField(self, collection, doc, field, values) -> list:
+        """
+        Atomically adds the `values` that are not in it yet to a list field of an existing document, treating a
+        missing field as empty. Returns the list after the update, or None, without creating it, if the
+        document does not exist. Adding a value twice leaves the list unchanged. Firestore runs it as a
+        transaction: a read and a commit, two round-trips, retried under contention.
+        """
+        raise NotImplementedError
+
+    def addDoc(self, collection, data) -> str:
+        """
+        Creates a document with a generated ID and returns the ID.
+        """
+        raise NotImplementedError
+
+    def deleteDoc(self, collection, doc):
+        """
+        Deletes the document. Deleting a missing document is not an error.
+        """
+        raise NotImplementedError
+
+    def getCollection(self, collection, includeDocId=False) -> list:
+        """
+        Returns every document in the collection as a list of dicts. With `includeDocId`, each dict also holds
+        the document ID in "docId", which older documents do not always store in a field.
+        """
+        raise NotImplementedError
+
+    def queryCollection(self, collection, field, op, value, orderBy=None, limit=None, where=None, includeDocId=False) -> list:
+        """
+        Returns the documents of the collection where `field` `op` `value`, for example ("finishedAt", "<", cutoff),
+        optionally ordered by a field (ascending) and limited. `op` is one of "<", "<=", "==", "!=", ">=", ">", "in" and "not-in".
+        `where` is a list of further (field, op, value) conditions that must all match. Documents without a
+        queried field never match. `includeDocId` adds the document IDs, see `getCollection`.
+        """
+        raise NotImplementedError
+
+    def moveDoc(self, source, target, doc, data=None) -> dict:
+        """
+        Atomically moves a document from the `source` collection to the `target` collection, merging `data` into
+        its fields. Returns the moved document, or None if it is not in `source`, so of several concurrent moves
+        of the same document exactly one succeeds.
+        """
+        raise NotImplementedError
+
+    def batchWrite(self, operations):
+        """
+        Applies a list of ("set", collection, doc, data), ("delete", collection, doc) and
+        ("increment", collection, doc, field, amount, data) operations in order. An increment adds `amount`
+        to a numeric field without reading it, merges the optional `data` fields, and creates the document if
+        it does not exist. Up to `maxBatchWrites` operations are applied atomically; longer lists are committed
+        in consecutive batches of `maxBatchWrites`, each atomic on its own, one round-trip per batch.
+        """
+        raise NotImplementedError
+
+    def uploadBlob(self, path, data, public=False, cacheControl=None, contentType=None):
+        """
+        Uploads `data` (bytes, str or a readable file object) to `path`. With `public`, the blob is made publicly
+        readable by the upload itself, without a separate `makeBlobPublic` round-trip. `cacheControl` sets the
+        Cache-Control header served with the blob. `contentType` defaults to the type guessed from the extension
+        of `path`, see `getContentType`.
+        """
+        raise NotImplementedError
+
+    def blobExists(self, path) -> bool:
+        """
+        Returns True if a blob exists at `path`.
+        """
+        raise NotImplementedError
+
+    def listBlobs(self, prefix) -> list:
+        """
+        Returns the metadata of every blob whose path starts with `prefix`, as dicts with "path", "size",
+        "md5" and "crc32c" (base64 digests, as Cloud Storage reports them, or None) and "updated" (a timestamp).
+        Cloud Storage lists 1000 blobs per request.
+        """
+        raise NotImplementedError
+
+    def downloadBlob(self, path) -> bytes:
+        """
+        Returns the content of the blob at `path`.
+        """
+        raise NotImplementedError
+
+    def downloadBlobToFile(self, path, filename):
+        """
+        Streams the blob at `path` into the local file `filename`, replacing it.
+        """
+        raise NotImplementedError
+
+    def deleteBlob(self, path):
+        """
+        Deletes the blob at `path`.
+        """
+        raise NotImplementedError
+
+    def makeBlobPublic(self, path):
+        """
+        Makes the blob at `path` publicly readable.
+        """
+        raise NotImplementedError
+
+    def getBlobURL(self, path) -> str:
+        """
+        Returns the public URL of the blob at `path`. Does not make a round-trip.
+        """
+        raise NotImplementedError
+
+    def getSignedURL(self, path, expiration=3600, method="GET") -> str:
+        """
+        Returns a V4 signed URL that grants access to the blob at `path` for `expiration` seconds. The URL is
+        signed locally with the service account key and does not make a round-trip.
+        """
+        raise NotImplementedError
+
+    def getBlob(self, path):
+        """
+        Returns a blob object for `path` with the `google.cloud.storage.Blob` methods used by uaimodal.
+        """
+        raise NotImplementedError
+
+
+class FirestoreBackend(Backend):
+    """
+    The default backend, backed by Cloud Firestore and Cloud Storage through `firebase_admin`.
+    Also used for the Firestore and Storage emulators, see `useEmulator`.
+    """
+    def getDoc(self, collection, doc) -> dict:
+        from uaimodal.api.firebase import getDB
+        snapshot = getDB().collection(collection).document(doc).get()
+        if snapshot.exists:
+            return snapshot.to_dict()
+        return None
+
+    def setDoc(self, collection, doc, data):
+        from uaimodal.api.firebase import getDB
+        getDB().collection(collection).document(doc).set(data)
+
+    def updateDoc(self, collection, doc, data) -> bool:
+        from uaimodal.api.firebase import getDB
+        from google.api_core.exceptions import NotFound
+        try:
+            getDB().collection(collection).document(doc).update(data)
+        except NotFound:
+            return False
+        return True
+
+    def incrementField(self, collection, doc, field, amount=1) -> int:
+        from uaimodal.api.firebase import getDB
+        from google.cloud import firestore
+        db = getDB()
+        ref = db.collection(collection).document(doc)
+
+        # A transaction rather than firestore.Increment, so the caller learns the value its increment produced
+        @firestore.transactional
+        def increment(transaction):
+            snapshot = ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return None
+            value = (snapshot.to_dict().get(field) or 0) + amount
+            transaction.update(ref, {field: value})
+            return value
+        return increment(db.transaction())
+
+    def unionField(self, collection, doc, field, values) -> list:
+        from uaimodal.api.firebase import getDB
+        from google.cloud import firestore
+        db = getDB()
+        ref = db.collection(collection).document(doc)
+
+        # A transaction rather than firestore.ArrayUnion, so the caller learns the list its update produced
+        @firestore.transactional
+        def union(transaction):
+            snapshot = ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return None
+            current = list(snapshot.to_dict().get(field) or [])
+            current += [value for value in values if value not in current]
+            transaction.update(ref, {field: current})
+            return current
+        return union(db.transaction())
+
+    def addDoc(self, collection, data) -> str:
+        from uaimodal.api.firebase import getDB
+        return getDB().collection(collection).add(data)[1].id
+
+    def deleteDoc(self, collection, doc):
+        from uaimodal.api.firebase import getDB
+        getDB().collection(collection).document(doc).delete()
+
+    def getCollection(self, collection, includeDocId=False) -> list:
+        from uaimodal.api.firebase import getDB
+        return [{**doc.to_dict(), "docId": doc.id} if includeDocId else doc.to_dict() for doc in getDB().collection(collection).stream()]
+
+    def queryCollection(self, collection, field, op, value, orderBy=None, limit=None, where=None, includeDocId=False) -> list:
+        from uaimodal.api.firebase import getDB
+        query = getDB().collection(collection).where(field, op, value)
+        for condition in where or []:
+            query = query.where(*condition)
+        if orderBy is not None:
+            query = query.order_by(orderBy)
+        if limit is not None:
+            query = query.limit(limit)
+        return [{**doc.to_dict(), "docId": doc.id} if includeDocId else doc.to_dict() for doc in query.stream()]
+
+    def moveDoc(self, source, target, doc, data=None) -> dict:
+        from uaimodal.api.firebase import getDB
+        from google.cloud import firestore
+        db = getDB()
+        sourceRef = db.collection(source).document(doc)
+        targetRef = db.collection(target).document(doc)
+
+        @firestore.transactional
+        def move(transaction):
+            snapshot = sourceRef.get(transaction=transaction)
+            if not snapshot.exists:
+                return None
+            document = snapshot.to_dict()
+            document.update(data or {})
+            transaction.set(targetRef, document)
+            transaction.delete(sourceRef)
+            return document
+        return move(db.transaction())
+
+    def batchWrite(self, operations):
+        from uaimodal.api.firebase import getDB
+        db = getDB()
+        for start in range(0, len(operations), maxBatchWrites):
+            batch = db.batch()
+            for operation in operations[start:start + maxBatchWrites]:
+                doc_ref = db.collection(operation[1]).document(operation[2])
+                if operation[0] == "set":
+                    batch.set(doc_ref, operation[3])
+                elif operation[0] == "delete":
+                    batch.delete(doc_ref)
+                elif operation[0] == "increment":
+                    from google.cloud import firestore
+                    data = dict(operation[5]) if len(operation) > 5 else {}
+                    data[operation[3]] = firestore.Increment(operation[4])
+                    batch.set(doc_ref, data, merge=True)
+                else:
+                    raise ValueError(f"Unknown batch operation: {operation[0]}")
+            batch.commit()
+
+    def uploadBlob(self, path, data, public=False, cacheControl=None, contentType=None):
+        blob = self.getBlob(path)
+        if cacheControl is not None:
+            blob.cache_control = cacheControl
+        # The ACL is applied by the upload request, which saves the make_public round-trip
+        acl = "publicRead" if public else None
+        contentType = getContentType(path, data, contentType)
+        if hasattr(data, "read"):
+            blob.upload_from_file(data, content_type=contentType, predefined_acl=acl)
+        else:
+            blob.upload_from_string(data, content_type=contentType, predefined_acl=acl)
+
+    def blobExists(self, path) -> bool:
+        return self.getBlob(path).exists()
+
+    def listBlobs(self, prefix) -> list:
+        from uaimodal.api.firebase import getBucket
+        return [{
+            "path": blob.name,
+            "size": blob.size,
+            "md5": blob.md5_hash,
+            "crc32c": blob.crc32c,
+            "updated": blob.updated.timestamp() if blob.updated is not None else 0.0,
+        } for blob in getBucket().list_blobs(prefix=prefix)]
+
+    def downloadBlob(self, path) -> bytes:
+        return self.getBlob(path).download_as_bytes()
+
+    def downloadBlobToFile(self, path, filename):
+        self.getBlob(path).download_to_filename(filename)
+
+    def deleteBlob(self, path):
+        self.getBlob(path).delete()
+
+    def makeBlobPublic(self, path):
+        self.getBlob(path).make_public()
+
+    def getBlobURL(self, path) -> str:
+        return self.getBlob(path).public_url
+
+    def getSignedURL(self, path, expiration=3600, method="GET") -> str:
+        import datetime
+        return self.getBlob(path).generate_signed_url(version="v4", expiration=datetime.timedelta(seconds=expiration), method=method)
+
+    def getBlob(self, path):
+        from uaimodal.api.firebase import getBucket
+        return getBucket().blob(path)
+
+
+class MemoryBlob():
+    """
+    A blob stored in a `MemoryBackend`, with the subset of the `google.cloud.storage.Blob` API that uaimodal uses.
+    """
+    def __init__(self, backend, path):
+        self.backend = backend
+        self.name = path
+
+    @property
+    def public_url(self):
+        return self.backend.getBlobURL(self.name)
+
+    def exists(self):
+        return self.backend.blobExists(self.name)
+
+    def upload_from_string(self, data, content_type=None, predefined_acl=None):
+        self.backend.uploadBlob(self.name, data, public=predefined_acl == "publicRead", contentType=content_type)
+
+    def upload_from_file(self, file_obj, content_type=None, predefined_acl=None):
+        self.backend.uploadBlob(self.name, file_obj, public=predefined_acl == "publicRead", contentType=content_type)
+
+    def upload_from_filename(self, filename, content_type=None, predefined_acl=None):
+        with open(filename, "rb") as f:
+            self.backend.uploadBlob(self.name, f, public=predefined_acl == "publicRead", contentType=content_type)
+
+    def generate_signed_url(self, version="v4", expiration=3600, method="GET"):
+        seconds = expiration.total_seconds() if hasattr(expiration, "total_seconds") else expiration
+        return self.backend.getSignedURL(self.name, int(seconds), method)
+
+    def download_as_bytes(self):
+        return self.backend.downloadBlob(self.name)
+
+    def download_as_string(self):
+        return self.backend.downloadBlob(self.name)
+
+    def download_to_filename(self, filename):
+        with open(filename, "wb") as f:
+            f.write(self.backend.downloadBlob(self.name))
+
+    def make_public(self):
+        self.backend.makeBlobPublic(self.name)
+
+    def delete(self):
+        self.backend.deleteBlob(self.name)
+
+
+class MemoryBackend(Backend):
+    """
+    An in-process stand-in for Firestore and Storage, for tests, CI and benchmarks.
+
+    Documents are deep-copied on every read and write, like they would be serialized over the wire,
+    and each call can sleep for an injected latency to simulate a network round-trip. `calls` counts
+    the round-trips made per method.
+
+    Example:
+        >>> from uaimodal.api.backend import MemoryBackend, setBackend
+        >>> setBackend(MemoryBackend(latency=0.02, jitter=0.005))
+    """
+    def __init__(self, latency=0.0, jitter=0.0, bucket="memory-bucket"):
+        """
+        Args:
+            latency (float, optional): Seconds each call sleeps for. Defaults to 0.0.
+            jitter (float, optional): Extra random seconds, between 0 and `jitter`, added to each call. Defaults to 0.0.
+            bucket (str, optional): The bucket name used in blob URLs. Defaults to "memory-bucket".
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.bucket = bucket
+        self.collections = {}
+        self.blobs = {}
+        self.blobHeaders = {}
+        self.publicBlobs = set()
+        self.calls = Counter()
+        self.lock = threading.RLock()
+
+    def delay(self):
+        if self.latency > 0 or self.jitter > 0:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+    def call(self, name):
+        with self.lock:
+            self.calls[name] += 1
+        self.delay()
+
+    def reset(self):
+        """
+        Removes every document and blob and clears the call counts.
+        """
+        with self.lock:
+            self.collections = {}
+            self.blobs = {}
+            self.blobHeaders = {}
+            self.publicBlobs = set()
+            self.calls = Counter()
+
+    def getDoc(self, collection, doc) -> dict:
+        self.call("getDoc")
+        with self.lock:
+            data = self.collections.get(collection, {}).get(doc)
+            return copy.deepcopy(data)
+
+    def setDoc(self, collection, doc, data):
+        self.call("setDoc")
+        with self.lock:
+            self.collections.setdefault(collection, {})[doc] = copy.deepcopy(data)
+
+    def updateDoc(self, collection, doc, data) -> bool:
+        self.call("updateDoc")
+        with self.lock:
+            document = self.collections.get(collection, {}).get(doc)
+            if document is None:
+                return False
+            document.update(copy.deepcopy(data))
+            return True
+
+    def incrementField(self, collection, doc, field, amount=1) -> int:
+        self.call("incrementField")
+        with self.lock:
+            document = self.collections.get(collection, {}).get(doc)
+            if document is None:
+                return None
+            document[field] = (document.get(field) or 0) + amount
+            return document[field]
+
+    def unionField(self, collection, doc, field, values) -> list:
+        self.call("unionField")
+        with self.lock:
+            document = self.collections.get(collection, {}).get(doc)
+            if document is None:
+                return None
+            current = list(document.get(field) or [])
+            current += [value for value in copy.deepcopy(values) if value not in current]
+            document[field] = current
+            return copy.deepcopy(current)
+
+    def addDoc(self, collection, data) -> str:
+        self.call("addDoc")
+        doc = uuid.uuid4().hex[:20]
+        with self.lock:
+            self.collections.setdefault(collection, {})[doc] = copy.deepcopy(data)
+        return doc
+
+    def deleteDoc(self, collection, doc):
+        self.call("deleteDoc")
+        with self.lock:
+            self.collections.get(collection, {}).pop(doc, None)
+
+    def getCollection(self, collection, includeDocId=False) -> list:
+        self.call("getCollection")
+        with self.lock:
+            documents = copy.deepcopy(self.collections.get(collection, {}))
+        return [{**document, "docId": docId} if includeDocId else document for docId, document in documents.items()]
+
+    def queryCollection(self, collection, field, op, value, orderBy=None, limit=None, where=None, includeDocId=False) -> list:
+        self.call("queryCollection")
+        compare = {
+            "<": lambda a, b: a < b, "<=": lambda a, b: a <= b, "==": lambda a, b: a == b,
+            "!=": lambda a, b: a != b, ">=": lambda a, b: a >= b, ">": lambda a, b: a > b,
+            "in": lambda a, b: a in b, "not-in": lambda a, b: a not in b,
+        }
+        conditions = [(field, op, value)] + list(where or [])
+        with self.lock:
+            documents = [{**document, "docId": docId} if includeDocId else document
+                         for docId, document in self.collections.get(collection, {}).items()
+                         if all(name in document and compare[test](document[name], expected) for name, test, expected in conditions)]
+            if orderBy is not None:
+                documents = sorted([document for document in documents if orderBy in document], key=lambda document: document[orderBy])
+            if limit is not None:
+                documents = documents[:limit]
+            return copy.deepcopy(documents)
+
+    def moveDoc(self, source, target, doc, data=None) -> dict:
+        self.call("moveDoc")
+        with self.lock:
+            document = self.collections.get(source, {}).pop(doc, None)
+            if document is None:
+                return None
+            document.update(copy.deepcopy(data or {}))
+            self.collections.setdefault(target, {})[doc] = document
+            return copy.deepcopy(document)
+
+    def batchWrite(self, operations):
+        self.call("batchWrite")
+        with self.lock:
+            for operation in operations:
+                if operation[0] == "set":
+                    self.collections.setdefault(operation[1], {})[operation[2]] = copy.deepcopy(operation[3])
+                elif operation[0] == "delete":
+                    self.collections.get(operation[1], {}).pop(operation[2], None)
+                elif operation[0] == "increment":
+                    document = self.collections.setdefault(operation[1], {}).setdefault(operation[2], {})
+                    document.update(copy.deepcopy(operation[5]) if len(operation) > 5 else {})
+                    document[operation[3]] = (document.get(operation[3]) or 0) + operation[4]
+                else:
+                    raise ValueError(f"Unknown batch operation: {operation[0]}")
+
+    def uploadBlob(self, path, data, public=False, cacheControl=None, contentType=None):
+        self.call("uploadBlob")
+        contentType = getContentType(path, data, contentType)
+        if hasattr(data, "read"):
+            data = data.read()
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self.lock:
+            self.blobs[path] = bytes(data)
+            self.blobHeaders[path] = {"cacheControl": cacheControl, "contentType": contentType, "updated": time.time()}
+            if public:
+                self.publicBlobs.add(path)
+
+    def blobExists(self, path) -> bool:
+        self.call("blobExists")
+        with self.lock:
+            return path in self.blobs
+
+    def listBlobs(self, prefix) -> list:
+        self.call("listBlobs")
+        with self.lock:
+            blobs = [(path, data, self.blobHeaders.get(path, {})) for path, data in self.blobs.items() if path.startswith(prefix)]
+        return [{
+            "path": path,
+            "size": len(data),
+            "md5": base64.b64encode(hashlib.md5(data).digest()).decode("ascii"),
+            "crc32c": None,
+            "updated": headers.get("updated", 0.0),
+        } for path, data, headers in sorted(blobs, key=lambda blob: blob[0])]
+
+    def downloadBlob(self, path) -> bytes:
+        self.call("downloadBlob")
+        with self.lock:
+            if path not in self.blobs:
+                raise FileNotFoundError(f"No blob at {path}")
+            return self.blobs[path]
+
+    def downloadBlobToFile(self, path, filename):
+        self.call("downloadBlobToFile")
+        with self.lock:
+            if path not in self.blobs:
+                raise FileNotFoundError(f"No blob at {path}")
+            data = self.blobs[path]
+        with open(filename, "wb") as f:
+            f.write(data)
+
+    def deleteBlob(self, path):
+        self.call("deleteBlob")
+        with self.lock:
+            if path not in self.blobs:
+                raise FileNotFoundError(f"No blob at {path}")
+            self.blobs.pop(path)
+            self.blobHeaders.pop(path, None)
+            self.publicBlobs.discard(path)
+
+    def makeBlobPublic(self, path):
+        self.call("makeBlobPublic")
+        with self.lock:
+            self.publicBlobs.add(path)
+
+    def getBlobURL(self, path) -> str:
+        return f"https://storage.googleapis.com/{self.bucket}/{path}"
+
+    def getSignedURL(self, path, expiration=3600, method="GET") -> str:
+        return f"https://storage.googleapis.com/{self.bucket}/{path}?X-Goog-Algorithm=GOOG4-RSA-SHA256&X-Goog-Expires={int(expiration)}&X-Goog-Signature=memory"
+
+    def getBlob(self, path):
+        return MemoryBlob(self, path)
+
+
+def getContentType(path, data, contentType=None) -> str:
+    """
+    Returns the Content-Type of an upload: `contentType` if given, otherwise guessed from the extension of
+    `path`, otherwise "text/plain" for strings and "application/octet-stream" for bytes and file objects.
+    """
+    if contentType is not None:
+        return contentType
+    guessed = mimetypes.guess_type(path)[0]
+    if guessed is not None:
+        return guessed
+    return "text/plain" if isinstance(data, str) else "application/octet-stream"
+
+def setBackend(newBackend):
+    """
+    Sets the backend used by every helper in `uaimodal.api.firebase` and `uaimodal.api.job`.
+
+    Args:
+        newBackend (Backend): The backend to use.
+
+    Returns:
+        Backend: The backend that was set.
+    """
+    global backend
+    backend = newBackend
+    return backend
+
+def getBackend() -> Backend:
+    """
+    Returns the current backend. On first use the backend is chosen from the `UAIMODAL_BACKEND`
+    environment variable: "firestore" (the default) or "memory".
+
+    Returns:
+        Backend: The current backend.
+    """
+    global backend
+    if backend is None:
+        name = os.environ.get("UAIMODAL_BACKEND", "firestore")
+        if name == "memory":
+            backend = MemoryBackend(latency=float(os.environ.get("UAIMODAL_BACKEND_LATENCY", "0")))
+        elif name == "firestore":
+            backend = FirestoreBackend()
+        else:
+            raise ValueError(f"Unknown backend: {name}")
+    return backend
+
+def useEmulator(firestoreHost="localhost:8080", storageHost="localhost:9199", project="demo-uaimodal", bucket=None):
+    """
+    Points the Firestore backend at the Firebase Local Emulator Suite. Must be called before the first
+    Firebase call. No service account is needed.
+
+    Args:
+        firestoreHost (str, optional): The Firestore emulator host. Defaults to "localhost:8080".
+        storageHost (str, optional): The Storage emulator host. Set to None to keep using the real bucket. Defaults to "localhost:9199".
+        project (str, optional): The emulator project ID. Defaults to "demo-uaimodal".
+        bucket (str, optional): The bucket name. Defaults to "<project>.appspot.com".
+
+    Returns:
+        Backend: The Firestore backend.
+    """
+    os.environ["FIRESTORE_EMULATOR_HOST"] = firestoreHost
+    os.environ["GCLOUD_PROJECT"] = project
+    if storageHost is not None:
+        os.environ["STORAGE_EMULATOR_HOST"] = f"http://{storageHost}"
+    os.environ["UAIMODAL_FIREBASE_BUCKET"] = bucket if bucket is not None else f"{project}.appspot.com"
+    return setBackend(FirestoreBackend())
@@ -0,0 +1,149 @@
+import json
+import time
+from uaimodal.api.firebase import queryCollection
+from uaimodal.api.job import claimJob
+
+
+def getJobRequest(job) -> dict:
+    """
+    Returns the request of a job as a dict. Requests are usually stored as JSON strings.
+
+    Args:
+        job (dict): The job to read the request from.
+
+    Returns:
+        dict: The parsed request, or an empty dict if the request is not a JSON object.
+    """
+    request = job.get("request", "")
+    if isinstance(request, dict):
+        return request
+    try:
+        request = json.loads(request)
+    except (TypeError, ValueError):
+        return {}
+    if not isinstance(request, dict):
+        return {}
+    return request
+
+def getBatchKey(job, keyFields=[]) -> str:
+    """
+    Returns the compatibility key of a job. Jobs with the same key can run in the same batch.
+
+    Args:
+        job (dict): The job to compute the key for.
+        keyFields (list, optional): Request fields that must match for jobs to share a batch, for example ["size", "batch_size"]. Defaults to [].
+
+    Returns:
+        str: The compatibility key, made of the job name and the values of `keyFields`.
+    """
+    request = getJobRequest(job)
+    values = [request.get(field) for field in keyFields]
+    return json.dumps([job.get("name", "")] + values, sort_keys=True, default=str)
+
+
+class JobBatcher():
+    """
+    Groups compatible pending jobs into batches.
+
+    Jobs are compatible when they have the same `name` and the same values for `keyFields` in their
+    request. A batch is released as soon as `maxBatchSize` compatible jobs are pending, or once the
+    oldest job of a group has been waiting for `maxWait` seconds, whichever happens first.
+
+    Each poll reads only the `fetchSize` oldest pending jobs with one indexed query ordered by `createdAt`,
+    instead of the whole pending collection. Only jobs with a `createdAt`, which `createJob` sets, are seen.
+    Firestore needs a composite index on `jobs_pending` for (name, createdAt) when filtering by job name.
+
+    Example:
+        >>> batcher = JobBatcher(keyFields=["size", "batch_size"], maxBatchSize=8, maxWait=0.5)
+        >>> jobs = batcher.nextBatch()
+    """
+    def __init__(self, keyFields=[], maxBatchSize=8, maxWait=0.5, pollInterval=0.25, fetchSize=None):
+        """
+        Args:
+            keyFields (list, optional): Request fields that must match for jobs to share a batch. Defaults to [].
+            maxBatchSize (int, optional): Maximum number of jobs in a batch. Defaults to 8.
+            maxWait (float, optional): Maximum seconds to hold a job back while waiting for the batch to fill. Defaults to 0.5.
+            pollInterval (float, optional): Seconds between polls while a batch is filling. Defaults to 0.25.
+            fetchSize (int, optional): Oldest pending jobs read per poll. Raise it when many incompatible jobs are
+                pending at once. Defaults to None (maxBatchSize).
+        """
+        self.keyFields = keyFields
+        self.maxBatchSize = maxBatchSize
+        self.maxWait = maxWait
+        self.pollInterval = pollInterval
+        self.fetchSize = fetchSize if fetchSize is not None else maxBatchSize
+        self.firstSeen = {}
+
+    def fetchJobs(self, names=None) -> list:
+        """
+        Reads the oldest pending jobs.
+
+        Args:
+            names (list, optional): Only read jobs whose `name` is in this list. Defaults to None (any job).
+
+        Returns:
+            list: Up to `fetchSize` pending jobs, oldest first.
+        """
+        if names is not None:
+            return queryCollection("jobs_pending", "name", "in", names, orderBy="createdAt", limit=self.fetchSize)
+        return queryCollection("jobs_pending", "createdAt", ">=", 0, orderBy="createdAt", limit=self.fetchSize)
+
+    def groupJobs(self, jobs) -> dict:
+        """
+        Groups jobs by compatibility key.
+
+        Args:
+            jobs (list): The jobs to group.
+
+        Returns:
+            dict: A dictionary of compatibility key to list of jobs, in the order they were given.
+        """
+        groups = {}
+        for job in jobs:
+            groups.setdefault(getBatchKey(job, self.keyFields), []).append(job)
+        return groups
+
+    def nextBatch(self, names=None, stopEvent=None) -> list:
+        """
+        Waits for a batch of compatible jobs and claims it.
+
+        Args:
+            names (list, optional): Only batch jobs whose `name` is in this list. Defaults to None (any job).
+            stopEvent (threading.Event, optional): Returns an empty list without claiming anything once set. Defaults to None.
+
+        Returns:
+            list: The claimed jobs, or an empty list if no jobs are pending.
+        """
+        while True:
+            if stopEvent is not None and stopEvent.is_set():
+                return []
+            jobs = self.fetchJobs(names)
+            groups = self.groupJobs(jobs)
+            now = time.time()
+            # Forget groups that drained without being released by this batcher
+            self.firstSeen = {key: self.firstSeen.get(key, now) for key in groups}
+            if len(groups) == 0:
+                return []
+            ready = [key for key in groups
+                     if len(groups[key]) >= self.maxBatchSize or now - self.firstSeen[key] >= self.maxWait]
+            if len(ready) > 0:
+                # Release the group that has waited the longest
+                key = min(ready, key=lambda key: self.firstSeen[key])
+                if len(groups[key]) <= self.maxBatchSize:
+                    self.firstSeen.pop(key)
+                claimed = []
+                for job in groups[key]:
+                    if len(claimed) >= self.maxBatchSize:
+                        break
+                    claimedJob = claimJob(job["id"])
+                    if claimedJob is not None:
+                        claimed.append(claimedJob)
+                if len(claimed) > 0:
+                    return claimed
+                continue
+            wait = min(self.maxWait - (now - self.firstSeen[key]) for key in groups)
+            wait = max(min(wait, self.pollInterval), 0)
+            if stopEvent is not None:
+                stopEvent.wait(wait)
+            else:
+                time.sleep(wait)
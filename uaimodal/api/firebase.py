@@ -1,44 +1,157 @@
-from firebase_admin import credentials, initialize_app, storage, firestore
+import os
+import threading
 from uaimodal.utils import rootPath 
+from uaimodal.api.backend import getBackend, maxBatchWrites
+from uaimodal.api.instrumentation import traced
 cred = None
 
 db  = None
 
+app = None
 
-def initFirebase(servicePath="service.json" ,bucket = "bucket.appspot.com") :
+# Number of Firestore clients (each with its own gRPC channel) that getDB() rotates between
+clientPoolSize = int(os.environ.get("UAIMODAL_FIRESTORE_POOL_SIZE", "1"))
+
+# Bucket prefix of content-addressed uploads, see saveContentToStorage()
+contentPrefix = os.environ.get("UAIMODAL_CONTENT_PREFIX", "content")
+
+# Seconds a signed URL stays valid
+signedURLExpiration = int(os.environ.get("UAIMODAL_SIGNED_URL_EXPIRATION", "3600"))
+
+# Content-addressed blobs this process uploaded or found, so repeated outputs also skip the existence check
+_knownContent = set()
+_knownContentLock = threading.Lock()
+
+_clients = []
+_clientIndex = 0
+_bucket = None
+_clientPid = None
+_lock = threading.RLock()
+
+
+def _resetClients():
+    """
+    Drops the clients created by this process without closing them. Called in forked child processes,
+    where the parent's gRPC channels must not be used or closed.
+    """
+    global db, _clients, _clientIndex, _bucket, _clientPid, _lock
+    _lock = threading.RLock()
+    _clients = []
+    _clientIndex = 0
+    _bucket = None
+    _clientPid = None
+    db = None
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_resetClients)
+
+
+def initFirebase(servicePath=None ,bucket = None, poolSize = None) :
     """
     Initializes the Firebase connection and returns the Firestore client and credentials.
 
+    Safe to call more than once: if the Firebase app is already initialized (by this module or by any
+    other code in the process) it is reused instead of raising.
+
     Args:
-        servicePath (str, optional): The path to the service account JSON file. Defaults to "service.json".
-        bucket (str, optional): The storage bucket URL. Defaults to "bucket.appspot.com".
+        servicePath (str, optional): The path to the service account JSON file. Defaults to the `UAIMODAL_FIREBASE_SERVICE` environment variable, or "service.json".
+        bucket (str, optional): The storage bucket URL. Defaults to the `UAIMODAL_FIREBASE_BUCKET` environment variable, or "bucket.appspot.com".
+        poolSize (int, optional): The number of Firestore clients to rotate between. Defaults to None (keep the current size).
 
     Returns:
         db (google.cloud.firestore.Client): The Firestore client.
         cred (google.auth.credentials.Certificate): The Firebase credentials.
     """
-    global db
     global cred
+    global app
+    from firebase_admin import credentials, initialize_app, get_app
     
-    cred = credentials.Certificate(servicePath)
-    initialize_app(cred, {'storageBucket': bucket})
-    db = firestore.client()
-    return db, cred
+    with _lock:
+        if app is None:
+            try:
+                app = get_app()
+            except ValueError:
+                if servicePath is None:
+                    servicePath = os.environ.get("UAIMODAL_FIREBASE_SERVICE", "service.json")
+                if bucket is None:
+                    bucket = os.environ.get("UAIMODAL_FIREBASE_BUCKET", "bucket.appspot.com")
+                app = initialize_app(credentials.Certificate(servicePath), {'storageBucket': bucket})
+            cred = app.credential
+        if poolSize is not None:
+            setClientPoolSize(poolSize)
+    return getDB(), cred
+
+def setClientPoolSize(size):
+    """
+    Sets the number of Firestore clients getDB() rotates between. Each client owns its own gRPC
+    channel, so a larger pool spreads many concurrent threads over several connections. The default
+    of 1 keeps a single warm client shared by every thread.
+
+    Args:
+        size (int): The number of clients in the pool.
+
+    Returns:
+        None
+    """
+    global clientPoolSize, _clients, db
+    if size < 1:
+        raise ValueError("The client pool size must be at least 1")
+    with _lock:
+        clientPoolSize = size
+        _clients = _clients[:size]
+        if len(_clients) == 0:
+            db = None
+
+def _emulated() -> bool:
+    # The emulators need no service account, so the firebase_admin app is skipped entirely
+    return "FIRESTORE_EMULATOR_HOST" in os.environ
+
+def _clientArgs() -> dict:
+    if _emulated():
+        from google.auth.credentials import AnonymousCredentials
+        return {"project": os.environ.get("GCLOUD_PROJECT", "demo-uaimodal"), "credentials": AnonymousCredentials()}
+    return {"project": app.project_id, "credentials": app.credential.get_credential()}
+
+def _bucketName() -> str:
+    if _emulated():
+        return os.environ.get("UAIMODAL_FIREBASE_BUCKET", "bucket.appspot.com")
+    return app.options.get("storageBucket")
+
+def _createClient():
+    from google.cloud import firestore as gcfirestore
+    return gcfirestore.Client(**_clientArgs())
+
+def _checkProcess():
+    # Fallback for platforms without os.register_at_fork
+    if _clientPid is not None and _clientPid != os.getpid():
+        _resetClients()
 
 def getDB() :
     """
     Retrieves the Firebase database instance.
 
-    If the database instance is not initialized, it will be initialized by calling the `initFirebase` function.
+    If Firebase is not initialized, it will be initialized by calling the `initFirebase` function. Clients
+    are created once per process and shared by all threads; after a fork the child creates its own.
 
     Returns:
         The Firebase database instance.
 
     """
-    global db
-    if db is None:
-        initFirebase()
-    return db
+    global db, _clientIndex, _clientPid
+    _checkProcess()
+    if len(_clients) < clientPoolSize:
+        if app is None and not _emulated():
+            initFirebase()
+        with _lock:
+            while len(_clients) < clientPoolSize:
+                _clients.append(_createClient())
+            _clientPid = os.getpid()
+            db = _clients[0]
+    if clientPoolSize == 1:
+        return _clients[0]
+    with _lock:
+        _clientIndex = (_clientIndex + 1) % len(_clients)
+        return _clients[_clientIndex]
 
 def getCred():
     """
@@ -55,6 +168,27 @@ def getCred():
         initFirebase()
     return cred
 
+def getBucket():
+    """
+    Retrieves the default storage bucket. The storage client is created once per process and shared by all threads.
+
+    Returns:
+        google.cloud.storage.Bucket: The default storage bucket.
+    """
+    global _bucket, _clientPid
+    _checkProcess()
+    if _bucket is None:
+        if app is None and not _emulated():
+            initFirebase()
+        with _lock:
+            if _bucket is None:
+                from google.cloud import storage as gcstorage
+                client = gcstorage.Client(**_clientArgs())
+                _bucket = client.bucket(_bucketName())
+                _clientPid = os.getpid()
+    return _bucket
+
+@traced
 def upload_file_to_space(file_src, save_as, **kwargs):
     """
     :param spaces_client: Your DigitalOcean Spaces client from get_spaces_client()
@@ -64,14 +198,13 @@ def upload_file_to_space(file_src, save_as, **kwargs):
     :param kwargs
     :return:
     """
-    bucket = storage.bucket()
-    blob = bucket.blob(save_as)
-    blob.upload_from_filename(file_src)
-
-    # Opt : if you want to make public access from the URL
-    blob.make_public()
-    return blob.public_url 
+    backend = getBackend()
+    with open(file_src, "rb") as f:
+        # Opt : if you want to make public access from the URL
+        backend.uploadBlob(save_as, f, public=True)
+    return backend.getBlobURL(save_as)
 
+@traced
 def initDoc(collection) -> str:
     """
     Generate a new document in the collection and return the document ID. This is useful so you don't have to create the document id and possibly have duplicates.
@@ -82,11 +215,9 @@ def initDoc(collection) -> str:
     Returns:
         str: The ID of the newly created document.
     """
-    db = getDB()
-    doc_ref = db.collection(collection)
-    docID = doc_ref.add({"name":""}).id
-    return docID
+    return getBackend().addDoc(collection, {"name":""})
 
+@traced
 def getDoc(collection, doc) -> dict:
     """
     Retrieves a document from a specified collection in the Firebase database.
@@ -98,14 +229,9 @@ def getDoc(collection, doc) -> dict:
     Returns:
         dict: A dictionary representing the retrieved document, or None if the document does not exist.
     """
-    db = getDB()
-    doc_ref = db.collection(collection).document(doc)
-    doc = doc_ref.get()
-    if doc.exists:
-        return doc.to_dict()
-    else:
-        return None
+    return getBackend().getDoc(collection, doc)
     
+@traced
 def setDoc(collection, doc, data) -> dict:
     """
     Sets the data for a document in a collection in the Firebase Firestore database.
@@ -119,17 +245,103 @@ def setDoc(collection, doc, data) -> dict:
         dict: The updated document as a dictionary.
 
     """
-    db = getDB()
-    doc_ref = db.collection(collection).document(doc)
-    doc_ref.set(data)
-    doc_updated = doc_ref.get()
-    return doc_updated.to_dict()
+    backend = getBackend()
+    backend.setDoc(collection, doc, data)
+    return backend.getDoc(collection, doc)
     
-def getCollection(collection):
-    db = getDB()
-    docs = db.collection(collection).stream()
-    return [doc.to_dict() for doc in docs]
+@traced
+def updateDoc(collection, doc, data) -> bool:
+    """
+    Merges fields into an existing document with a single write, without reading it first.
+
+    Args:
+        collection (str): The name of the collection in which the document resides.
+        doc (str): The ID of the document to be updated.
+        data (dict): The fields to set. Other fields are left unchanged.
+
+    Returns:
+        bool: True if the document was updated, False if it does not exist.
+    """
+    return getBackend().updateDoc(collection, doc, data)
+
+@traced
+def incrementField(collection, doc, field, amount=1) -> int:
+    """
+    Atomically adds `amount` to a numeric field of an existing document. This is a transaction that reads the
+    document and then commits the update, so it takes two round-trips, more when it is retried under contention.
+    Use `batchWrite` with an "increment" operation when the new value is not needed.
+
+    Args:
+        collection (str): The name of the collection in which the document resides.
+        doc (str): The ID of the document.
+        field (str): The field to increment. A missing field counts as 0.
+        amount (int, optional): The amount to add. Defaults to 1.
+
+    Returns:
+        int: The value after this increment, or None if the document does not exist.
+    """
+    return getBackend().incrementField(collection, doc, field, amount)
+
+@traced
+def unionField(collection, doc, field, values) -> list:
+    """
+    Atomically adds values to a list field of an existing document. Values already in the list are not added again.
+    This is a transaction that reads the document and then commits the update, so it takes two round-trips,
+    more when it is retried under contention.
+
+    Args:
+        collection (str): The name of the collection in which the document resides.
+        doc (str): The ID of the document.
+        field (str): The list field. A missing field counts as empty.
+        values (list): The values to add.
+
+    Returns:
+        list: The list after this update, or None if the document does not exist.
+    """
+    return getBackend().unionField(collection, doc, field, values)
+
+@traced
+def getCollection(collection, includeDocId=False):
+    return getBackend().getCollection(collection, includeDocId)
+
+@traced
+def queryCollection(collection, field, op, value, orderBy=None, limit=None, where=None, includeDocId=False) -> list:
+    """
+    Retrieves the documents of a collection that match a condition, without reading the whole collection.
+
+    Args:
+        collection (str): The name of the collection.
+        field (str): The field to compare.
+        op (str): The comparison, one of "<", "<=", "==", "!=", ">=", ">", "in" and "not-in".
+        value (any): The value to compare with.
+        orderBy (str, optional): Sort the documents by this field, ascending. Defaults to None.
+        limit (int, optional): Maximum number of documents. Defaults to None.
+        where (list, optional): Further (field, op, value) conditions that must all match. Firestore needs a
+            composite index for most combinations. Defaults to None.
+        includeDocId (bool, optional): Adds the document ID to each dict as "docId". Defaults to False.
+
+    Returns:
+        list: The matching documents as dicts. Documents without a queried field never match.
+    """
+    return getBackend().queryCollection(collection, field, op, value, orderBy, limit, where, includeDocId)
+
+@traced
+def moveDoc(source, target, doc, data=None) -> dict:
+    """
+    Atomically moves a document to another collection with a single round-trip, for example to claim a job.
+
+    Args:
+        source (str): The collection the document is in.
+        target (str): The collection to move it to.
+        doc (str): The ID of the document.
+        data (dict, optional): Fields to set on the moved document. Defaults to None.
+
+    Returns:
+        dict: The moved document, or None if it is not in `source`, for example because another caller moved it first.
+    """
+    return getBackend().moveDoc(source, target, doc, data)
 
+@traced
 def deleteDoc(collection, doc):
     """
     Deletes a document from a specified collection in the Firebase Firestore database.
@@ -141,25 +353,74 @@ def deleteDoc(collection, doc):
     Returns:
         None
     """
-    db = getDB()
-    doc_ref = db.collection(collection).document(doc)
-    doc_ref.delete()
+    getBackend().deleteDoc(collection, doc)
     
-def getStorageURL(path):
+@traced
+def batchWrite(operations):
+    """
+    Applies several document writes in as few round-trips as possible using Firestore batched writes.
+    Up to `maxBatchWrites` (500) operations are applied atomically. Longer lists are committed in consecutive
+    batches of 500, each atomic on its own, so use `batchWriteGroups` when writes must stay together.
+
+    Args:
+        operations (list): A list of operations. Each item is a tuple of either:
+            - ("set", collection, doc, data): Sets the data for a document.
+            - ("delete", collection, doc): Deletes a document.
+            - ("increment", collection, doc, field, amount, data): Adds `amount` to a numeric field without reading
+              it, and merges the optional `data` fields. Creates the document if it does not exist.
+
+    Returns:
+        None
+    """
+    getBackend().batchWrite(operations)
+
+@traced
+def batchWriteGroups(groups):
     """
-    Retrieves the public URL of a file stored in the Firebase storage.
+    Applies groups of document writes, for example the writes that move one job, in as few batched writes as
+    possible without splitting a group across batches. Each group is applied atomically, and groups are
+    applied in order.
+
+    Args:
+        groups (list): Lists of operations, see `batchWrite`.
+
+    Returns:
+        None
+
+    Raises:
+        ValueError: If a group has more than `maxBatchWrites` operations.
+    """
+    batch = []
+    for group in groups:
+        if len(group) > maxBatchWrites:
+            raise ValueError(f"A group of {len(group)} writes does not fit in one batch of {maxBatchWrites}")
+        if len(batch) + len(group) > maxBatchWrites:
+            getBackend().batchWrite(batch)
+            batch = []
+        batch += group
+    if len(batch) > 0:
+        getBackend().batchWrite(batch)
+
+@traced
+def getStorageURL(path, signed=False, expiration=None):
+    """
+    Retrieves the URL of a file stored in the Firebase storage. Neither URL makes a round-trip.
 
     Args:
         path (str): The path of the file in the storage.
+        signed (bool, optional): Returns a V4 signed URL, which works for private files, instead of the public URL.
+                                 Signing needs service account credentials with a private key. Defaults to False.
+        expiration (int, optional): Seconds the signed URL stays valid. Defaults to None (signedURLExpiration).
 
     Returns:
-        str: The public URL of the file.
+        str: The URL of the file.
 
     """
-    bucket = storage.bucket()
-    blob = bucket.blob(path)
-    return blob.public_url
+    if signed:
+        return getBackend().getSignedURL(path, signedURLExpiration if expiration is None else expiration)
+    return getBackend().getBlobURL(path)
 
+@traced
 def getStorageBytes(path):
     """
     Retrieves the bytes of a file from the storage bucket.
@@ -171,10 +432,9 @@ def getStorageBytes(path):
         bytes: The bytes of the file.
 
     """
-    bucket = storage.bucket()
-    blob = bucket.blob(path)
-    return blob.download_as_bytes()
+    return getBackend().downloadBlob(path)
 
+@traced
 def getStorageText(path):
     """
     Retrieves the text content of a file from a storage bucket.
@@ -186,10 +446,9 @@ def getStorageText(path):
         str: The text content of the file.
 
     """
-    bucket = storage.bucket()
-    blob = bucket.blob(path)
-    return blob.download_as_string()
+    return getBackend().downloadBlob(path)
 
+@traced
 def getStorageJson(path):
     """
     Retrieves a JSON file from a storage bucket.
@@ -208,11 +467,10 @@ def getStorageJson(path):
         {'key1': 'value1', 'key2': 'value2'}
     """
     import json
-    bucket = storage.bucket()
-    blob = bucket.blob(path)
-    return json.loads(blob.download_as_string())
+    return json.loads(getBackend().downloadBlob(path))
 
-def saveStringToStorage(data, path, public=True):
+@traced
+def saveStringToStorage(data, path, public=True, cacheControl=None):
     """
     Saves a string to a storage bucket.
 
@@ -221,17 +479,15 @@ def saveStringToStorage(data, path, public=True):
         path (str): The path where the string data will be saved in the storage bucket.
         public (bool, optional): Determines whether the saved file should be publicly accessible. 
                                  Defaults to True.
+        cacheControl (str, optional): The Cache-Control header served with the file. Defaults to None.
 
     Returns:
         None
     """
-    bucket = storage.bucket()
-    blob = bucket.blob(path)
-    blob.upload_from_string(data)
-    if public:
-        blob.make_public()
+    getBackend().uploadBlob(path, data, public=public, cacheControl=cacheControl)
     
-def saveFileObjectToStorage(fileObject, path, public=True):
+@traced
+def saveFileObjectToStorage(fileObject, path, public=True, cacheControl=None):
     """
     Saves a file object to a storage bucket.
 
@@ -239,17 +495,15 @@ def saveFileObjectToStorage(fileObject, path, public=True):
         fileObject: The file object to be saved.
         path: The path where the file should be stored in the bucket.
         public: A boolean indicating whether the file should be made public (default is True).
+        cacheControl: The Cache-Control header served with the file (default is None).
 
     Returns:
         None
     """
-    bucket = storage.bucket()
-    blob = bucket.blob(path)
-    blob.upload_from_file(fileObject)
-    if public:
-        blob.make_public()
+    getBackend().uploadBlob(path, fileObject, public=public, cacheControl=cacheControl)
         
-def saveBytesToStorage(data, path, public=True):
+@traced
+def saveBytesToStorage(data, path, public=True, cacheControl=None):
     """
     Saves bytes data to a storage bucket.
 
@@ -257,18 +511,16 @@ def saveBytesToStorage(data, path, public=True):
         data: The bytes data to be saved.
         path: The path where the data will be stored in the bucket.
         public: A boolean indicating whether the stored data should be made public (default is True).
+        cacheControl: The Cache-Control header served with the data (default is None).
 
     Returns:
         None
     """
     from uaimodal.utils import BytesToBase64
-    bucket = storage.bucket()
-    blob = bucket.blob(path)
-    blob.upload_from_string(BytesToBase64(data))
-    if public:
-        blob.make_public()
+    getBackend().uploadBlob(path, BytesToBase64(data), public=public, cacheControl=cacheControl)
     
-def saveJsonToStorage(data, path, public=True):
+@traced
+def saveJsonToStorage(data, path, public=True, cacheControl=None):
     """
     Saves a JSON object to a storage bucket.
 
@@ -277,17 +529,82 @@ def saveJsonToStorage(data, path, public=True):
         path (str): The path to the storage bucket where the JSON object will be saved.
         public (bool, optional): Specifies whether the saved JSON object should be made public. 
                                  Defaults to True.
+        cacheControl (str, optional): The Cache-Control header served with the JSON object. Defaults to None.
 
     Returns:
         None
     """
     import json
-    bucket = storage.bucket()
-    blob = bucket.blob(path)
-    blob.upload_from_string(json.dumps(data))
-    if public:
-        blob.make_public()
+    getBackend().uploadBlob(path, json.dumps(data), public=public, cacheControl=cacheControl)
+
+def getContentHash(data) -> str:
+    """
+    Returns the SHA-256 hex digest of bytes, a string (UTF-8) or a readable binary file object. A file object
+    is read in chunks and rewound.
+    """
+    import hashlib
+    digest = hashlib.sha256()
+    if hasattr(data, "read"):
+        start = data.tell()
+        for chunk in iter(lambda: data.read(1 << 20), b""):
+            digest.update(chunk)
+        data.seek(start)
+    else:
+        digest.update(data.encode("utf-8") if isinstance(data, str) else data)
+    return digest.hexdigest()
+
+@traced
+def saveContentToStorage(data, extension="", prefix=None, public=False, signed=False, expiration=None, cacheControl=None, contentType=None) -> dict:
+    """
+    Saves data under a path derived from its SHA-256 hash, `<prefix>/<hash><extension>`, and skips the upload
+    when that path already exists. Identical outputs are stored once: a repeat costs one existence check, or
+    no round-trip at all when this process already uploaded or found the same content.
+
+    Content-addressed files never change, so they are served with an immutable Cache-Control header by
+    default and CDNs and browsers can cache them indefinitely. A public file is made public by the upload
+    itself. Keep public and private content under different prefixes, since a repeat is never re-uploaded
+    and keeps the visibility of its first upload.
+
+    Args:
+        data (bytes, str or file object): The content. A file object must be opened in binary mode and seekable.
+        extension (str, optional): Appended to the hash, for example ".mp4". Defaults to "".
+        prefix (str, optional): The bucket prefix. Defaults to None (contentPrefix).
+        public (bool, optional): Makes the file publicly readable and returns its public URL. Defaults to False.
+        signed (bool, optional): Returns a V4 signed URL, generated locally without a round-trip. Defaults to False.
+        expiration (int, optional): Seconds the signed URL stays valid. Defaults to None (signedURLExpiration).
+        cacheControl (str, optional): The Cache-Control header. Defaults to None ("public" or "private", max-age of a year, immutable).
+        contentType (str, optional): The Content-Type header. Defaults to None.
+
+    Returns:
+        dict: The "path" and "hash" of the file, whether it was "uploaded" by this call, and its "url"
+            (signed if `signed`, public if `public`, otherwise None).
+
+    Example:
+        >>> saved = saveContentToStorage(videoBytes, ".mp4", signed=True)
+        >>> saved["url"]
+    """
+    backend = getBackend()
+    contentHash = getContentHash(data)
+    path = f"{contentPrefix if prefix is None else prefix}/{contentHash}{extension}"
+    if cacheControl is None:
+        cacheControl = f"{'public' if public else 'private'}, max-age=31536000, immutable"
+    key = (id(backend), path)
+    with _knownContentLock:
+        known = key in _knownContent
+    uploaded = False
+    if not known and not backend.blobExists(path):
+        backend.uploadBlob(path, data, public=public, cacheControl=cacheControl, contentType=contentType)
+        uploaded = True
+    with _knownContentLock:
+        _knownContent.add(key)
+    url = None
+    if signed:
+        url = backend.getSignedURL(path, signedURLExpiration if expiration is None else expiration)
+    elif public:
+        url = backend.getBlobURL(path)
+    return {"path": path, "hash": contentHash, "uploaded": uploaded, "url": url}
         
+@traced
 def deleteStorage(path):
     """
     Deletes a file from the Firebase storage.
@@ -298,10 +615,12 @@ def deleteStorage(path):
     Returns:
         None
     """
-    bucket = storage.bucket()
-    blob = bucket.blob(path)
-    blob.delete()
+    backend = getBackend()
+    backend.deleteBlob(path)
+    with _knownContentLock:
+        _knownContent.discard((id(backend), path))
     
+@traced
 def getStorageBlob(path):
     """
     Retrieves a storage blob from the default bucket.
@@ -313,8 +632,7 @@ def getStorageBlob(path):
         Blob: The storage blob object.
 
     """
-    bucket = storage.bucket()
-    return bucket.blob(path)
+    return getBackend().getBlob(path)
 
 
     
\ No newline at end of file
@@ -0,0 +1,362 @@
+import os
+import json
+import time
+import threading
+import functools
+
+hooks = []
+
+collector = None
+
+_local = threading.local()
+
+
+def addHook(before=None, after=None):
+    """
+    Registers callables that are called around every backend round-trip.
+
+    Both are called with the same event dict. `before` receives it with the operation details filled in,
+    `after` receives it once the call has returned or raised, with the following keys:
+        - operation (str): The backend method, for example "getDoc" or "uploadBlob".
+        - kind (str): "read", "write" or "delete".
+        - target (str): The collection or blob path.
+        - call (str): The outermost traced API call the round-trip belongs to, for example "setJob", or None.
+        - seconds (float): The call latency.
+        - documents (int): The number of documents read or written.
+        - bytesIn (int): Bytes downloaded, for storage reads.
+        - bytesOut (int): Bytes uploaded, for storage writes.
+        - error (str): The exception class name if the call raised, otherwise None.
+
+    Args:
+        before (callable, optional): Called before the round-trip. Defaults to None.
+        after (callable, optional): Called after the round-trip. Defaults to None.
+
+    Returns:
+        tuple: The registered (before, after) pair, to pass to `removeHook`.
+    """
+    hook = (before, after)
+    hooks.append(hook)
+    return hook
+
+def removeHook(hook):
+    """
+    Unregisters a hook returned by `addHook`.
+
+    Args:
+        hook (tuple): The (before, after) pair returned by `addHook`.
+
+    Returns:
+        None
+    """
+    if hook in hooks:
+        hooks.remove(hook)
+
+def currentCall() -> str:
+    """
+    Returns:
+        str: The name of the outermost traced API call running on this thread, or None.
+    """
+    stack = getattr(_local, "stack", None)
+    if not stack:
+        return None
+    return stack[0]
+
+def traced(function):
+    """
+    Decorator that attributes the backend round-trips made inside `function` to its name, so the
+    collector can report how many round-trips each API call costs.
+    """
+    name = function.__name__
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(name)
+        outermost = len(stack) == 1
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stack.pop()
+            if outermost and collector is not None:
+                collector.recordCall(name, time.perf_counter() - start)
+    return wrapper
+
+def _size(value) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if hasattr(value, "read"):
+        # The bytes left to read, which is what an upload of the file object sends
+        try:
+            position = value.tell()
+            end = value.seek(0, os.SEEK_END)
+            value.seek(position)
+            return end - position
+        except (AttributeError, OSError, ValueError):
+            pass
+        try:
+            return os.fstat(value.fileno()).st_size
+        except (AttributeError, OSError, ValueError):
+            return 0
+    return 0
+
+def _documentsWritten(operation, args) -> int:
+    if operation == "batchWrite":
+        return len(args[0])
+    if operation in ["setDoc", "updateDoc", "incrementField", "unionField", "addDoc", "deleteDoc"]:
+        return 1
+    if operation == "moveDoc":
+        return 2
+    return 0
+
+def _documentsRead(operation, result) -> int:
+    if operation in ["getCollection", "queryCollection", "listBlobs"]:
+        return len(result)
+    if operation == "getDoc":
+        return 1
+    return 0
+
+def instrumented(operation, kind):
+    """
+    Decorator for backend methods. Emits an event to the registered hooks for every call.
+
+    Args:
+        operation (str): The operation name reported in events.
+        kind (str): "read", "write" or "delete".
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(self, *args, **kwargs):
+            if len(hooks) == 0:
+                return function(self, *args, **kwargs)
+            event = {
+                "operation": operation,
+                "kind": kind,
+                "target": str(args[0]) if len(args) > 0 and not isinstance(args[0], list) else "",
+                "call": currentCall(),
+                "seconds": 0.0,
+                "documents": _documentsWritten(operation, args),
+                "bytesIn": 0,
+                "bytesOut": _size(args[1]) if operation == "uploadBlob" and len(args) > 1 else 0,
+                "error": None,
+            }
+            for before, after in list(hooks):
+                if before is not None:
+                    before(event)
+            start = time.perf_counter()
+            try:
+                result = function(self, *args, **kwargs)
+                event["documents"] += _documentsRead(operation, result)
+                if operation == "downloadBlob":
+                    event["bytesIn"] = _size(result)
+                elif operation == "downloadBlobToFile" and len(args) > 1:
+                    event["bytesIn"] = os.path.getsize(args[1])
+                return result
+            except Exception as error:
+                event["error"] = type(error).__name__
+                raise
+            finally:
+                event["seconds"] = time.perf_counter() - start
+                for before, after in list(hooks):
+                    if after is not None:
+                        after(event)
+        return wrapper
+    return decorator
+
+
+def _percentile(samples, fraction) -> float:
+    if len(samples) == 0:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+class MemoryCollector():
+    """
+    Collects backend events in memory: counts, errors, documents, bytes and latencies per operation,
+    and round-trips per traced API call.
+
+    Example:
+        >>> collector = enableCollector()
+        >>> createJob("sadtalker", "user", "{}", "")
+        >>> print(formatReport())
+    """
+    def __init__(self, maxSamples=10000):
+        """
+        Args:
+            maxSamples (int, optional): Maximum latency samples kept per operation. Defaults to 10000.
+        """
+        self.maxSamples = maxSamples
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Clears everything collected so far.
+        """
+        with self.lock:
+            self.operations = {}
+            self.calls = {}
+
+    def after(self, event):
+        with self.lock:
+            stats = self.operations.setdefault(event["operation"], {
+                "kind": event["kind"], "count": 0, "errors": 0, "documents": 0,
+                "bytesIn": 0, "bytesOut": 0, "seconds": 0.0, "samples": [],
+            })
+            stats["count"] += 1
+            stats["errors"] += 1 if event["error"] is not None else 0
+            stats["documents"] += event["documents"]
+            stats["bytesIn"] += event["bytesIn"]
+            stats["bytesOut"] += event["bytesOut"]
+            stats["seconds"] += event["seconds"]
+            if len(stats["samples"]) < self.maxSamples:
+                stats["samples"].append(event["seconds"])
+            if event["call"] is not None:
+                call = self.calls.setdefault(event["call"], {"count": 0, "roundTrips": 0, "seconds": 0.0})
+                call["roundTrips"] += 1
+
+    def recordCall(self, name, seconds):
+        with self.lock:
+            call = self.calls.setdefault(name, {"count": 0, "roundTrips": 0, "seconds": 0.0})
+            call["count"] += 1
+            call["seconds"] += seconds
+
+    def report(self) -> dict:
+        """
+        Returns:
+            dict: A summary with an "operations" entry per backend operation (count, errors, documents,
+                bytes, mean and percentile latencies in milliseconds) and a "calls" entry per traced API
+                call (count, round-trips per call, mean latency).
+        """
+        with self.lock:
+            operations = {}
+            for name, stats in self.operations.items():
+                samples = stats["samples"]
+                operations[name] = {
+                    "kind": stats["kind"],
+                    "count": stats["count"],
+                    "errors": stats["errors"],
+                    "documents": stats["documents"],
+                    "bytesIn": stats["bytesIn"],
+                    "bytesOut": stats["bytesOut"],
+                    "meanMs": stats["seconds"] / stats["count"] * 1000,
+                    "p50Ms": _percentile(samples, 0.50) * 1000,
+                    "p95Ms": _percentile(samples, 0.95) * 1000,
+                    "p99Ms": _percentile(samples, 0.99) * 1000,
+                }
+            calls = {}
+            for name, call in self.calls.items():
+                count = max(call["count"], 1)
+                calls[name] = {
+                    "count": call["count"],
+                    "roundTripsPerCall": call["roundTrips"] / count,
+                    "meanMs": call["seconds"] / count * 1000,
+                }
+            totals = {
+                "reads": sum(stats["count"] for stats in self.operations.values() if stats["kind"] == "read"),
+                "writes": sum(stats["count"] for stats in self.operations.values() if stats["kind"] == "write"),
+                "deletes": sum(stats["count"] for stats in self.operations.values() if stats["kind"] == "delete"),
+                "documents": sum(stats["documents"] for stats in self.operations.values()),
+                "bytesIn": sum(stats["bytesIn"] for stats in self.operations.values()),
+                "bytesOut": sum(stats["bytesOut"] for stats in self.operations.values()),
+            }
+            return {"totals": totals, "operations": operations, "calls": calls}
+
+
+def enableCollector(maxSamples=10000) -> MemoryCollector:
+    """
+    Installs the built-in in-memory collector, replacing any previous one.
+
+    Args:
+        maxSamples (int, optional): Maximum latency samples kept per operation. Defaults to 10000.
+
+    Returns:
+        MemoryCollector: The installed collector.
+    """
+    global collector
+    disableCollector()
+    collector = MemoryCollector(maxSamples)
+    collector.hook = addHook(after=collector.after)
+    return collector
+
+def disableCollector():
+    """
+    Removes the built-in collector.
+    """
+    global collector
+    if collector is not None:
+        removeHook(collector.hook)
+        collector = None
+
+def report() -> dict:
+    """
+    Returns the built-in collector's summary, see `MemoryCollector.report`.
+
+    Returns:
+        dict: The summary, or an empty dict if the collector is not enabled.
+    """
+    if collector is None:
+        return {}
+    return collector.report()
+
+def formatReport() -> str:
+    """
+    Returns the built-in collector's summary as a human readable table.
+
+    Returns:
+        str: The formatted summary.
+    """
+    summary = report()
+    if summary == {}:
+        return "Instrumentation collector is not enabled"
+    lines = [json.dumps(summary["totals"])]
+    lines.append(f"{'operation':<16}{'kind':<8}{'count':>8}{'errors':>8}{'docs':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in sorted(summary["operations"].items()):
+        lines.append(f"{name:<16}{stats['kind']:<8}{stats['count']:>8}{stats['errors']:>8}{stats['documents']:>8}{stats['p50Ms']:>10.2f}{stats['p95Ms']:>10.2f}{stats['p99Ms']:>10.2f}")
+    lines.append(f"{'call':<24}{'count':>8}{'rt/call':>10}{'mean ms':>10}")
+    for name, call in sorted(summary["calls"].items()):
+        lines.append(f"{name:<24}{call['count']:>8}{call['roundTripsPerCall']:>10.2f}{call['meanMs']:>10.2f}")
+    return "\n".join(lines)
+
+def enableOpenTelemetry(tracer=None):
+    """
+    Emits an OpenTelemetry span for every backend round-trip. Requires the `opentelemetry-api` package.
+
+    Args:
+        tracer (opentelemetry.trace.Tracer, optional): The tracer to use. Defaults to a tracer named "uaimodal".
+
+    Returns:
+        tuple: The registered hook, to pass to `removeHook`.
+    """
+    from opentelemetry import trace
+    if tracer is None:
+        tracer = trace.get_tracer("uaimodal")
+    spans = threading.local()
+
+    def before(event):
+        span = tracer.start_span(f"firebase.{event['operation']}", attributes={
+            "uaimodal.kind": event["kind"],
+            "uaimodal.target": event["target"],
+            "uaimodal.call": event["call"] or "",
+        })
+        if not hasattr(spans, "stack"):
+            spans.stack = []
+        spans.stack.append(span)
+
+    def after(event):
+        span = spans.stack.pop()
+        span.set_attribute("uaimodal.documents", event["documents"])
+        span.set_attribute("uaimodal.bytes_in", event["bytesIn"])
+        span.set_attribute("uaimodal.bytes_out", event["bytesOut"])
+        if event["error"] is not None:
+            span.set_status(trace.Status(trace.StatusCode.ERROR, event["error"]))
+        span.end()
+
+    return addHook(before=before, after=after)
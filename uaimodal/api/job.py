@@ -1,13 +1,57 @@
-from uaimodal.api.firebase import getDoc, setDoc, deleteDoc, getCollection, initDoc
+from uaimodal.api.firebase import getDoc, setDoc, updateDoc, incrementField, unionField, moveDoc, deleteDoc, getCollection, queryCollection, initDoc, batchWrite, batchWriteGroups
+from uaimodal.api.instrumentation import traced
+import os
+import json
+import time
 import uuid
+import random
+import hashlib
+import threading
+import traceback
+
+# Whether createJob reuses the results of identical requests, see setJobMemoization
+memoizeJobs = os.environ.get("UAIMODAL_MEMOIZE_JOBS", "") == "1"
+
+# Seconds a finished result is reused for
+memoizeTTL = float(os.environ.get("UAIMODAL_MEMOIZE_TTL", "86400"))
+
+# Whether job state changes update the depth counters in jobs_counters, see setQueueMetrics
+queueMetrics = os.environ.get("UAIMODAL_QUEUE_METRICS", "") == "1"
+
+# Counter documents per state and job name. Firestore sustains about one write per second per document
+counterShards = int(os.environ.get("UAIMODAL_COUNTER_SHARDS", "8"))
+
+# Where the stages of a pipeline write their outputs in the bucket, see createPipeline
+pipelinePrefix = "pipelines"
+
+# Priority classes, most urgent first. Lower values are scheduled first, see uaimodal.api.scheduler
+priorityClasses = {"interactive": 0, "normal": 1, "batch": 2}
+
 jobSchema = {
     "id":{"type":"string", "required":True, "unique":True, "default": "","options":[]},
     "name":{"type":"string", "required":False, "unique":False, "default": "","options":[]},
     "user":{"type":"string", "required":False, "unique":False, "default": "","options":[]},
     "request":{"type":"string", "required":False, "unique":False, "default": "","options":[]},
     "result":{"type":"string", "required":False, "unique":False, "default": "","options":[]},
-    "status":{"type":"string", "required":False, "unique":False, "default": "idle", "options":["idle","pending", "running", "finished", "error"]},
+    "status":{"type":"string", "required":False, "unique":False, "default": "idle", "options":["idle","waiting","pending", "running", "finished", "error", "cancelled"]},
     "messages":{"type":"string", "required":False, "unique":False, "default": "","options":[]},
+    "progress":{"type":"number", "required":False, "unique":False, "default": 0,"options":[]},
+    "finishedAt":{"type":"number", "required":False, "unique":False, "default": 0,"options":[]},
+    "signal":{"type":"string", "required":False, "unique":False, "default": "","options":["", "cancel", "preempt"]},
+    "cancelReason":{"type":"string", "required":False, "unique":False, "default": "","options":[]},
+    "createdAt":{"type":"number", "required":False, "unique":False, "default": 0,"options":[]},
+    "queuedAt":{"type":"number", "required":False, "unique":False, "default": 0,"options":[]},
+    "startedAt":{"type":"number", "required":False, "unique":False, "default": 0,"options":[]},
+    "priority":{"type":"number", "required":False, "unique":False, "default": 1,"options":[0, 1, 2]},
+    "parentId":{"type":"string", "required":False, "unique":False, "default": "","options":[]},
+    "shardIndex":{"type":"number", "required":False, "unique":False, "default": 0,"options":[]},
+    "shardCount":{"type":"number", "required":False, "unique":False, "default": 0,"options":[]},
+    "shardsDone":{"type":"number", "required":False, "unique":False, "default": 0,"options":[]},
+    "pipelineId":{"type":"string", "required":False, "unique":False, "default": "","options":[]},
+    "stage":{"type":"string", "required":False, "unique":False, "default": "","options":[]},
+    "outputPath":{"type":"string", "required":False, "unique":False, "default": "","options":[]},
+    "dependsOn":{"type":"array", "required":False, "unique":False, "default": [],"options":[]},
+    "dependents":{"type":"array", "required":False, "unique":False, "default": [],"options":[]},
 }
 
 def getJobSchema() -> dict:
@@ -20,6 +64,170 @@ def getJobSchema() -> dict:
     """
     return jobSchema
 
+def getPriority(priority) -> int:
+    """
+    Returns the numeric priority of a priority class.
+
+    Args:
+        priority (str or int): A class of priorityClasses ("interactive", "normal" or "batch"), or a numeric priority.
+
+    Returns:
+        int: The priority. Lower values are scheduled first.
+    """
+    if isinstance(priority, str):
+        if priority not in priorityClasses:
+            raise ValueError(f"Unknown priority class {priority}, expected one of {list(priorityClasses)}")
+        return priorityClasses[priority]
+    return int(priority)
+
+def setJobMemoization(enabled=True, ttl=None):
+    """
+    Enables or disables request memoization for every `createJob` call that does not set `memoize` itself.
+
+    Args:
+        enabled (bool, optional): Whether identical requests reuse finished or in-flight jobs. Defaults to True.
+        ttl (float, optional): Seconds a finished result is reused for. Defaults to None (unchanged).
+
+    Returns:
+        None
+    """
+    global memoizeJobs, memoizeTTL
+    memoizeJobs = enabled
+    if ttl is not None:
+        memoizeTTL = ttl
+
+def setQueueMetrics(enabled=True, shards=None):
+    """
+    Enables or disables the queue depth counters, see `uaimodal.api.metrics`. Every process that creates,
+    claims or finishes jobs must enable them, for example with UAIMODAL_QUEUE_METRICS=1. Run
+    `uaimodal.api.metrics.rebuildQueueCounters` once after enabling them on an existing queue.
+
+    Args:
+        enabled (bool, optional): Whether state changes update the counters. Defaults to True.
+        shards (int, optional): Counter documents per state and job name. Defaults to None (unchanged).
+
+    Returns:
+        None
+    """
+    global queueMetrics, counterShards
+    queueMetrics = enabled
+    if shards is not None:
+        counterShards = shards
+
+def getCounterId(state, name, shard) -> str:
+    """
+    Returns:
+        str: The ID of a counter document in `jobs_counters`. Job names are hashed, since they may contain "/".
+    """
+    return f"{state}-{hashlib.sha1(name.encode('utf-8')).hexdigest()[:16]}-{shard}"
+
+def getCounterOperations(transitions) -> list:
+    """
+    Returns the batch operations that update the queue depth counters for job state changes. Each change
+    increments a random shard of the counter of its state and job name.
+
+    Args:
+        transitions (list): (name, fromState, toState) tuples. fromState is None for new jobs, toState is None for removed jobs.
+
+    Returns:
+        list: The "increment" operations for `batchWrite`. Empty if the counters are disabled.
+    """
+    if not queueMetrics:
+        return []
+    deltas = {}
+    for name, fromState, toState in transitions:
+        if fromState == toState:
+            continue
+        if fromState is not None:
+            deltas[(fromState, name)] = deltas.get((fromState, name), 0) - 1
+        if toState is not None:
+            deltas[(toState, name)] = deltas.get((toState, name), 0) + 1
+    operations = []
+    for (state, name), amount in deltas.items():
+        if amount == 0:
+            continue
+        counterId = getCounterId(state, name, random.randrange(counterShards))
+        operations.append(("increment", "jobs_counters", counterId, "count", amount, {"id": counterId, "state": state, "name": name}))
+    return operations
+
+def writeCounters(transitions):
+    """
+    Updates the queue depth counters with one batched write, for state changes that could not be batched with the change itself.
+
+    Args:
+        transitions (list): (name, fromState, toState) tuples, see getCounterOperations.
+    """
+    operations = getCounterOperations(transitions)
+    if len(operations) > 0:
+        batchWrite(operations)
+
+def getRequestHash(name, request) -> str:
+    """
+    Returns the memoization key of a request. JSON requests are canonicalized first, so key order and
+    whitespace do not change the hash.
+
+    Args:
+        name (str): The name of the job.
+        request (str): The request, usually a JSON string.
+
+    Returns:
+        str: The SHA-256 hex digest of the name and the canonical request.
+    """
+    canonical = request
+    if isinstance(request, str):
+        try:
+            canonical = json.loads(request)
+        except ValueError:
+            canonical = request
+    payload = json.dumps([name, canonical], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def getJobIndexOperations(job) -> list:
+    """
+    Returns the batch operations that update the memoization index when a job finishes. Failed jobs are
+    removed from the index, so the next identical request runs again.
+
+    Args:
+        job (dict): The finished job.
+
+    Returns:
+        list: The operations for `batchWrite`. Empty if the job was not memoized.
+    """
+    requestHash = job.get("requestHash", "")
+    if requestHash == "":
+        return []
+    if job.get("status") in ["error", "cancelled"]:
+        return [("delete", "jobs_index", requestHash)]
+    return [("set", "jobs_index", requestHash, {"hash": requestHash, "jobId": job["id"], "state": "finished", "finishedAt": time.time()})]
+
+@traced
+def findMemoizedJob(name, request, ttl=None) -> dict:
+    """
+    Looks up a job for an identical request: a finished job younger than `ttl`, or a pending or running one.
+
+    Args:
+        name (str): The name of the job.
+        request (str): The request.
+        ttl (float, optional): Seconds a finished result is reused for. Defaults to None (memoizeTTL).
+
+    Returns:
+        dict: The job, or None if there is nothing to reuse.
+    """
+    ttl = memoizeTTL if ttl is None else ttl
+    entry = getDoc("jobs_index", getRequestHash(name, request))
+    if entry is None:
+        return None
+    if entry["state"] == "finished":
+        if time.time() - entry["finishedAt"] > ttl:
+            return None
+        job = getJob(entry["jobId"], "finished")
+    else:
+        job, state = findJob(entry["jobId"])
+    if job is None or job.get("status") in ["error", "cancelled"]:
+        return None
+    return job
+
+@traced
 def getJob(jobId, state="pending") -> dict:
     """
     Retrieves a job based on the provided jobId and state.
@@ -41,10 +249,13 @@ def getJob(jobId, state="pending") -> dict:
         return getDoc("jobs_running", jobId)
     elif state == "finished":
         return getDoc("jobs_finished", jobId)
+    elif state == "waiting":
+        return getDoc("jobs_waiting", jobId)
     
+@traced
 def findJob(jobId):
     """
-    Finds a job with the given jobId.
+    Finds a job with the given jobId, in the pending, running, finished and waiting collections, in that order.
 
     Args:
         jobId (int): The ID of the job to find.
@@ -63,8 +274,12 @@ def findJob(jobId):
     if job is None:
         state = "finished"
         job = getJob(jobId, "finished")
+    if job is None:
+        state = "waiting"
+        job = getJob(jobId, "waiting")
     return job, state
 
+@traced
 def setJob(jobId, data, state="pending") -> dict:
     """
     Sets the job with the given jobId to the specified state and updates its data.
@@ -85,12 +300,20 @@ def setJob(jobId, data, state="pending") -> dict:
         {'jobId': 123, 'name': 'Job 1', 'status': 'completed'}
     """
     job_, prevState = findJob(jobId)
+    if queueMetrics:
+        # The move and the counters are written together
+        operations = [("delete", f"jobs_{prevState}", jobId)] if job_ is not None else []
+        operations.append(("set", f"jobs_{state}", jobId, data))
+        name = data.get("name", job_.get("name", "") if job_ is not None else "")
+        batchWrite(operations + getCounterOperations([(name, prevState if job_ is not None else None, state)]))
+        return data
     if job_ is not None:
         deleteDoc(f"jobs_{prevState}", jobId)
     newJob = setDoc(f"jobs_{state}", jobId, data)
     return newJob
     
     
+@traced
 def setJobPending(jobId, data) -> dict:
     """
     Sets the status of a job to 'pending'.
@@ -105,9 +328,10 @@ def setJobPending(jobId, data) -> dict:
     """
     return setJob(jobId, data, "pending")
     
+@traced
 def setJobRunning(jobId, data) -> dict:
     """
-    Sets the status of a job to 'running'.
+    Sets the status of a job to 'running'. Workers claim jobs with `claimJob` instead, which is atomic.
 
     Args:
         jobId (int): The ID of the job.
@@ -118,21 +342,27 @@ def setJobRunning(jobId, data) -> dict:
     """
     return setJob(jobId, data, "running")
     
+@traced
 def setJobFinished(jobId, data) -> dict:
     """
     Sets the status of a job to 'finished' and returns the updated job information.
 
     Parameters:
     - jobId (int): The ID of the job to update.
-    - data (dict): The data to update the job with.
+    - data (dict): The data to update the job with. It is not modified.
 
     Returns:
     - dict: The updated job information.
 
     """
-    return setJob(jobId, data, "finished")
+    data = {**data, "finishedAt": time.time()}
+    newJob = setJob(jobId, data, "finished")
+    completeShards([data])
+    completeDependencies([data])
+    return newJob
     
 
+@traced
 def updateJobResult(jobId, data, inputJob=None):
     """
     Updates the result of a job with the given jobId. Also sets the job status to 'finished'.
@@ -144,7 +374,6 @@ def updateJobResult(jobId, data, inputJob=None):
     Returns:
         None
     """
-    import json
     if inputJob is None:
         job_, state = findJob(jobId)
     else:
@@ -152,10 +381,74 @@ def updateJobResult(jobId, data, inputJob=None):
     if job_ is not None:
         job_["result"] = json.dumps(data, indent=4)
         setJobFinished(jobId, job_)
+        indexOperations = getJobIndexOperations(job_)
+        if len(indexOperations) > 0:
+            batchWrite(indexOperations)
         
+@traced
+def updateJobResults(results):
+    """
+    Updates the results of several running jobs with a single batched write and moves them to 'finished'.
+    More than about 240 jobs take several batched writes, each moving whole jobs, see `batchWriteGroups`.
+
+    Args:
+        results (list): A list of (job, data) tuples. `job` is the job dict as claimed by the worker and
+            `data` is the result to assign to it.
+
+    Returns:
+        None
+    """
+    groups = []
+    for job_, data in results:
+        job_["result"] = json.dumps(data, indent=4)
+        job_["finishedAt"] = time.time()
+        groups.append([("delete", "jobs_running", job_["id"]), ("set", "jobs_finished", job_["id"], job_)] + getJobIndexOperations(job_))
+    groups.append(getCounterOperations([(job_.get("name", ""), "running", "finished") for job_, data in results]))
+    batchWriteGroups(groups)
+    completeShards([job_ for job_, data in results])
+    completeDependencies([job_ for job_, data in results])
+
+@traced
+def claimJob(jobId) -> dict:
+    """
+    Claims a pending job for a worker by moving it to the 'running' state, with a single atomic move, so of
+    several workers claiming the same job exactly one gets it.
+
+    Args:
+        jobId (str): The ID of the job to claim.
+
+    Returns:
+        dict: The claimed job, or None if the job is no longer pending (for example because another worker claimed it first).
+    """
+    job_ = moveDoc("jobs_pending", "jobs_running", jobId, {"status": "running", "startedAt": time.time()})
+    if job_ is not None:
+        writeCounters([(job_.get("name", ""), "pending", "running")])
+    return job_
+
+@traced
+def requeueJob(jobId, data=None) -> dict:
+    """
+    Returns a claimed job to the pending collection with a single atomic move, for example when a worker stops
+    before processing it. A job that was deleted or cancelled in the meantime is not brought back.
+
+    Args:
+        jobId (str): The ID of the running job.
+        data (dict, optional): Fields to merge into the job. Defaults to None.
+
+    Returns:
+        dict: The requeued job, or None if the job is no longer running.
+    """
+    job_ = moveDoc("jobs_running", "jobs_pending", jobId, {"status": "pending", **(data or {})})
+    if job_ is not None:
+        writeCounters([(job_.get("name", ""), "running", "pending")])
+    return job_
+
+@traced
 def deleteJob(jobId):
     """
-    Deletes a job with the given jobId.
+    Deletes a job with the given jobId. If it is running, its worker notices through its `JobWatcher` and
+    stops without writing a result. Use `cancelJob` to keep a record of the job. Jobs that depend on an
+    unfinished job fail, since it will never finish.
 
     Parameters:
     - jobId (str): The ID of the job to be deleted.
@@ -165,8 +458,80 @@ def deleteJob(jobId):
     """
     job_, state = findJob(jobId)
     if job_ is not None:
-        deleteDoc(f"jobs_{state}", jobId)
+        batchWrite([("delete", f"jobs_{state}", jobId)] + getCounterOperations([(job_.get("name", ""), state, None)]))
+        if state != "finished":
+            for dependentId in job_.get("dependents", []):
+                failWaitingJob(dependentId, f"Dependency {jobId} ({job_.get('stage', job_.get('name', ''))}) was deleted")
         
+@traced
+def cancelJob(jobId, reason="") -> str:
+    """
+    Cancels a job. Waiting and pending jobs are moved to the finished collection with status 'cancelled' right
+    away, along with the children of a sharded job, and jobs that depend on them fail. Running jobs get a
+    cancel signal: their worker sees it through its `JobWatcher` within a few seconds, stops the job
+    cooperatively and moves it to the finished collection with status 'cancelled', without a result.
+
+    Args:
+        jobId (str): The ID of the job.
+        reason (str, optional): Why the job was cancelled, saved in `cancelReason`. Defaults to "".
+
+    Returns:
+        str: "cancelled" if the job was cancelled, "cancelling" if its worker was signalled, or None if the job is not waiting, pending or running.
+    """
+    data = {"status": "cancelled", "cancelReason": reason, "finishedAt": time.time()}
+    for state in ["pending", "waiting"]:
+        job_ = moveDoc(f"jobs_{state}", "jobs_finished", jobId, data)
+        if job_ is not None:
+            writeCounters([(job_.get("name", ""), state, "finished")])
+            for childId in job_.get("children", []):
+                cancelJob(childId, reason)
+            completeShards([job_])
+            completeDependencies([job_])
+            return "cancelled"
+    if updateDoc("jobs_running", jobId, {"signal": "cancel", "cancelReason": reason}):
+        return "cancelling"
+    return None
+
+@traced
+def preemptJob(jobId) -> bool:
+    """
+    Asks the worker of a running job to stop it and return it to the pending collection, for example to free
+    a GPU for more urgent work, see `uaimodal.api.scheduler.preemptJobs`. The job keeps its `createdAt`, so
+    it is claimed again ahead of newer jobs of the same priority.
+
+    Args:
+        jobId (str): The ID of the running job.
+
+    Returns:
+        bool: True if the job is running and was signalled.
+    """
+    return updateDoc("jobs_running", jobId, {"signal": "preempt"})
+
+@traced
+def finishCancelledJob(job, reason) -> dict:
+    """
+    Settles a running job that its worker stopped because of a signal.
+
+    Args:
+        job (dict): The running job.
+        reason (str): "cancelled" to move it to the finished collection with status 'cancelled', "preempted" to
+            return it to the pending collection, or "deleted" if it was deleted, which needs no write.
+
+    Returns:
+        dict: The moved job, or None if there was nothing to move.
+    """
+    if reason == "deleted":
+        return None
+    if reason == "preempted":
+        return requeueJob(job["id"], {"signal": "", "queuedAt": time.time()})
+    job_ = moveDoc("jobs_running", "jobs_finished", job["id"], {"status": "cancelled", "finishedAt": time.time()})
+    if job_ is not None:
+        writeCounters([(job_.get("name", ""), "running", "finished")])
+        completeShards([job_])
+        completeDependencies([job_])
+    return job_
+
+@traced
 def getPendingJobs():
     """
     Retrieves a collection of pending jobs.
@@ -176,6 +541,7 @@ def getPendingJobs():
     """
     return getCollection("jobs_pending")
 
+@traced
 def getRunningJobs():
     """
     Retrieves the collection of running jobs.
@@ -185,6 +551,7 @@ def getRunningJobs():
     """
     return getCollection("jobs_running")
 
+@traced
 def getFinishedJobs():
     """
     Retrieves a collection of finished jobs.
@@ -194,6 +561,7 @@ def getFinishedJobs():
     """
     return getCollection("jobs_finished")
 
+@traced
 def getJobs():
     """
     Retrieves all jobs from the system.
@@ -203,33 +571,54 @@ def getJobs():
     """
     return getPendingJobs() + getRunningJobs() + getFinishedJobs()
 
+@traced
 def getJobResults(jobId):
     """
-    Retrieves the results of a finished job.
+    Retrieves the results of a finished job. Jobs that were archived (see `uaimodal.api.archive`) are read back from their archive bundle.
 
     Args:
         jobId (str): The ID of the job to retrieve results for.
 
     Returns:
-        dict: A dictionary containing the job results.
+        dict: A dictionary containing the job results, or None if the job is not finished.
 
     """
-    return getDoc("jobs_finished", jobId)
+    job_ = getDoc("jobs_finished", jobId)
+    if job_ is None:
+        from uaimodal.api.archive import getArchivedJob
+        job_ = getArchivedJob(jobId)
+    return job_
 
-def createJob(name, user, request, result):
+@traced
+def createJob(name, user, request, result, memoize=None, ttl=None, refresh=False, priority="normal"):
     """
     Creates a new job with the given parameters.
 
+    With memoization, a job whose name and request match a finished job younger than `ttl` is not created
+    again: the finished job, with its result, is returned instead. If an identical job is pending or running,
+    that job is returned, so the caller waits for the same result. Memoized jobs are indexed by request hash
+    in the `jobs_index` collection.
+
     Args:
         name (str): The name of the job.
         user (str): The user associated with the job.
         request (str): The request for the job.
         result (str): The result of the job.
+        memoize (bool, optional): Reuse identical jobs. Defaults to None (memoizeJobs, see setJobMemoization).
+        ttl (float, optional): Seconds a finished result is reused for. Defaults to None (memoizeTTL).
+        refresh (bool, optional): Always run a new job, and index it so later identical requests reuse its result. Defaults to False.
+        priority (str or int, optional): The priority class, see getPriority. Defaults to "normal".
 
     Returns:
-        dict: A dictionary representing the created job.
+        dict: A dictionary representing the created job, or the reused job. Reused jobs have "memoized" set to True.
 
     """
+    memoize = memoizeJobs if memoize is None else memoize
+    if memoize and not refresh:
+        job = findMemoizedJob(name, request, ttl)
+        if job is not None:
+            job["memoized"] = True
+            return job
     job = {
         "id":str(uuid.uuid4()),
         "name":name,
@@ -237,11 +626,598 @@ def createJob(name, user, request, result):
         "request":request,
         "result":result,
         "status":"idle",
-        "messages":""
+        "messages":"",
+        "createdAt":time.time(),
+        "priority":getPriority(priority),
     }
-    newDocID = initDoc("jobs_queue")
-    setJob(newDocID, job, "pending")
+    job["queuedAt"] = job["createdAt"]
+    if memoize:
+        # The ID is new, so the job and its index entry are written without looking the job up first
+        job["requestHash"] = getRequestHash(name, request)
+        batchWrite([
+            ("set", "jobs_pending", job["id"], job),
+            ("set", "jobs_index", job["requestHash"], {"hash": job["requestHash"], "jobId": job["id"], "state": "pending", "finishedAt": 0}),
+        ] + getCounterOperations([(name, None, "pending")]))
+        return job
+    # The ID is new, so there is no previous state to look up
+    batchWrite([("set", "jobs_pending", job["id"], job)] + getCounterOperations([(name, None, "pending")]))
     return job
 
+def getShardRanges(total, shards=None, shardSize=None) -> list:
+    """
+    Splits a range of frames (or segments, or seconds) into contiguous shards of nearly equal size.
+
+    Args:
+        total (int): The number of frames.
+        shards (int, optional): The number of shards. Defaults to None (use `shardSize`).
+        shardSize (int, optional): The number of frames per shard, used when `shards` is not set. Defaults to None.
+
+    Returns:
+        list: The [start, end) frame ranges, in order.
+
+    Examples:
+        >>> getShardRanges(10, shards=3)
+        [[0, 4], [4, 7], [7, 10]]
+    """
+    if shards is None:
+        if shardSize is None:
+            raise ValueError("Either shards or shardSize must be set")
+        shards = -(-total // shardSize)
+    shards = max(1, min(shards, total))
+    size, extra = divmod(total, shards)
+    ranges = []
+    start = 0
+    for index in range(shards):
+        end = start + size + (1 if index < extra else 0)
+        ranges.append([start, end])
+        start = end
+    return ranges
+
+@traced
+def createShardedJob(name, user, request, ranges, reducer=None, priority="normal") -> dict:
+    """
+    Splits a job into child jobs over frame or segment ranges, to be run in parallel by any worker, and a
+    parent job that reduces their results once every child has finished.
+
+    Each child is a regular pending job named `name`, whose request is the parent request with an added
+    "shard" object: {"index", "count", "start", "end"}. The parent waits in the `jobs_waiting` collection,
+    where workers do not see it. Every finished or failed child increments the parent's `shardsDone` counter,
+    and the child that completes the count moves the parent to `jobs_pending` under the `reducer` name, so a
+    worker for the reducer claims it and merges the results with `getShardResults`, for example with
+    `uaimodal.utils.ConcatVideos`. The parent and the children are written with a single batched write.
+
+    Args:
+        name (str): The name of the child jobs, as claimed by the workers that render a shard.
+        user (str): The user associated with the job.
+        request (str or dict): The request, a JSON object.
+        ranges (list): The [start, end) range of each child, see `getShardRanges`.
+        reducer (str, optional): The name of the parent job when it is released. Defaults to None ("<name>.reduce").
+        priority (str or int, optional): The priority class of the parent and the children, see getPriority. Defaults to "normal".
+
+    Returns:
+        dict: The parent job, with the child IDs in "children".
+    """
+    if isinstance(request, str):
+        request = json.loads(request)
+    createdAt = time.time()
+    parent = {
+        "id":str(uuid.uuid4()),
+        "name":reducer if reducer is not None else f"{name}.reduce",
+        "user":user,
+        "request":json.dumps(request),
+        "result":"",
+        "status":"waiting",
+        "messages":"",
+        "createdAt":createdAt,
+        "priority":getPriority(priority),
+        "shardCount":len(ranges),
+        "shardsDone":0,
+        "children":[],
+    }
+    children = []
+    for index, (start, end) in enumerate(ranges):
+        shardRequest = dict(request)
+        shardRequest["shard"] = {"index": index, "count": len(ranges), "start": start, "end": end}
+        children.append({
+            "id":str(uuid.uuid4()),
+            "name":name,
+            "user":user,
+            "request":json.dumps(shardRequest),
+            "result":"",
+            "status":"idle",
+            "messages":"",
+            "createdAt":createdAt,
+            "queuedAt":createdAt,
+            "priority":getPriority(priority),
+            "parentId":parent["id"],
+            "shardIndex":index,
+            "shardCount":len(ranges),
+        })
+    parent["children"] = [child["id"] for child in children]
+    # The parent comes first, so it exists before any child can finish
+    counters = getCounterOperations([(parent["name"], None, "waiting")] + [(name, None, "pending") for child in children])
+    batchWrite([("set", "jobs_waiting", parent["id"], parent)] + [("set", "jobs_pending", child["id"], child) for child in children] + counters)
+    return parent
+
+@traced
+def completeShards(jobs):
+    """
+    Counts finished child jobs towards their parent, and releases each parent whose children have all
+    finished. Called by `setJobFinished` and `updateJobResults`, so workers need no changes.
+
+    Args:
+        jobs (list): The finished jobs. Jobs that are not shards are ignored.
+
+    Returns:
+        list: The IDs of the released parents.
+    """
+    released = []
+    for job_ in jobs:
+        parentId = job_.get("parentId", "")
+        if parentId == "":
+            continue
+        # The counter is incremented atomically, so exactly one child sees the final count
+        done = incrementField("jobs_waiting", parentId, "shardsDone")
+        if done is not None and done == job_["shardCount"]:
+            releaseShardedJob(parentId)
+            released.append(parentId)
+    return released
+
+@traced
+def releaseShardedJob(parentId) -> dict:
+    """
+    Moves a waiting parent job to the pending collection, so its reducer runs. Normally called by
+    `completeShards`. Call it directly to reduce a parent whose counter was not updated, for example
+    after a worker crashed between finishing a child and counting it.
+
+    Args:
+        parentId (str): The ID of the parent job.
+
+    Returns:
+        dict: The released parent, or None if it is not waiting.
+    """
+    return releaseWaitingJob(parentId)
+
+@traced
+def releaseWaitingJob(jobId, job=None) -> dict:
+    """
+    Moves a job from the waiting collection to the pending collection, where workers can claim it.
+
+    Args:
+        jobId (str): The ID of the job.
+        job (dict, optional): The waiting job, if it was just read. Defaults to None (read it).
+
+    Returns:
+        dict: The released job, or None if it is not waiting.
+    """
+    job_ = getJob(jobId, "waiting") if job is None else job
+    if job_ is None:
+        return None
+    job_["status"] = "pending"
+    job_["queuedAt"] = time.time()
+    batchWrite([("delete", "jobs_waiting", jobId), ("set", "jobs_pending", jobId, job_)] + getCounterOperations([(job_.get("name", ""), "waiting", "pending")]))
+    return job_
+
+@traced
+def getShardResults(parent, raiseOnError=True) -> list:
+    """
+    Retrieves the finished children of a sharded job with a single query, for the reducer.
+
+    Args:
+        parent (dict or str): The parent job, or its ID.
+        raiseOnError (bool, optional): Raise if a child failed or is missing. Defaults to True.
+
+    Returns:
+        list: The finished child jobs, ordered by shard index.
+
+    Raises:
+        RuntimeError: If `raiseOnError` is set and a child failed or is not finished.
+    """
+    parentId = parent["id"] if isinstance(parent, dict) else parent
+    children = sorted(queryCollection("jobs_finished", "parentId", "==", parentId), key=lambda child: child["shardIndex"])
+    if raiseOnError:
+        failed = [child["shardIndex"] for child in children if child.get("status") in ["error", "cancelled"]]
+        if len(failed) > 0:
+            raise RuntimeError(f"Shards {failed} of job {parentId} failed")
+        if isinstance(parent, dict) and len(children) != parent.get("shardCount", len(children)):
+            raise RuntimeError(f"Only {len(children)} of {parent['shardCount']} shards of job {parentId} are finished")
+    return children
+
+@traced
+def createPipeline(stages, user) -> dict:
+    """
+    Creates the jobs of a multi-stage workflow at once, with dependency edges between them, so each stage
+    is claimed by whichever worker pool serves it as soon as the stages it depends on have finished. No
+    orchestrator has to poll for results.
+
+    Stages without dependencies are created pending. The others wait in the `jobs_waiting` collection with
+    their `dependsOn` job IDs, and every job lists the IDs of its `dependents`. When a job finishes, each of
+    its dependents records it with an atomic `unionField`, and the update that completes the dependencies
+    moves the dependent to `jobs_pending`. If a job fails, its dependents, and theirs, fail without running.
+    Every job is written with a single batched write.
+
+    Outputs are passed by reference: each stage gets its own Storage prefix in `outputPath`, under
+    `pipelines/<pipeline id>/<stage>`, and its request gets "outputPath" and an "inputs" object with the
+    `outputPath` of each stage it depends on.
+
+    Args:
+        stages (dict): The stages by key. Each stage is a dict with "name" (the job name), "request" (a JSON object,
+            as a dict or string) and optionally "dependsOn" (the keys of the stages it depends on) and "priority"
+            (see getPriority, defaults to "normal").
+        user (str): The user associated with the jobs.
+
+    Returns:
+        dict: The pipeline, with its "id" and its "jobs" by stage key.
+
+    Raises:
+        ValueError: If a stage depends on an unknown stage, or the dependencies contain a cycle.
+
+    Examples:
+        >>> createPipeline({
+        >>>     "preprocess": {"name": "preprocess", "request": request},
+        >>>     "generate": {"name": "sadtalker", "request": request, "dependsOn": ["preprocess"]},
+        >>>     "encode": {"name": "encode", "request": {}, "dependsOn": ["generate"]},
+        >>> }, user)
+    """
+    for key, stage in stages.items():
+        for dependency in stage.get("dependsOn", []):
+            if dependency not in stages:
+                raise ValueError(f"Stage {key} depends on unknown stage {dependency}")
+    # Orders the stages so every stage comes after the stages it depends on, which also detects cycles
+    ordered = []
+    remaining = dict(stages)
+    while len(remaining) > 0:
+        ready = [key for key, stage in remaining.items() if all(dependency in ordered for dependency in stage.get("dependsOn", []))]
+        if len(ready) == 0:
+            raise ValueError(f"The dependencies of stages {list(remaining)} contain a cycle")
+        for key in ready:
+            ordered.append(key)
+            remaining.pop(key)
+    pipelineId = str(uuid.uuid4())
+    createdAt = time.time()
+    ids = {key: str(uuid.uuid4()) for key in ordered}
+    paths = {key: f"{pipelinePrefix}/{pipelineId}/{key}" for key in ordered}
+    jobs = {}
+    for key in ordered:
+        stage = stages[key]
+        dependsOn = list(stage.get("dependsOn", []))
+        request = stage.get("request", {})
+        request = dict(json.loads(request) if isinstance(request, str) else request)
+        request["inputs"] = {dependency: paths[dependency] for dependency in dependsOn}
+        request["outputPath"] = paths[key]
+        jobs[key] = {
+            "id":ids[key],
+            "name":stage["name"],
+            "user":user,
+            "request":json.dumps(request),
+            "result":"",
+            "status":"waiting" if len(dependsOn) > 0 else "idle",
+            "messages":"",
+            "createdAt":createdAt,
+            "queuedAt":createdAt,
+            "priority":getPriority(stage.get("priority", "normal")),
+            "pipelineId":pipelineId,
+            "stage":key,
+            "outputPath":paths[key],
+            "dependsOn":[ids[dependency] for dependency in dependsOn],
+            "dependents":[ids[other] for other in ordered if key in stages[other].get("dependsOn", [])],
+        }
+    # Waiting jobs come first, so every dependent exists before any stage can finish
+    operations = [("set", "jobs_waiting", job["id"], job) for job in jobs.values() if job["status"] == "waiting"]
+    operations += [("set", "jobs_pending", job["id"], job) for job in jobs.values() if job["status"] != "waiting"]
+    operations += getCounterOperations([(job["name"], None, "waiting" if job["status"] == "waiting" else "pending") for job in jobs.values()])
+    batchWrite(operations)
+    return {"id": pipelineId, "jobs": jobs}
+
+@traced
+def completeDependencies(jobs):
+    """
+    Releases the dependents of finished jobs whose dependencies have all finished, and fails the dependents
+    of failed jobs. Called by `setJobFinished` and `updateJobResults`, so workers need no changes.
+
+    Args:
+        jobs (list): The finished jobs. Jobs without dependents cost no round-trips.
+
+    Returns:
+        list: The IDs of the released jobs.
+    """
+    released = []
+    for job_ in jobs:
+        for dependentId in job_.get("dependents", []):
+            if job_.get("status") in ["error", "cancelled"]:
+                failWaitingJob(dependentId, f"Dependency {job_['id']} ({job_.get('stage', job_.get('name', ''))}) failed")
+                continue
+            # The update is atomic, so exactly one finishing dependency gets the complete list back
+            finished = unionField("jobs_waiting", dependentId, "finishedDependencies", [job_["id"]])
+            if finished is None:
+                continue
+            dependent = getJob(dependentId, "waiting")
+            # Checks the list this update produced, not the document, which other dependencies may have completed since
+            if dependent is not None and all(dependency in finished for dependency in dependent["dependsOn"]):
+                releaseWaitingJob(dependentId, dependent)
+                released.append(dependentId)
+    return released
+
+@traced
+def failWaitingJob(jobId, message) -> dict:
+    """
+    Moves a waiting job to the finished collection with status 'error', without running it, and fails its dependents too.
+
+    Args:
+        jobId (str): The ID of the job.
+        message (str): The reason, saved in the job's messages.
+
+    Returns:
+        dict: The failed job, or None if it is not waiting.
+    """
+    job_ = getJob(jobId, "waiting")
+    if job_ is None:
+        return None
+    job_["status"] = "error"
+    job_["messages"] = message
+    job_["finishedAt"] = time.time()
+    batchWrite([("delete", "jobs_waiting", jobId), ("set", "jobs_finished", jobId, job_)] + getCounterOperations([(job_.get("name", ""), "waiting", "finished")]))
+    completeDependencies([job_])
+    return job_
+
+
+
+class JobProgress():
+    """
+    Reports the progress and log lines of a running job without slowing down the code that produces them.
+
+    `update` and `log` only change an in-memory buffer. A background thread merges everything reported
+    since the last write into a single `updateDoc` of the job every `interval` seconds, and only if
+    something changed, which keeps the job document under Firestore's sustained write rate of about one
+    write per second. `close` (or leaving the `with` block) writes whatever is still buffered.
+
+    When created with the job dict, the dict is kept up to date too, so the final write of the job
+    (for example by `updateJobResults`) includes the last progress and messages.
+
+    Example:
+        >>> with JobProgress(job, interval=2.0) as progress:
+        >>>     for i, frame in enumerate(frames):
+        >>>         render(frame)
+        >>>         progress.update(i / len(frames), f"Rendered frame {i}")
+    """
+    def __init__(self, job, interval=2.0, maxLines=100, state="running"):
+        """
+        Args:
+            job (dict or str): The job, or its ID. With only the ID, the job's existing messages are replaced.
+            interval (float, optional): Seconds between writes. Defaults to 2.0.
+            maxLines (int, optional): Number of most recent log lines kept in the job's `messages`. Defaults to 100.
+            state (str, optional): The collection state of the job. Defaults to "running".
+        """
+        self.job = job if isinstance(job, dict) else None
+        self.jobId = job["id"] if isinstance(job, dict) else job
+        self.interval = interval
+        self.maxLines = maxLines
+        self.state = state
+        self.lines = self.job["messages"].splitlines()[-maxLines:] if self.job is not None and self.job.get("messages") else []
+        self.fields = {}
+        self.dirty = False
+        self.writes = 0
+        self.lock = threading.Lock()
+        self.flushLock = threading.Lock()
+        self.stopEvent = threading.Event()
+        self.thread = threading.Thread(target=self.flushLoop, name="uaimodal-progress", daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, excTraceback):
+        if excValue is not None:
+            self.log(f"Error: {excType.__name__}: {excValue}")
+        self.close()
+        return False
+
+    def update(self, progress=None, message=None, **fields):
+        """
+        Records progress. Never waits for a write.
+
+        Args:
+            progress (float, optional): The progress, from 0 to 1. Defaults to None (unchanged).
+            message (str, optional): A log line to add to the job's messages. Defaults to None.
+            **fields: Other job fields to set, for example stage="upscaling".
+        """
+        with self.lock:
+            if progress is not None:
+                self.fields["progress"] = float(progress)
+            self.fields.update(fields)
+            if message is not None:
+                self.lines.append(str(message))
+                del self.lines[:-self.maxLines]
+            self.dirty = True
+
+    def log(self, message):
+        """
+        Adds a log line to the job's messages. Never waits for a write.
+
+        Args:
+            message (str): The log line.
+        """
+        self.update(message=message)
+
+    def flushLoop(self):
+        while not self.stopEvent.wait(self.interval):
+            self.flush()
+
+    def flush(self) -> bool:
+        """
+        Writes everything reported since the last write, with a single merged update of the job document.
+
+        Returns:
+            bool: True if a write was made.
+        """
+        with self.flushLock:
+            with self.lock:
+                if not self.dirty:
+                    return False
+                data = dict(self.fields)
+                data["messages"] = "\n".join(self.lines)
+                self.dirty = False
+            if self.job is not None:
+                self.job.update(data)
+            try:
+                updateDoc(f"jobs_{self.state}", self.jobId, data)
+                self.writes += 1
+            except Exception:
+                traceback.print_exc()
+                with self.lock:
+                    self.dirty = True
+                return False
+            return True
+
+    def close(self):
+        """
+        Stops the background writes and writes whatever is still buffered.
+        """
+        self.stopEvent.set()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+        self.flush()
+
+
+class JobCancelled(Exception):
+    """
+    Raised by `JobWatcher.checkCancelled` to stop a job that was cancelled, preempted or deleted.
+    """
+    def __init__(self, job, reason):
+        """
+        Args:
+            job (dict): The job.
+            reason (str): "cancelled", "preempted" or "deleted".
+        """
+        self.job = job
+        self.reason = reason
+        super().__init__(f"Job {job['id']} was {reason}")
+
+
+class JobWatcher():
+    """
+    Tells a worker when one of its running jobs is cancelled, preempted or deleted, so it can stop wasting GPU time on it.
+
+    A background thread reads the watched jobs every `interval` seconds, with one query per 30 jobs whatever
+    the number of jobs. A job is cancelled or preempted when `cancelJob` or `preemptJob` set its `signal`, and
+    deleted when it is no longer in the running collection. Processing code checks `isCancelled` or calls
+    `checkCancelled` between steps, and `onCancel` is called from the watcher thread, for example to kill a
+    subprocess. `JobWorker` watches the jobs it claims and settles stopped jobs with `finishCancelledJob`.
+
+    Example:
+        >>> watcher = JobWatcher(interval=2.0)
+        >>> watcher.watch([job])
+        >>> for frame in frames:
+        >>>     watcher.checkCancelled(job)
+        >>>     render(frame)
+    """
+    def __init__(self, interval=2.0, onCancel=None):
+        """
+        Args:
+            interval (float, optional): Seconds between reads. Defaults to 2.0.
+            onCancel (callable, optional): Called as onCancel(job, reason) when a watched job is signalled. Defaults to None.
+        """
+        self.interval = interval
+        self.onCancel = onCancel
+        self.jobs = {}
+        self.signals = {}
+        self.lock = threading.Lock()
+        self.stopEvent = threading.Event()
+        self.thread = threading.Thread(target=self.pollLoop, name="uaimodal-watcher", daemon=True)
+        self.thread.start()
+
+    def watch(self, jobs):
+        """
+        Starts watching running jobs.
+
+        Args:
+            jobs (list): The jobs.
+        """
+        with self.lock:
+            for job in jobs:
+                self.jobs[job["id"]] = job
+
+    def unwatch(self, job) -> str:
+        """
+        Stops watching a job, before it is finished or returned to the pending collection.
+
+        Args:
+            job (dict): The job.
+
+        Returns:
+            str: "cancelled", "preempted" or "deleted" if the job was signalled, otherwise None.
+        """
+        with self.lock:
+            self.jobs.pop(job["id"], None)
+            return self.signals.pop(job["id"], None)
+
+    def getSignal(self, job) -> str:
+        """
+        Returns:
+            str: "cancelled", "preempted" or "deleted" if the job was signalled, otherwise None.
+        """
+        with self.lock:
+            return self.signals.get(job["id"])
+
+    def isCancelled(self, job) -> bool:
+        """
+        Returns:
+            bool: True if the job was cancelled, preempted or deleted and should stop.
+        """
+        return self.getSignal(job) is not None
+
+    def checkCancelled(self, job):
+        """
+        Raises:
+            JobCancelled: If the job was cancelled, preempted or deleted.
+        """
+        reason = self.getSignal(job)
+        if reason is not None:
+            raise JobCancelled(job, reason)
+
+    def pollLoop(self):
+        while not self.stopEvent.wait(self.interval):
+            try:
+                self.poll()
+            except Exception:
+                traceback.print_exc()
+
+    def poll(self):
+        """
+        Reads the watched jobs once and records their signals.
+        """
+        with self.lock:
+            ids = [jobId for jobId in self.jobs if jobId not in self.signals]
+        # Firestore accepts at most 30 values in an "in" query
+        for start in range(0, len(ids), 30):
+            chunk = ids[start:start + 30]
+            found = {job["id"]: job for job in queryCollection("jobs_running", "id", "in", chunk)}
+            for jobId in chunk:
+                running = found.get(jobId)
+                if running is None:
+                    self.setSignal(jobId, "deleted")
+                elif running.get("signal") == "cancel":
+                    self.setSignal(jobId, "cancelled")
+                elif running.get("signal") == "preempt":
+                    self.setSignal(jobId, "preempted")
+
+    def setSignal(self, jobId, reason):
+        with self.lock:
+            # The job may have been unwatched and finished while it was being read
+            job = self.jobs.get(jobId)
+            if job is None or jobId in self.signals:
+                return
+            self.signals[jobId] = reason
+        if self.onCancel is not None:
+            try:
+                self.onCancel(job, reason)
+            except Exception:
+                traceback.print_exc()
 
-    
\ No newline at end of file
+    def close(self):
+        """
+        Stops the background reads.
+        """
+        self.stopEvent.set()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
@@ -0,0 +1,205 @@
+from uaimodal.api.firebase import getCollection, queryCollection, batchWrite
+from uaimodal.api.instrumentation import traced
+from uaimodal.api.job import getCounterId
+import time
+import threading
+
+# Job states with a depth counter
+queueStates = ["waiting", "pending", "running", "finished"]
+
+
+def getPercentiles(samples) -> dict:
+    """
+    Returns:
+        dict: The count, mean and 50th, 95th and 99th percentiles of `samples`, in seconds.
+    """
+    ordered = sorted(samples)
+    def percentile(fraction):
+        if len(ordered) == 0:
+            return 0.0
+        return ordered[min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)]
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered) if len(ordered) > 0 else 0.0,
+        "p50": percentile(0.50),
+        "p95": percentile(0.95),
+        "p99": percentile(0.99),
+    }
+
+@traced
+def getQueueDepth() -> dict:
+    """
+    Returns the number of jobs per state, from the sharded counters in `jobs_counters`, with a single read
+    of a collection that holds a few documents per state and job name. Requires queue metrics, see
+    `uaimodal.api.job.setQueueMetrics`.
+
+    Returns:
+        dict: The totals per state in "total", and the counts per job name and state in "byName".
+    """
+    total = {state: 0 for state in queueStates}
+    byName = {}
+    for counter in getCollection("jobs_counters"):
+        total[counter["state"]] = total.get(counter["state"], 0) + counter["count"]
+        counts = byName.setdefault(counter["name"], {state: 0 for state in queueStates})
+        counts[counter["state"]] = counts.get(counter["state"], 0) + counter["count"]
+    return {"total": total, "byName": byName}
+
+@traced
+def queueStats(window=3600.0) -> dict:
+    """
+    Returns the queue statistics used for autoscaling, without scanning the job collections: the depth per
+    state and job name from the counters, the age of the oldest pending job, and the wait time, run time
+    and throughput of the jobs that finished in the last `window` seconds. Takes three round-trips.
+
+    Wait time is from `queuedAt` (created, or released by its dependencies) to `startedAt` (claimed), and run
+    time from `startedAt` to `finishedAt`. Jobs without these stamps are counted but left out of the latencies.
+
+    Args:
+        window (float, optional): Seconds of finished jobs to compute latencies and throughput from. Defaults to 3600.0.
+
+    Returns:
+        dict: The statistics, with "depth", "oldestPendingSeconds", "window", "finished", "errors", "cancelled",
+            "throughputPerMinute", "waitSeconds" and "runSeconds" (count, mean, p50, p95, p99), and the same
+            window statistics per job name in "byName".
+    """
+    now = time.time()
+    depth = getQueueDepth()
+    oldest = queryCollection("jobs_pending", "queuedAt", ">", 0, orderBy="queuedAt", limit=1)
+    finished = queryCollection("jobs_finished", "finishedAt", ">", now - window)
+
+    def summarize(jobs) -> dict:
+        waits = [job["startedAt"] - job["queuedAt"] for job in jobs if "startedAt" in job and "queuedAt" in job]
+        runs = [job["finishedAt"] - job["startedAt"] for job in jobs if "startedAt" in job]
+        return {
+            "finished": len(jobs),
+            "errors": len([job for job in jobs if job.get("status") == "error"]),
+            "cancelled": len([job for job in jobs if job.get("status") == "cancelled"]),
+            "throughputPerMinute": len(jobs) / window * 60,
+            "waitSeconds": getPercentiles(waits),
+            "runSeconds": getPercentiles(runs),
+        }
+
+    names = {}
+    for job in finished:
+        names.setdefault(job.get("name", ""), []).append(job)
+    stats = {
+        "time": now,
+        "window": window,
+        "depth": depth,
+        "oldestPendingSeconds": now - oldest[0]["queuedAt"] if len(oldest) > 0 else 0.0,
+    }
+    stats.update(summarize(finished))
+    stats["byName"] = {name: summarize(jobs) for name, jobs in names.items()}
+    return stats
+
+@traced
+def rebuildQueueCounters() -> dict:
+    """
+    Recounts every job collection once and replaces the counters, for example after enabling queue metrics
+    on an existing queue. Run it while no jobs are created or claimed, since changes made during the
+    recount are lost.
+
+    Returns:
+        dict: The totals per state.
+    """
+    counts = {}
+    for state in queueStates:
+        for job in getCollection(f"jobs_{state}"):
+            counts[(state, job.get("name", ""))] = counts.get((state, job.get("name", "")), 0) + 1
+    operations = [("delete", "jobs_counters", counter["id"]) for counter in getCollection("jobs_counters") if "id" in counter]
+    for (state, name), count in counts.items():
+        counterId = getCounterId(state, name, 0)
+        operations = [operation for operation in operations if operation[2] != counterId]
+        operations.append(("set", "jobs_counters", counterId, {"id": counterId, "state": state, "name": name, "count": count}))
+    batchWrite(operations)
+    total = {state: 0 for state in queueStates}
+    for (state, name), count in counts.items():
+        total[state] += count
+    return total
+
+def escapeLabel(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def formatPrometheus(stats) -> str:
+    """
+    Formats `queueStats` in the Prometheus text exposition format.
+
+    Args:
+        stats (dict): The result of `queueStats`.
+
+    Returns:
+        str: The metrics.
+    """
+    lines = [
+        "# HELP uaimodal_queue_jobs Jobs per state and job name.",
+        "# TYPE uaimodal_queue_jobs gauge",
+    ]
+    for name, counts in sorted(stats["depth"]["byName"].items()):
+        for state, count in sorted(counts.items()):
+            lines.append(f'uaimodal_queue_jobs{{name="{escapeLabel(name)}",state="{state}"}} {count}')
+    lines += [
+        "# HELP uaimodal_queue_oldest_pending_seconds Age of the oldest pending job.",
+        "# TYPE uaimodal_queue_oldest_pending_seconds gauge",
+        f"uaimodal_queue_oldest_pending_seconds {stats['oldestPendingSeconds']}",
+    ]
+    windows = [("", stats)] + [(name, nameStats) for name, nameStats in sorted(stats["byName"].items())]
+    for metric, prometheusName, help in [("throughputPerMinute", "uaimodal_queue_throughput_per_minute", "Jobs finished per minute over the window."),
+                                         ("errors", "uaimodal_queue_errors", "Jobs that failed in the window."),
+                                         ("cancelled", "uaimodal_queue_cancelled", "Jobs cancelled in the window.")]:
+        lines += [f"# HELP {prometheusName} {help}", f"# TYPE {prometheusName} gauge"]
+        for name, values in windows:
+            label = f'{{name="{escapeLabel(name)}"}}' if name != "" else ""
+            lines.append(f"{prometheusName}{label} {values[metric]}")
+    for metric, prometheusName, help in [("waitSeconds", "uaimodal_queue_wait_seconds", "Seconds from queued to claimed, over the window."),
+                                         ("runSeconds", "uaimodal_queue_run_seconds", "Seconds from claimed to finished, over the window.")]:
+        lines += [f"# HELP {prometheusName} {help}", f"# TYPE {prometheusName} summary"]
+        for name, values in windows:
+            label = f'name="{escapeLabel(name)}",' if name != "" else ""
+            summary = values[metric]
+            for quantile in ["p50", "p95", "p99"]:
+                lines.append(f'{prometheusName}{{{label}quantile="0.{quantile[1:]}"}} {summary[quantile]}')
+            suffix = f'{{{label.rstrip(",")}}}' if label != "" else ""
+            lines.append(f"{prometheusName}_sum{suffix} {summary['mean'] * summary['count']}")
+            lines.append(f"{prometheusName}_count{suffix} {summary['count']}")
+    return "\n".join(lines) + "\n"
+
+def startMetricsServer(port=9100, host="0.0.0.0", window=3600.0, cacheSeconds=10.0):
+    """
+    Serves `queueStats` at /metrics for Prometheus from a background thread. Statistics are computed at
+    most once every `cacheSeconds`, however often the endpoint is scraped.
+
+    Args:
+        port (int, optional): The port. Defaults to 9100.
+        host (str, optional): The interface to listen on. Defaults to "0.0.0.0".
+        window (float, optional): Seconds of finished jobs the latencies are computed from. Defaults to 3600.0.
+        cacheSeconds (float, optional): Seconds the statistics are reused for. Defaults to 10.0.
+
+    Returns:
+        ThreadingHTTPServer: The server. Call `shutdown()` to stop it.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    cache = {"time": 0.0, "body": b""}
+    lock = threading.Lock()
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            with lock:
+                if time.time() - cache["time"] >= cacheSeconds:
+                    cache["body"] = formatPrometheus(queueStats(window)).encode("utf-8")
+                    cache["time"] = time.time()
+                body = cache["body"]
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="uaimodal-metrics", daemon=True).start()
+    return server
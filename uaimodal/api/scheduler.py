@@ -0,0 +1,197 @@
+import time
+from collections import Counter
+from uaimodal.api.firebase import getCollection, queryCollection
+from uaimodal.api.job import claimJob, preemptJob, getPriority, priorityClasses
+
+# Users a candidate query can exclude. Firestore allows at most 10 values in a not-in filter
+maxExcludedUsers = 10
+
+
+def preemptJobs(priority, count=1, names=None) -> list:
+    """
+    Frees workers for urgent work by preempting running jobs of a less urgent priority class. The least urgent
+    jobs are preempted first, and the most recently created among them. Their workers return them to the
+    pending collection, where they keep their place, see `preemptJob`.
+
+    Call it when urgent jobs are waiting and every worker is busy, for example after creating an interactive job.
+
+    Args:
+        priority (str or int): The priority of the urgent work. Only jobs of a less urgent class are preempted.
+        count (int, optional): The number of jobs to preempt. Defaults to 1.
+        names (list, optional): Only preempt jobs whose `name` is in this list, the jobs the urgent work can replace. Defaults to None (any job).
+
+    Returns:
+        list: The IDs of the preempted jobs.
+    """
+    where = [("name", "in", names)] if names is not None else None
+    running = queryCollection("jobs_running", "priority", ">", getPriority(priority), orderBy="priority", where=where)
+    running = [job for job in running if job.get("signal", "") == ""]
+    running.sort(key=lambda job: (-job["priority"], -job.get("createdAt", 0)))
+    preempted = []
+    for job in running[:count]:
+        if preemptJob(job["id"]):
+            preempted.append(job["id"])
+    return preempted
+
+
+class JobScheduler():
+    """
+    Chooses which pending job a worker claims next, by priority class and fair share between users.
+
+    The oldest jobs of each priority class are read with an indexed query per class, ordered by `createdAt`,
+    instead of reading the whole pending collection. When a class has more than `fetchSize` pending jobs,
+    the users seen so far are excluded and the class is queried again, until every user with pending jobs
+    has candidates (up to `maxExcludedUsers` users fill a window of their own, the rest share the last one).
+    A user with a large backlog therefore never hides the other users from the ranking, and small queues
+    still cost one query per class. Among the candidates the scheduler claims:
+        1. The job with the most urgent effective priority. A job's priority improves by one class for
+           every `agingSeconds` it has waited, so batch work is never starved by interactive work.
+        2. Within that priority, the job of the user with the fewest running jobs relative to their weight
+           (weighted round-robin between users), skipping users that reached their concurrency cap.
+        3. The oldest job.
+
+    Running jobs are counted from the `jobs_running` collection, which is as large as the number of jobs
+    in flight. Candidates are cached for `refreshInterval` seconds, and a claim is an atomic move, so
+    concurrent schedulers never claim the same job. Only jobs with a `priority` and a `createdAt` are seen,
+    which `createJob` sets.
+
+    Firestore needs composite indexes on `jobs_pending` for (priority, createdAt) and (priority, user, createdAt),
+    and for the same fields with `name` first when workers filter by job name.
+
+    Example:
+        >>> scheduler = JobScheduler(agingSeconds=120, userWeights={"studio": 4}, maxRunningPerUser=8)
+        >>> job = scheduler.nextJob(names=["sadtalker"])
+    """
+    def __init__(self, classes=None, agingSeconds=60.0, userWeights=None, maxRunningPerUser=None, userCaps=None, fetchSize=50, refreshInterval=1.0):
+        """
+        Args:
+            classes (list, optional): The numeric priorities to schedule, most urgent first. Defaults to None (every class of priorityClasses).
+            agingSeconds (float, optional): Seconds of waiting that raise a job's priority by one class. Defaults to 60.0.
+            userWeights (dict, optional): The share of each user, relative to the default of 1. Defaults to None (equal shares).
+            maxRunningPerUser (int, optional): The default cap on running jobs per user. Defaults to None (no cap).
+            userCaps (dict, optional): Caps on running jobs for specific users, overriding `maxRunningPerUser`. Defaults to None.
+            fetchSize (int, optional): Oldest jobs read per priority class. Defaults to 50.
+            refreshInterval (float, optional): Seconds the candidates and running counts are reused for. Defaults to 1.0.
+        """
+        self.classes = classes if classes is not None else sorted(priorityClasses.values())
+        self.agingSeconds = agingSeconds
+        self.userWeights = userWeights or {}
+        self.maxRunningPerUser = maxRunningPerUser
+        self.userCaps = userCaps or {}
+        self.fetchSize = fetchSize
+        self.refreshInterval = refreshInterval
+        self.candidates = []
+        self.running = Counter()
+        self.refreshedAt = 0.0
+        self.refreshedNames = None
+
+    def getUserCap(self, user) -> int:
+        """
+        Returns:
+            int: The cap on running jobs of `user`, or None if there is none.
+        """
+        return self.userCaps.get(user, self.maxRunningPerUser)
+
+    def getEffectivePriority(self, job, now) -> int:
+        """
+        Returns the priority of a job after aging.
+
+        Args:
+            job (dict): The pending job.
+            now (float): The current time.
+
+        Returns:
+            int: The priority, improved by one class per `agingSeconds` waited, and never better than the most urgent class.
+        """
+        aged = job["priority"]
+        if self.agingSeconds is not None and self.agingSeconds > 0:
+            aged -= int(max(now - job["createdAt"], 0) // self.agingSeconds)
+        return max(aged, self.classes[0])
+
+    def refresh(self, names=None):
+        """
+        Reads the oldest pending jobs of each priority class and counts the running jobs per user.
+
+        Args:
+            names (list, optional): Only read jobs whose `name` is in this list. Defaults to None (any job).
+        """
+        candidates = []
+        for priority in self.classes:
+            # Firestore cannot combine "in" with "not-in", so each job name is queried on its own
+            for name in names if names is not None else [None]:
+                candidates += self.fetchCandidates(priority, name)
+        self.candidates = candidates
+        self.running = Counter(job.get("user", "") for job in getCollection("jobs_running"))
+        self.refreshedAt = time.time()
+        self.refreshedNames = names
+
+    def fetchCandidates(self, priority, name=None) -> list:
+        """
+        Reads the oldest pending jobs of a priority class, in windows of `fetchSize` jobs. Each window excludes
+        the users of the previous ones, so every user with pending jobs gets candidates.
+
+        Args:
+            priority (int): The priority class.
+            name (str, optional): Only read jobs with this `name`. Defaults to None (any job).
+
+        Returns:
+            list: The candidates.
+        """
+        candidates = []
+        excluded = []
+        while True:
+            where = [("name", "==", name)] if name is not None else []
+            if len(excluded) > 0:
+                where.append(("user", "not-in", excluded))
+            jobs = queryCollection("jobs_pending", "priority", "==", priority, orderBy="createdAt", limit=self.fetchSize, where=where or None)
+            candidates += jobs
+            if len(jobs) < self.fetchSize or len(excluded) >= maxExcludedUsers:
+                return candidates
+            users = [user for user in dict.fromkeys(job.get("user", "") for job in jobs) if user not in excluded]
+            excluded += users[:maxExcludedUsers - len(excluded)]
+
+    def rankJobs(self, now=None) -> list:
+        """
+        Orders the cached candidates in the order they should be claimed, leaving out the jobs of users at their cap.
+
+        Args:
+            now (float, optional): The current time. Defaults to None (time.time()).
+
+        Returns:
+            list: The candidates, next job first.
+        """
+        now = time.time() if now is None else now
+        ranked = []
+        for job in self.candidates:
+            user = job.get("user", "")
+            cap = self.getUserCap(user)
+            if cap is not None and self.running[user] >= cap:
+                continue
+            share = self.running[user] / self.userWeights.get(user, 1.0)
+            ranked.append((self.getEffectivePriority(job, now), share, job["createdAt"], job))
+        ranked.sort(key=lambda entry: entry[:3])
+        return [entry[3] for entry in ranked]
+
+    def nextJob(self, names=None, stopEvent=None) -> dict:
+        """
+        Claims the next job.
+
+        Args:
+            names (list, optional): Only claim jobs whose `name` is in this list. Defaults to None (any job).
+            stopEvent (threading.Event, optional): Returns None without claiming anything once set. Defaults to None.
+
+        Returns:
+            dict: The claimed job, or None if no job can be claimed.
+        """
+        if len(self.candidates) == 0 or names != self.refreshedNames or time.time() - self.refreshedAt >= self.refreshInterval:
+            self.refresh(names)
+        for job in self.rankJobs():
+            if stopEvent is not None and stopEvent.is_set():
+                return None
+            self.candidates.remove(job)
+            claimed = claimJob(job["id"])
+            if claimed is not None:
+                self.running[claimed.get("user", "")] += 1
+                return claimed
+        return None
+
@@ -0,0 +1,280 @@
+from uaimodal.api.backend import getBackend
+from uaimodal.api.instrumentation import traced
+from concurrent.futures import ThreadPoolExecutor
+import os
+import json
+import base64
+import hashlib
+import tempfile
+import threading
+import mimetypes
+
+# Name of the file that caches the hashes of a synced directory's files. It is never synced itself
+manifestName = ".uaimodal-sync.json"
+
+# Suffix of the temporary files syncStorageToDir() downloads to. They are never synced themselves
+partialSuffix = ".uaimodal-part"
+
+# Concurrent transfers of syncDirToStorage() and syncStorageToDir()
+syncWorkers = int(os.environ.get("UAIMODAL_SYNC_WORKERS", "8"))
+
+
+def hashFile(filename, kind="md5") -> str:
+    """
+    Returns the digest of a local file in the format Cloud Storage reports it, base64 encoded, reading it in chunks.
+
+    Args:
+        filename (str): The file.
+        kind (str, optional): "md5", or "crc32c", which requires the `google-crc32c` package. Defaults to "md5".
+
+    Returns:
+        str: The digest.
+    """
+    if kind == "crc32c":
+        import google_crc32c
+        digest = google_crc32c.Checksum()
+    else:
+        digest = hashlib.md5()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return base64.b64encode(digest.digest()).decode("ascii")
+
+def loadManifest(localDir) -> dict:
+    """
+    Returns:
+        dict: The cached size, modification time and digests per relative path of `localDir`, or an empty dict.
+    """
+    try:
+        with open(os.path.join(localDir, manifestName), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def saveManifest(localDir, manifest):
+    """
+    Writes the manifest of `localDir`, replacing the previous one atomically.
+    """
+    path = os.path.join(localDir, manifestName)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, separators=(",", ":"))
+    os.replace(path + ".tmp", path)
+
+def listLocalFiles(localDir) -> dict:
+    """
+    Returns:
+        dict: The `os.stat_result` of every file under `localDir`, by relative path with "/" separators, without the manifest
+            and the temporary files of downloads in progress or interrupted.
+    """
+    files = {}
+    for root, dirs, names in os.walk(localDir):
+        for name in names:
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, localDir).replace(os.sep, "/")
+            if relative in [manifestName, manifestName + ".tmp"] or name.endswith(partialSuffix):
+                continue
+            files[relative] = os.stat(path)
+    return files
+
+def listRemoteFiles(prefix) -> dict:
+    """
+    Returns:
+        dict: The metadata of every blob under `prefix`, see `Backend.listBlobs`, by path relative to the prefix.
+    """
+    prefix = prefix.rstrip("/") + "/" if prefix != "" else ""
+    files = {}
+    for blob in getBackend().listBlobs(prefix):
+        relative = blob["path"][len(prefix):]
+        # Folder placeholders created by the console end with a slash
+        if relative == "" or relative.endswith("/") or relative == manifestName:
+            continue
+        files[relative] = blob
+    return files
+
+def getRemotePath(prefix, relative) -> str:
+    return f"{prefix.rstrip('/')}/{relative}" if prefix != "" else relative
+
+def getLocalPath(localDir, relative) -> str:
+    """
+    Returns the local path of a remote file, raising a ValueError if it would be outside `localDir`,
+    for example for a blob name with ".." parts.
+    """
+    path = os.path.join(localDir, *relative.split("/"))
+    root = os.path.realpath(localDir)
+    resolved = os.path.realpath(path)
+    if resolved == root or os.path.commonpath([root, resolved]) != root:
+        raise ValueError(f"{relative} is outside {localDir}")
+    return path
+
+
+class SyncState():
+    """
+    The manifest of a directory being synced, shared by the transfer threads.
+    """
+    def __init__(self, localDir, useManifest=True):
+        self.localDir = localDir
+        self.useManifest = useManifest
+        self.manifest = loadManifest(localDir) if useManifest else {}
+        self.lock = threading.Lock()
+
+    def getHash(self, relative, stat, kind) -> str:
+        """
+        Returns the digest of a local file, from the manifest when its size and modification time are unchanged.
+        """
+        with self.lock:
+            entry = self.manifest.get(relative)
+        if entry is None or entry.get("size") != stat.st_size or entry.get("mtime") != stat.st_mtime_ns:
+            entry = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+        if entry.get(kind) is None:
+            entry[kind] = hashFile(os.path.join(self.localDir, relative), kind)
+        with self.lock:
+            self.manifest[relative] = entry
+        return entry[kind]
+
+    def matches(self, relative, stat, blob) -> bool:
+        """
+        Returns True if the local file has the content of the blob, comparing sizes first, then the md5
+        digest, or the crc32c digest for blobs without one (composite uploads).
+        """
+        if blob.get("size") is not None and blob["size"] != stat.st_size:
+            return False
+        kind = "md5" if blob.get("md5") else "crc32c" if blob.get("crc32c") else None
+        if kind is None:
+            return False
+        return self.getHash(relative, stat, kind) == blob[kind]
+
+    def record(self, relative, blob):
+        """
+        Records a downloaded file with the digests of its blob, so it is not hashed on the next sync.
+        """
+        stat = os.stat(os.path.join(self.localDir, relative))
+        entry = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+        for kind in ["md5", "crc32c"]:
+            if blob.get(kind):
+                entry[kind] = blob[kind]
+        with self.lock:
+            self.manifest[relative] = entry
+
+    def save(self, files):
+        """
+        Drops the entries of files that no longer exist and writes the manifest.
+        """
+        if not self.useManifest:
+            return
+        with self.lock:
+            self.manifest = {relative: entry for relative, entry in self.manifest.items() if relative in files}
+            saveManifest(self.localDir, self.manifest)
+
+
+@traced
+def syncDirToStorage(localDir, prefix, delete=False, workers=None, public=False, cacheControl=None, useManifest=True) -> dict:
+    """
+    Uploads the files of a local directory that are missing or changed under a bucket prefix, like `rsync`.
+
+    The remote files are listed once with their metadata, and a local file is uploaded only if its size
+    or md5 (crc32c for composite blobs) differs. Local digests are cached in a manifest file in the
+    directory, so unchanged files are not read again on the next sync. Transfers run on a thread pool.
+
+    Args:
+        localDir (str): The local directory.
+        prefix (str): The bucket prefix, for example "checkpoints/sadtalker".
+        delete (bool, optional): Also deletes remote files under the prefix that are not in the directory. Defaults to False.
+        workers (int, optional): Concurrent transfers. Defaults to None (syncWorkers).
+        public (bool, optional): Makes the uploaded files public. Defaults to False.
+        cacheControl (str, optional): The Cache-Control header of the uploaded files. Defaults to None.
+        useManifest (bool, optional): Reads and writes the manifest file. Defaults to True.
+
+    Returns:
+        dict: The relative paths that were "uploaded" and "deleted", and the number of "unchanged" files.
+
+    Example:
+        >>> syncDirToStorage("/tmp/frames", "outputs/job-1/frames", delete=True, public=True)
+    """
+    backend = getBackend()
+    state = SyncState(localDir, useManifest)
+    local = listLocalFiles(localDir)
+    remote = listRemoteFiles(prefix)
+
+    def upload(relative):
+        stat = local[relative]
+        if relative in remote and state.matches(relative, stat, remote[relative]):
+            return None
+        with open(os.path.join(localDir, relative), "rb") as f:
+            backend.uploadBlob(getRemotePath(prefix, relative), f, public=public, cacheControl=cacheControl,
+                               contentType=mimetypes.guess_type(relative)[0])
+        return relative
+
+    def remove(relative):
+        backend.deleteBlob(getRemotePath(prefix, relative))
+        return relative
+
+    extras = sorted(relative for relative in remote if relative not in local) if delete else []
+    try:
+        with ThreadPoolExecutor(max_workers=workers or syncWorkers) as pool:
+            uploaded = [relative for relative in pool.map(upload, sorted(local)) if relative is not None]
+            deleted = list(pool.map(remove, extras))
+    finally:
+        state.save(local)
+    return {"uploaded": uploaded, "deleted": deleted, "unchanged": len(local) - len(uploaded)}
+
+@traced
+def syncStorageToDir(prefix, localDir, delete=False, workers=None, useManifest=True) -> dict:
+    """
+    Downloads the files under a bucket prefix that are missing or changed in a local directory, for example
+    to warm a worker's model cache.
+
+    A remote file is downloaded only if the local file's size or md5 (crc32c for composite blobs) differs,
+    see `syncDirToStorage`. Files are streamed to a temporary file and moved into place, so readers never
+    see a partial file, and their digests are recorded in the manifest without hashing them. A blob whose
+    path would be outside `localDir` raises a ValueError before anything is downloaded.
+
+    Args:
+        prefix (str): The bucket prefix.
+        localDir (str): The local directory, created if needed.
+        delete (bool, optional): Also deletes local files that are not under the prefix. Defaults to False.
+        workers (int, optional): Concurrent transfers. Defaults to None (syncWorkers).
+        useManifest (bool, optional): Reads and writes the manifest file. Defaults to True.
+
+    Returns:
+        dict: The relative paths that were "downloaded" and "deleted", and the number of "unchanged" files.
+
+    Example:
+        >>> syncStorageToDir("checkpoints/sadtalker", "/cache/sadtalker")
+    """
+    backend = getBackend()
+    os.makedirs(localDir, exist_ok=True)
+    state = SyncState(localDir, useManifest)
+    local = listLocalFiles(localDir)
+    remote = listRemoteFiles(prefix)
+    paths = {relative: getLocalPath(localDir, relative) for relative in remote}
+
+    def download(relative):
+        blob = remote[relative]
+        if relative in local and state.matches(relative, local[relative], blob):
+            return None
+        path = paths[relative]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Next to the target, so the move is atomic, with a name listLocalFiles() skips
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=partialSuffix)
+        os.close(handle)
+        try:
+            backend.downloadBlobToFile(getRemotePath(prefix, relative), temporary)
+            os.replace(temporary, path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        state.record(relative, blob)
+        return relative
+
+    def remove(relative):
+        os.remove(os.path.join(localDir, *relative.split("/")))
+        return relative
+
+    extras = sorted(relative for relative in local if relative not in remote) if delete else []
+    try:
+        with ThreadPoolExecutor(max_workers=workers or syncWorkers) as pool:
+            downloaded = [relative for relative in pool.map(download, sorted(remote)) if relative is not None]
+            deleted = list(pool.map(remove, extras))
+    finally:
+        state.save(set(remote) | (set(local) - set(extras)))
+    return {"downloaded": downloaded, "deleted": deleted, "unchanged": len(remote) - len(downloaded)}
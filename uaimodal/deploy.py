@@ -1,32 +1,572 @@
 import os
+import time
+import json
+import inspect
+import functools
 from modal import Image, gpu
 import modal
+from uaimodal.utils import preloadListPath, IgnoreMatcher, HashLocalFiles
+
+# Where profiled builds write one marker file per build step, see UAIModal(profileBuild=True)
+buildProfilePath = "/root/.uaimodal/build"
+
+# Where the wheelhouse volume is mounted while wheels are built, see UAIModal.useWheelhouse
+wheelhousePath = "/wheelhouse"
+
+# Where the installer cache volume is mounted during install steps, see UAIModal.setInstaller
+installerCachePath = "/cache"
+
+# apt packages per CUDA profile, formatted with the CUDA version as major-minor (for example 12-4)
+cudaProfiles = {
+    "runtime": ["cuda-libraries-{version}"],
+    "cudnn": ["cuda-libraries-{version}", "libcudnn9-cuda-{major}"],
+    "devel": ["cuda-toolkit-{version}"],
+}
+
+# Full CUDA versions of the NVIDIA base images, see cudaBaseImage
+cudaImageVersions = {"11.8": "11.8.0", "12.1": "12.1.1", "12.4": "12.4.1"}
+
+# Packages that optimizeColdStart strips of test suites and docs. Only directories named "tests" or "docs" are removed
+coldStartStripPackages = ["torch", "torchvision", "torchaudio", "diffusers", "transformers", "accelerate", "numpy", "scipy", "pandas",
+                          "sklearn", "skimage", "cv2", "moviepy", "matplotlib", "sympy", "networkx", "PIL", "imageio"]
+
+# Modules imported in the image to record the import profile, see optimizeColdStart
+coldStartModules = ["torch", "torchvision", "diffusers", "transformers", "cv2", "numpy", "moviepy", "flask", "firebase_admin"]
+
+# GPU types accepted by Modal, optionally followed by a count, for example "A10G" or "H100:2"
+gpuTypes = ["T4", "L4", "A10G", "A100", "A100-40GB", "A100-80GB", "L40S", "H100", "ANY"]
+
+# Serving function options and their defaults, see validateServingOptions
+servingDefaults = {
+    "gpu": None,
+    "cpu": None,
+    "memory": None,
+    "timeout": 300,
+    "keep_warm": 0,
+    "container_idle_timeout": 60,
+    "allow_concurrent_inputs": 1,
+    "concurrency_limit": None,
+    "retries": 0,
+    "max_batch_size": 0,
+    "wait_ms": 0,
+    "web": "",
+    "method": "POST",
+    "secrets": [],
+    "volumes": {},
+}
+
+# Tuned starting points for UAI workloads, see UAIModal.addServingFunction
+servingPresets = {
+    # Flask apps: I/O bound, so one container serves many requests at once
+    "flask": {"cpu": 1.0, "memory": 1024, "keep_warm": 1, "container_idle_timeout": 300, "allow_concurrent_inputs": 32, "web": "wsgi"},
+    # Diffusers inference: one request at a time per GPU, batched, and kept around between bursts to amortize model loading
+    "diffusers": {"gpu": "A10G", "memory": 16384, "timeout": 600, "container_idle_timeout": 300, "retries": 2, "max_batch_size": 4, "wait_ms": 200},
+    # Diffusers behind an HTTP endpoint, one request per container
+    "diffusers-web": {"gpu": "A10G", "memory": 16384, "timeout": 600, "container_idle_timeout": 300, "web": "endpoint"},
+    # Job queue workers, see uaimodal.worker.JobWorker. Long running, so no retries and no concurrency
+    "worker": {"gpu": "A10G", "timeout": 3600, "container_idle_timeout": 120},
+}
+
+def validateServingOptions(options:dict) -> dict:
+    """
+    Checks serving function options and fills in the defaults.
+
+    Args:
+        options (dict): The options. Keys must be in servingDefaults.
+
+    Raises:
+        ValueError: If an option is unknown, out of range, or incompatible with another option.
+
+    Returns:
+        dict: The complete options.
+    """
+    unknown = [key for key in options if key not in servingDefaults]
+    if len(unknown) > 0:
+        raise ValueError(f"Unknown serving options: {unknown}. Expected some of {list(servingDefaults)}")
+    options = {**servingDefaults, **options}
+    if options["gpu"] is not None:
+        gpuType, _, count = str(options["gpu"]).partition(":")
+        if gpuType.upper() not in gpuTypes or (count != "" and not (count.isdigit() and int(count) >= 1)):
+            raise ValueError(f"Unknown gpu: {options['gpu']}. Expected one of {gpuTypes}, optionally followed by :count")
+    for key, minimum in [("keep_warm", 0), ("retries", 0), ("max_batch_size", 0), ("wait_ms", 0), ("allow_concurrent_inputs", 1), ("container_idle_timeout", 2), ("timeout", 1)]:
+        if not isinstance(options[key], int) or options[key] < minimum:
+            raise ValueError(f"{key} must be an integer >= {minimum}, got {options[key]!r}")
+    if options["concurrency_limit"] is not None and (not isinstance(options["concurrency_limit"], int) or options["concurrency_limit"] < max(options["keep_warm"], 1)):
+        raise ValueError(f"concurrency_limit must be an integer >= keep_warm and >= 1, got {options['concurrency_limit']!r}")
+    if options["web"] not in ["", "wsgi", "asgi", "endpoint"]:
+        raise ValueError(f"web must be '', 'wsgi', 'asgi' or 'endpoint', got {options['web']!r}")
+    if options["method"] not in ["GET", "POST", "PUT", "DELETE", "PATCH"]:
+        raise ValueError(f"Unknown method: {options['method']}")
+    if options["max_batch_size"] > 1000 or options["wait_ms"] > 10000:
+        raise ValueError("max_batch_size must be <= 1000 and wait_ms <= 10000")
+    if options["max_batch_size"] > 0:
+        if options["web"] != "":
+            raise ValueError("Batched functions cannot be web endpoints. Call the batched function from the endpoint instead")
+        if options["allow_concurrent_inputs"] > 1:
+            raise ValueError("Batched functions cannot set allow_concurrent_inputs, batching already runs many inputs per container")
+    return options
+
+def getServingOptions(preset:str = "", **options) -> dict:
+    """
+    Returns the validated options of a preset, with `options` overriding the preset.
+
+    Args:
+        preset (str, optional): A key of servingPresets. Defaults to "" (only the defaults).
+        **options: Options overriding the preset, see servingDefaults.
+
+    Returns:
+        dict: The complete options.
+    """
+    if preset != "" and preset not in servingPresets:
+        raise ValueError(f"Unknown serving preset: {preset}. Expected one of {list(servingPresets)}")
+    return validateServingOptions({**servingPresets.get(preset, {}), **options})
+
+# Left out of copied and mounted directories, on top of their .gitignore and .modalignore files, see UAIModal.setIgnorePatterns
+defaultIgnorePatterns = [".git/", "__pycache__/", "*.pyc", ".venv/", "venv/", ".env/", "node_modules/", ".ipynb_checkpoints/",
+                         ".mypy_cache/", ".pytest_cache/", "*.egg-info/", ".DS_Store", ".vscode/", ".idea/"]
+
+# Where dev mode keeps the content hashes of mounted directories between runs
+mountManifestPath = os.path.join(os.path.expanduser("~"), ".uaimodal", "mounts")
+
+# Part of every catalog image name. Bump it to rebuild the whole catalog, see warmBaseImages
+baseImageVersion = "1"
+
+# Base images built once and shared by every app that starts from them, by name, see registerBaseImage
+baseImageCatalog = {}
+
+# Built with installWheels, which pins it to the commit the default branch points to, see resolvePackageSpec.
+# Set it to git+https://github.com/vltmedia/BasicSR.git@<sha> to skip the lookup
+basicsrPackage = "git+https://github.com/vltmedia/BasicSR.git"
+
+# The dlib release installCMake builds. The spec is the wheelhouse cache key, so it is pinned
+dlibPackage = "dlib==19.24.6"
+
+
+def describeValue(value):
+    """
+    Returns a JSON serializable description of a build step argument.
+
+    Args:
+        value (object): The argument value.
+
+    Returns:
+        object: The value itself if it is JSON serializable, otherwise its name or repr.
+    """
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, (list, tuple)):
+        return [describeValue(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): describeValue(item) for key, item in value.items()}
+    return getattr(value, "__name__", repr(value))
+
+def buildStep(method):
+    """
+    Decorator for UAIModal methods that add layers to the image. Records the method name, its arguments
+    and the image operations it emits as one build step. Steps called from inside another step are
+    recorded as part of the outer step.
+    """
+    signature = inspect.signature(method)
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.currentStep is not None:
+            return method(self, *args, **kwargs)
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        step = {
+            "index": len(self.steps),
+            "method": method.__name__,
+            "args": {key: describeValue(value) for key, value in bound.arguments.items() if key != "self"},
+            "ops": [],
+            "localSeconds": 0.0,
+        }
+        self.steps.append(step)
+        self.currentStep = step
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.currentStep = None
+            step["localSeconds"] = time.perf_counter() - start
+            if self.profileBuild and len(step["ops"]) > 0:
+                self.addProfileMarker(step)
+    return wrapper
+
+def readBuildProfile(buildStart=None, path=buildProfilePath) -> list:
+    """
+    Reads the markers written by a profiled build. Call this inside the built container, for example
+    from a Modal function, and pass the result to `UAIModal.buildReport`.
+
+    Each step's wall time is measured from the previous step's marker, so it includes the time Modal
+    spent building that step's layers. A step whose marker is older than `buildStart` came from the
+    layer cache.
+
+    Args:
+        buildStart (float, optional): Unix time the build was started. Defaults to None (cache hits are not detected).
+        path (str, optional): The marker directory. Defaults to buildProfilePath.
+
+    Returns:
+        list: One dict per step with index, method, end, wallSeconds, sizeKB, layerSizeKB and cacheHit.
+    """
+    records = []
+    if not os.path.isdir(path):
+        return records
+    for name in sorted(os.listdir(path)):
+        with open(os.path.join(path, name)) as f:
+            index, method, end, sizeKB = f.read().split()
+        records.append({"index": int(index), "method": method, "end": float(end), "sizeKB": int(sizeKB)})
+    records.sort(key=lambda record: record["index"])
+    previous = None
+    for record in records:
+        record["cacheHit"] = None if buildStart is None else record["end"] < buildStart
+        record["wallSeconds"] = None
+        record["layerSizeKB"] = record["sizeKB"]
+        if previous is not None:
+            start = previous["end"] if buildStart is None else max(previous["end"], buildStart)
+            record["wallSeconds"] = 0.0 if record["cacheHit"] else record["end"] - start
+            record["layerSizeKB"] = record["sizeKB"] - previous["sizeKB"]
+        previous = record
+    return records
+
+
+def resolvePackageSpec(package:str) -> str:
+    """
+    Pins a git requirement spec that names a branch or tag, or no ref at all, to the commit it points to now,
+    with `git ls-remote`. The wheelhouse cache key and the image layer then change whenever the source does.
+    Other specs, and git specs already pinned to a full commit sha, are returned unchanged.
+
+    Args:
+        package (str): The pip requirement spec, for example "git+https://github.com/vltmedia/BasicSR.git".
+
+    Returns:
+        str: The spec, for example "git+https://github.com/vltmedia/BasicSR.git@<sha>".
+
+    Raises:
+        RuntimeError: If the ref cannot be resolved, rather than building an image whose cache key depends on the network.
+    """
+    import re
+    import subprocess
+    match = re.match(r"^(?P<name>[\w.\-\[\], ]+@\s*)?git\+(?P<url>[^#\s]+)(?P<fragment>#\S*)?$", package.strip())
+    if match is None:
+        return package
+    url = match.group("url")
+    ref = None
+    # A ref follows the last "@" of the repository path, "git@host" style users come before it
+    if "@" in url and url.rindex("@") > url.rindex("/"):
+        url, ref = url[:url.rindex("@")], url[url.rindex("@") + 1:]
+    if ref is not None and re.fullmatch(r"[0-9a-f]{40}", ref):
+        return package
+    try:
+        output = subprocess.run(["git", "ls-remote", url, ref or "HEAD", f"{ref or 'HEAD'}^{{}}"], capture_output=True, text=True, timeout=60, check=True).stdout
+    except (OSError, subprocess.SubprocessError) as error:
+        raise RuntimeError(f"Could not resolve {package} with git ls-remote, pin a commit sha in the spec instead: {error}") from error
+    lines = [line.split() for line in output.splitlines() if line.strip() != ""]
+    if len(lines) == 0:
+        raise RuntimeError(f"Could not resolve {package}: unknown ref {ref or 'HEAD'}")
+    # Annotated tags are listed twice, the peeled "^{}" entry is the commit
+    peeled = [line for line in lines if line[-1].endswith("^{}")]
+    sha = (peeled or lines)[0][0]
+    return f"{match.group('name') or ''}git+{url}@{sha}{match.group('fragment') or ''}"
+
+def buildWheels(packages:list, wheelhouse:str = wheelhousePath, volumeName:str = ""):
+    """
+    Builds wheels for the given packages into the wheelhouse, unless they are already there, and installs them.
+    Runs inside the image during the build, see `UAIModal.installWheels`.
+
+    Wheels are stored per (python version, platform) and per package spec, so pinning a git commit or a
+    version in the spec gives every source revision its own cache entry. Unpinned git specs are pinned to
+    their current commit first, see `resolvePackageSpec`. `pip wheel` downloads an existing
+    binary wheel from the index instead of compiling when one is available.
+
+    Args:
+        packages (list): The pip requirement specs to build, for example ["dlib==19.24.6", "git+https://github.com/vltmedia/BasicSR.git@<sha>"].
+        wheelhouse (str, optional): The wheelhouse directory. Defaults to wheelhousePath.
+        volumeName (str, optional): The Modal volume backing the wheelhouse, committed after new wheels are built. Defaults to "".
+
+    Returns:
+        list: The installed wheel paths.
+    """
+    import sys
+    import glob
+    import shutil
+    import hashlib
+    import tempfile
+    import sysconfig
+    import subprocess
+    platformTag = sysconfig.get_platform().replace("-", "_").replace(".", "_")
+    tag = f"cp{sys.version_info.major}{sys.version_info.minor}-{platformTag}"
+    wheels = []
+    built = False
+    for package in packages:
+        package = resolvePackageSpec(package)
+        key = hashlib.sha1(package.encode("utf-8")).hexdigest()[:16]
+        directory = os.path.join(wheelhouse, tag, key)
+        found = glob.glob(os.path.join(directory, "*.whl"))
+        if len(found) == 0:
+            print(f"Building wheel for {package}")
+            buildDir = tempfile.mkdtemp()
+            subprocess.check_call([sys.executable, "-m", "pip", "wheel", "--no-deps", "--no-cache-dir", "-w", buildDir, package])
+            os.makedirs(directory, exist_ok=True)
+            for wheel in glob.glob(os.path.join(buildDir, "*.whl")):
+                shutil.move(wheel, directory)
+            shutil.rmtree(buildDir, ignore_errors=True)
+            found = glob.glob(os.path.join(directory, "*.whl"))
+            built = True
+        else:
+            print(f"Reusing wheel for {package}: {os.path.basename(found[0])}")
+        wheels += found
+    subprocess.check_call([sys.executable, "-m", "pip", "install", "--no-cache-dir"] + wheels)
+    if built and volumeName != "":
+        modal.Volume.from_name(volumeName).commit()
+    return wheels
+
+
+def recordImportProfile(modules:list, path:str = preloadListPath, minMs:float = 5.0) -> dict:
+    """
+    Imports the given modules in a fresh interpreter with `-X importtime` and saves the import profile and the
+    preload list to `path`. Runs inside the image during the build, see `UAIModal.optimizeColdStart`.
+
+    The preload list holds the top-level imports that took at least `minMs`, in the order they completed, so
+    importing them in that order from a container-enter hook (see `uaimodal.utils.PreloadModules`) does the
+    same work the first request would have done.
+
+    Args:
+        modules (list): The modules to import. Modules that are not installed are skipped.
+        path (str, optional): The JSON file to write. Defaults to preloadListPath.
+        minMs (float, optional): Minimum cumulative import time for a module to be preloaded. Defaults to 5.0.
+
+    Returns:
+        dict: The saved profile, with "preload" and "profile" entries.
+    """
+    import sys
+    import subprocess
+    # Interpreter startup imports are reported too, so the script marks where its own imports begin
+    marker = "uaimodal-import-profile"
+    script = f"import sys\nsys.stderr.write({marker!r} + '\\n')\n" + "".join(f"try:\n    __import__({module!r})\nexcept Exception:\n    pass\n" for module in modules) + "import json\nprint(json.dumps(list(sys.modules)))\n"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", script], capture_output=True, text=True)
+    lines = result.stderr.splitlines()
+    lines = lines[lines.index(marker) + 1:] if marker in lines else lines
+    profile = []
+    for line in lines:
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        selfUs, cumulativeUs, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        profile.append({"module": name.strip(), "depth": depth, "selfMs": int(selfUs) / 1000, "cumulativeMs": int(cumulativeUs) / 1000})
+    # Failed imports are reported too, so only keep modules that ended up loaded
+    imported = set(json.loads(result.stdout.strip().splitlines()[-1]))
+    preload = [entry["module"] for entry in profile if entry["depth"] == 0 and entry["cumulativeMs"] >= minMs and entry["module"] in imported]
+    preload += [module for module in modules if module in imported and module not in preload]
+    data = {"modules": modules, "preload": preload, "totalMs": sum(entry["cumulativeMs"] for entry in profile if entry["depth"] == 0),
+            "profile": sorted(profile, key=lambda entry: entry["cumulativeMs"], reverse=True)[:100]}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(data, f, indent=4)
+    print(f"Recorded {len(preload)} preload modules ({data['totalMs']:.0f} ms) to {path}")
+    return data
+
+def getPytorchCudaVersion(cudaVersion:float = 12.4, customCommand:str = ""):
+    """
+    Returns the CUDA version of the torch wheel `UAIModal.installPytorch` installs for the given arguments.
+
+    Args:
+        cudaVersion (float, optional): The cudaVersion passed to installPytorch. Defaults to 12.4.
+        customCommand (str, optional): The customCommand passed to installPytorch. Defaults to "".
+
+    Returns:
+        str: The CUDA version, for example "12.4", or None for CPU wheels and custom commands.
+    """
+    if customCommand != "" or cudaVersion == 0:
+        return None
+    if cudaVersion in [12.1, 12.4]:
+        return str(cudaVersion)
+    return "11.8"
+
+def cudaBaseImage(cudaVersion:float = 12.4, profile:str = "runtime", distro:str = "ubuntu22.04") -> str:
+    """
+    Returns the NVIDIA CUDA base image tag for a CUDA profile, to use with `initCudaContainer` or
+    `UAIModal(baseClass=Image.from_registry, tag=...)` instead of installing CUDA on debian_slim.
+
+    Args:
+        cudaVersion (float, optional): The CUDA version. Defaults to 12.4.
+        profile (str, optional): "runtime", "cudnn" or "devel". Defaults to "runtime".
+        distro (str, optional): The base image distribution. Defaults to "ubuntu22.04".
+
+    Returns:
+        str: The image tag, for example "nvidia/cuda:12.4.1-runtime-ubuntu22.04".
+    """
+    if profile not in cudaProfiles:
+        raise ValueError(f"Unknown CUDA profile: {profile}. Expected one of {list(cudaProfiles)}")
+    if str(cudaVersion) not in cudaImageVersions:
+        raise ValueError(f"No NVIDIA base image known for CUDA {cudaVersion}. Expected one of {list(cudaImageVersions)}")
+    flavor = {"runtime": "runtime", "cudnn": "cudnn-runtime", "devel": "devel"}[profile]
+    return f"nvidia/cuda:{cudaImageVersions[str(cudaVersion)]}-{flavor}-{distro}"
+
+def runCachedCommands(commands:list, cacheDir:str = installerCachePath, volumeName:str = ""):
+    """
+    Runs install commands with pip and uv caches pointed at a mounted volume, so downloads are shared
+    across builds without being stored in the image layer. Runs inside the image during the build, see
+    `UAIModal.setInstaller`.
+
+    Args:
+        commands (list): The shell commands to run, in order.
+        cacheDir (str, optional): The mounted cache directory. Defaults to installerCachePath.
+        volumeName (str, optional): The Modal volume backing the cache, committed after the commands run. Defaults to "".
+
+    Returns:
+        None
+    """
+    import subprocess
+    env = dict(os.environ)
+    env["PIP_CACHE_DIR"] = os.path.join(cacheDir, "pip")
+    env["UV_CACHE_DIR"] = os.path.join(cacheDir, "uv")
+    # The cache volume and site-packages are on different filesystems, so uv cannot hardlink
+    env["UV_LINK_MODE"] = "copy"
+    for command in commands:
+        print(command)
+        subprocess.check_call(command, shell=True, env=env)
+    if volumeName != "":
+        modal.Volume.from_name(volumeName).commit()
 
 
 class UAIModal():
-    def __init__(self,appName="Untitled", pythonVersion="3.11", baseClass=Image.debian_slim, **kwargs):
+    def __init__(self,appName="Untitled", pythonVersion="3.11", baseClass=Image.debian_slim, dryRun=False, profileBuild=False, **kwargs):
+        """
+        Args:
+            appName (str, optional): The name of the Modal app. Defaults to "Untitled".
+            pythonVersion (str, optional): The Python version of the image. Defaults to "3.11".
+            baseClass (Image, optional): The Modal image constructor to start from. Defaults to Image.debian_slim.
+            dryRun (bool, optional): Only record the build steps, without creating a Modal image or app. Defaults to False.
+            profileBuild (bool, optional): Add a marker layer after every build step so `readBuildProfile` can report per-step wall time, layer size and cache hits. Defaults to False.
+            **kwargs: Passed to the base image constructor.
+        """
         self.pythonVersion = pythonVersion
-        if baseClass == Image.debian_slim:
-            self.image = Image.debian_slim(**kwargs)
-        elif baseClass == Image.from_dockerfile:
-            self.image = Image.from_dockerfile(**kwargs)
-        elif baseClass == Image.from_aws_ecr:
-            self.image = Image.from_aws_ecr(**kwargs)
-        elif baseClass == Image.from_gcp_artifact_registry:
-            self.image = Image.from_gcp_artifact_registry(**kwargs)
-        elif baseClass == Image.from_registry:
-            self.image = Image.from_registry(**kwargs)
-        self.app = modal.App(appName)
+        self.appName = appName
+        self.dryRun = dryRun
+        self.profileBuild = profileBuild
+        self.devMode = os.environ.get("UAIMODAL_DEV_MODE", "") == "1"
+        self.ignorePatterns = list(defaultIgnorePatterns)
+        self.mounts = []
+        self.steps = []
+        self.currentStep = None
+        self.wheelhouse = None
+        self.appPaths = []
+        self.servingFunctions = []
+        self.cudaVersion = None
+        self.torchCudaVersion = None
+        self.installer = "pip"
+        self.installerCacheVolume = ""
+        self.installerReady = True
+        self.baseImage = None
+        self.image = None
+        self.app = None
+        baseName = getattr(baseClass, "__name__", str(baseClass))
+        self.steps.append({"index": 0, "method": "__init__", "args": {"baseClass": baseName, **describeValue(kwargs)}, "ops": [{"op": baseName, "args": [], "kwargs": describeValue(kwargs)}], "localSeconds": 0.0})
+        if not dryRun:
+            if baseClass == Image.debian_slim:
+                self.image = Image.debian_slim(**kwargs)
+            elif baseClass == Image.from_dockerfile:
+                self.image = Image.from_dockerfile(**kwargs)
+            elif baseClass == Image.from_aws_ecr:
+                self.image = Image.from_aws_ecr(**kwargs)
+            elif baseClass == Image.from_gcp_artifact_registry:
+                self.image = Image.from_gcp_artifact_registry(**kwargs)
+            elif baseClass == Image.from_registry:
+                self.image = Image.from_registry(**kwargs)
+            self.app = modal.App(appName)
+        if profileBuild:
+            self.addProfileMarker(self.steps[0])
 
         
     def applyAppImage(self):
         """
         Run this when you are finished with the image and want to apply it to the app.
         """
-        self.app.image = self.image
+        if not self.dryRun:
+            self.app.image = self.image
+        return self
+
+    def addImageOp(self, op:str, *args, **kwargs):
+        """
+        Applies a Modal image method, for example "run_commands" or "pip_install", and records it on the current build step.
+        Modal images are immutable, so the resulting image replaces `self.image`.
+
+        Args:
+            op (str): The name of the modal.Image method.
+            *args: Positional arguments for the method.
+            **kwargs: Keyword arguments for the method.
+
+        Returns:
+            UAIModal: The UAIModal object.
+        """
+        step = self.currentStep if self.currentStep is not None else self.steps[-1]
+        step["ops"].append({"op": op, "args": describeValue(list(args)), "kwargs": describeValue(kwargs)})
+        if not self.dryRun:
+            self.image = getattr(self.image, op)(*args, **kwargs)
+        return self
+
+    def addProfileMarker(self, step:dict):
+        """
+        Adds a layer that records the time and the image size after the given step. Only used when profileBuild is set.
+
+        Args:
+            step (dict): The build step that just finished.
+        """
+        marker = f"{buildProfilePath}/{step['index']:04d}"
+        command = f"mkdir -p {buildProfilePath} && echo \"{step['index']} {step['method']} $(date +%s.%N) $(du -skx / 2>/dev/null | cut -f1)\" > {marker}"
+        if not self.dryRun:
+            self.image = self.image.run_commands([command])
+
+    def buildReport(self, profile:list = None) -> dict:
+        """
+        Returns a report of every build step with the method and arguments that emitted it and the image operations it added.
+
+        Args:
+            profile (list, optional): The output of `readBuildProfile` from a profiled build. When given, each step also gets wallSeconds, layerSizeKB and cacheHit. Defaults to None.
+
+        Returns:
+            dict: The report, with one entry per step in "steps".
+        """
+        records = {record["index"]: record for record in (profile or [])}
+        steps = []
+        for step in self.steps:
+            entry = {
+                "index": step["index"],
+                "method": step["method"],
+                "args": step["args"],
+                "ops": step["ops"],
+                "localSeconds": step["localSeconds"],
+            }
+            if step["index"] in records:
+                record = records[step["index"]]
+                entry["wallSeconds"] = record["wallSeconds"]
+                entry["layerSizeKB"] = record["layerSizeKB"]
+                entry["cacheHit"] = record["cacheHit"]
+            steps.append(entry)
+        report = {"app": self.appName, "dryRun": self.dryRun, "steps": steps, "functions": self.servingFunctions}
+        if profile is not None:
+            measured = [step for step in steps if step.get("wallSeconds") is not None]
+            report["totalWallSeconds"] = sum(step["wallSeconds"] for step in measured)
+            report["slowestSteps"] = [step["method"] for step in sorted(measured, key=lambda step: step["wallSeconds"], reverse=True)[:5]]
+        return report
+
+    def saveBuildReport(self, path:str, profile:list = None):
+        """
+        Saves the build report as JSON.
+
+        Args:
+            path (str): The path of the JSON file.
+            profile (list, optional): The output of `readBuildProfile` from a profiled build. Defaults to None.
+
+        Returns:
+            UAIModal: The UAIModal object.
+        """
+        with open(path, "w") as f:
+            json.dump(self.buildReport(profile), f, indent=4)
         return self
         
         
+    @buildStep
     def installUtils(self):
         """
         Install necessary utilities in the given image.
@@ -35,30 +575,25 @@ class UAIModal():
         Returns:
             Image: The updated image with utilities installed.
         """
-        (self.image
-        .run_commands([
+        self.addImageOp("run_commands", [
                 "apt update",
                 "apt install -y unzip wget git ",
-                        ]
-                      
-                      )
-        .pip_install(["requests"])
-        )
+                        ])
+        self.installPackages(["requests"])
         return self
         
 
+    @buildStep
     def installAWS(self):
         """
         Installs the AWS Boto3 library in the given image.
         
         """
-        (
-            self.image
-            .pip_install(["botocore", "boto3"])
-        )
+        self.installPackages(["botocore", "boto3"])
         return self
 
 
+    @buildStep
     def installFlask(self):
         """
         Installs Flask and Flask-Cors packages in the given image.
@@ -66,12 +601,11 @@ class UAIModal():
         Returns:
             Image: The updated image with the packages installed.
         """
-        (self.image
-                .pip_install(["flask", "flask_cors"])
-        )
+        self.installPackages(["flask", "flask_cors"])
         return self
         
 
+    @buildStep
     def installPythonRequirementsLocal(self, localPath:str = "requirements.txt"):
         """
         Installs Python requirements from a given file into the specified Docker image.
@@ -82,12 +616,11 @@ class UAIModal():
         Returns:
             Image: The updated Docker image with the requirements installed.
         """
-        (self.image
-                .copy_local_file(localPath, "/root/requirements.txt")
-                .run_commands(["pip install -r /root/requirements.txt"])
-        )
+        self.addImageOp("copy_local_file", localPath, "/root/requirements.txt")
+        self.addInstallCommands([self.pipCommand("-r /root/requirements.txt")])
         return self
         
+    @buildStep
     def installPythonRequirementsServer(self, serverPath:str = "/root/requirements.txt"):
         """
         Installs Python requirements from a given requirements.txt file on the server.
@@ -98,11 +631,10 @@ class UAIModal():
         Returns:
             Image: The updated Docker image with the installed requirements.
         """
-        (self.image
-                .run_commands([f"pip install -r {serverPath}"])
-        )
+        self.addInstallCommands([self.pipCommand(f"-r {serverPath}")])
         return self
 
+    @buildStep
     def copyLocalFileAndDirectories(self, items:list = []):
         """
         Copies local directories to the image.
@@ -123,12 +655,146 @@ class UAIModal():
             outputPath = file[1]
             if outputPath == "":
                 outputPath = f"/root/{baseName}"
+            if self.devMode:
+                self.addMount(inputPath, outputPath)
+                continue
+            self.appPaths.append(outputPath)
             if isFile:
-                self.image.copy_local_file(inputPath, outputPath)
-            else:
-                self.image.copy_local_dir(inputPath, outputPath)
+                self.addImageOp("copy_local_file", inputPath, outputPath)
+                continue
+            matcher = IgnoreMatcher.fromDirectory(inputPath, self.ignorePatterns)
+            mount = {"local": inputPath, "ignore": matcher.patterns}
+            if not self.dryRun:
+                mount = modal.Mount.from_local_dir(inputPath, remote_path="/", condition=matcher.include)
+            self.addImageOp("copy_mount", mount, remote_path=outputPath)
+            self.currentOp()["source"] = {"local": inputPath, "ignore": matcher.patterns}
+        return self
+
+    def toDockerfile(self, strict:bool = True) -> str:
+        """
+        Returns the recorded build steps as a Dockerfile for BuildKit, see `uaimodal.dockerfile.renderDockerfile`.
+        Local paths are relative to the current directory, which is the build context.
+
+        Args:
+            strict (bool, optional): Raises a ValueError if a step cannot be exported, otherwise warns. Defaults to True.
+
+        Returns:
+            str: The Dockerfile.
+        """
+        from uaimodal.dockerfile import renderDockerfile
+        return renderDockerfile(self, strict)[0]
+
+    def saveDockerfile(self, path:str = "Dockerfile", strict:bool = True):
+        """
+        Saves the recorded build steps as a Dockerfile, and the ignore patterns of copied directories as `<path>.dockerignore`,
+        which BuildKit reads instead of the context's .dockerignore. Build it with `DOCKER_BUILDKIT=1 docker build -f <path> .`
+
+        Args:
+            path (str, optional): The Dockerfile path. Defaults to "Dockerfile".
+            strict (bool, optional): Raises a ValueError if a step cannot be exported, otherwise warns. Defaults to True.
+
+        Returns:
+            UAIModal: The UAIModal object.
+        """
+        from uaimodal.dockerfile import renderDockerfile
+        dockerfile, dockerignore = renderDockerfile(self, strict)
+        with open(path, "w") as f:
+            f.write(dockerfile)
+        if dockerignore != "":
+            with open(path + ".dockerignore", "w") as f:
+                f.write(dockerignore)
+        return self
+
+    def currentOp(self) -> dict:
+        """
+        Returns:
+            dict: The last image operation recorded on the current build step.
+        """
+        step = self.currentStep if self.currentStep is not None else self.steps[-1]
+        return step["ops"][-1]
+
+    def setDevMode(self, enabled:bool = True):
+        """
+        In dev mode, the files and directories passed to `copyLocalFiles` and `copyLocalDirectories` are mounted
+        into the serving functions at runtime instead of being copied into the image, so editing local code
+        does not rebuild the image. Modal only uploads mounted files whose content changed. Call it before the
+        copy steps. Dev mode is also enabled by the UAIMODAL_DEV_MODE=1 environment variable.
+
+        Args:
+            enabled (bool, optional): Whether to mount instead of copy. Defaults to True.
+
+        Returns:
+            UAIModal: The UAIModal object.
+        """
+        self.devMode = enabled
         return self
 
+    def setIgnorePatterns(self, patterns:list = [], replace:bool = False):
+        """
+        Sets the gitignore-style patterns left out of copied and mounted directories. Each directory's own
+        .gitignore and .modalignore files are applied after them.
+
+        Args:
+            patterns (list, optional): The patterns, for example ["datasets/", "*.ckpt"]. Defaults to [].
+            replace (bool, optional): Replace defaultIgnorePatterns instead of adding to them. Defaults to False.
+
+        Returns:
+            UAIModal: The UAIModal object.
+        """
+        self.ignorePatterns = list(patterns) if replace else list(defaultIgnorePatterns) + list(patterns)
+        return self
+
+    def addMount(self, localPath:str, remotePath:str):
+        """
+        Mounts a local file or directory into the serving functions registered with `addServingFunction`.
+        For directories, prints how many files changed since the last run.
+
+        Args:
+            localPath (str): The local file or directory.
+            remotePath (str): Where it is mounted in the container.
+
+        Returns:
+            UAIModal: The UAIModal object.
+        """
+        step = self.currentStep if self.currentStep is not None else self.steps[-1]
+        record = {"op": "mount", "args": [localPath, remotePath], "kwargs": {}}
+        if os.path.isfile(localPath):
+            mount = None if self.dryRun else modal.Mount.from_local_file(localPath, remote_path=remotePath)
+        else:
+            matcher = IgnoreMatcher.fromDirectory(localPath, self.ignorePatterns)
+            record["kwargs"] = {"ignore": matcher.patterns, "changedFiles": self.countChangedFiles(localPath, matcher)}
+            mount = None if self.dryRun else modal.Mount.from_local_dir(localPath, remote_path=remotePath, condition=matcher.include)
+        step["ops"].append(record)
+        if mount is not None:
+            self.mounts.append(mount)
+        return self
+
+    def countChangedFiles(self, localPath:str, matcher:IgnoreMatcher) -> int:
+        """
+        Hashes the included files of a directory and compares them with the hashes saved by the previous run.
+
+        Args:
+            localPath (str): The directory.
+            matcher (IgnoreMatcher): The files to leave out.
+
+        Returns:
+            int: The number of added, changed or removed files.
+        """
+        import hashlib
+        hashes = HashLocalFiles(localPath, matcher)
+        manifest = os.path.join(mountManifestPath, hashlib.sha1(os.path.abspath(localPath).encode("utf-8")).hexdigest()[:16] + ".json")
+        previous = {}
+        if os.path.exists(manifest):
+            with open(manifest) as f:
+                previous = json.load(f)
+        changed = len([path for path in set(hashes) | set(previous) if hashes.get(path) != previous.get(path)])
+        os.makedirs(mountManifestPath, exist_ok=True)
+        with open(manifest, "w") as f:
+            json.dump(hashes, f)
+        print(f"Mounting {localPath}: {len(hashes)} files, {changed} changed")
+        return changed
+
+    @buildStep
     def copyLocalFiles(self, files: list = []):
         """
         Copy local files and directories to the specified image.
@@ -147,6 +813,7 @@ class UAIModal():
 
 
 
+    @buildStep
     def copyLocalDirectories (self, directories: list = []):
         """
         Copy local directories to the specified image.
@@ -163,6 +830,7 @@ class UAIModal():
         self.copyLocalFileAndDirectories( directories)
         return self
 
+    @buildStep
     def makeDirectories (self, directories: list = []):
         """
         Make directories in the specified image.
@@ -175,7 +843,7 @@ class UAIModal():
             Image: The updated image with the copied directories.
         """
         for directory in directories:
-            self.image.run_commands([f"mkdir -p {directory}"])
+            self.addImageOp("run_commands", [f"mkdir -p {directory}"])
         return self
 
         
@@ -199,6 +867,7 @@ class UAIModal():
         
         
 
+    @buildStep
     def setEnvironmentVariable(self, variable:dict= {"DEV": "True"}):
         """
         Sets an environment variable in the image.
@@ -209,10 +878,11 @@ class UAIModal():
         Returns:
             Image: The updated image with the environment variable set.
         """
-        self.image.env(variable)
+        self.addImageOp("env", variable)
         return self
         
 
+    @buildStep
     def setEnvironmentVariables(self, variables:list= []):
         """
         Sets multiple environment variables in the image.
@@ -225,12 +895,84 @@ class UAIModal():
         """
         for variable in variables:
             key = next(iter(variable))
-            self.setEnvironmentVariable({key, variable[key]})
+            self.setEnvironmentVariable({key: variable[key]})
         return self
         
+    def addServingFunction(self, function, preset:str = "", **options):
+        """
+        Registers a serving function or web endpoint on the app, with the image built so far. Call it after every build step.
+
+        The options are validated, see `validateServingOptions`, and start from `preset` (see servingPresets):
+            - gpu (str): The GPU type, for example "A10G" or "H100:2". None for CPU only.
+            - cpu (float), memory (int): CPU cores and memory in MB.
+            - timeout (int): Seconds before an input is cancelled.
+            - keep_warm (int): Containers kept running even without traffic.
+            - container_idle_timeout (int): Seconds an idle container is kept before it is scaled down.
+            - allow_concurrent_inputs (int): Inputs a single container handles at once.
+            - concurrency_limit (int): Maximum number of containers.
+            - retries (int): Retries for failed inputs.
+            - max_batch_size (int), wait_ms (int): Dynamic batching with `modal.batched`. The function then takes and returns lists.
+            - web (str): "wsgi" (Flask apps), "asgi" or "endpoint" (`modal.web_endpoint`). "" for a plain function.
+            - method (str): The HTTP method of a web endpoint.
+            - secrets (list), volumes (dict): Passed to the function.
+
+        Example:
+            >>> @uModal.servingFunction("diffusers", gpu="A100")
+            >>> def generate(prompts: list[str]) -> list[bytes]:
+
+        Args:
+            function (callable): The function. Must be defined at module level.
+            preset (str, optional): A key of servingPresets. Defaults to "".
+            **options: Options overriding the preset.
+
+        Returns:
+            modal.Function: The registered function, or `function` itself in dry runs.
+        """
+        options = getServingOptions(preset, **options)
+        self.servingFunctions.append({"name": function.__name__, "preset": preset, "options": describeValue(options)})
+        if self.dryRun:
+            return function
+        if options["max_batch_size"] > 0:
+            function = modal.batched(max_batch_size=options["max_batch_size"], wait_ms=options["wait_ms"])(function)
+        if options["web"] == "wsgi":
+            function = modal.wsgi_app()(function)
+        elif options["web"] == "asgi":
+            function = modal.asgi_app()(function)
+        elif options["web"] == "endpoint":
+            function = modal.web_endpoint(method=options["method"])(function)
+        kwargs = {key: options[key] for key in ["gpu", "cpu", "memory", "timeout", "keep_warm", "container_idle_timeout", "retries", "secrets", "volumes"]}
+        if options["allow_concurrent_inputs"] > 1:
+            kwargs["allow_concurrent_inputs"] = options["allow_concurrent_inputs"]
+        if options["concurrency_limit"] is not None:
+            kwargs["concurrency_limit"] = options["concurrency_limit"]
+        if len(self.mounts) > 0:
+            kwargs["mounts"] = self.mounts
+        return self.app.function(image=self.image, **kwargs)(function)
+
+    def servingFunction(self, preset:str = "", **options):
+        """
+        Decorator form of `addServingFunction`.
+
+        Example:
+            >>> @uModal.servingFunction("flask")
+            >>> def web():
+            >>>     return flaskApp
+
+        Args:
+            preset (str, optional): A key of servingPresets. Defaults to "".
+            **options: Options overriding the preset.
+
+        Returns:
+            callable: The decorator.
+        """
+        def decorator(function):
+            return self.addServingFunction(function, preset, **options)
+        return decorator
+
     def emptyFunction ():
         print("Empty Function")
         
+    @buildStep
     def runFunctions(self, functions:list= []):
         """
         Runs a list of functions on the given image.
@@ -259,9 +1001,10 @@ class UAIModal():
             network_file_systems = self.getDictValue(functDict, "network_file_system", {})
             secrets = self.getDictValue(functDict, "secrets", [])
             function_ = self.getDictValue(functDict, "function", self.emptyFunction)
-            self.image.run_function(function_, gpu=gpu, cpu=cpu, memory=memory, timeout=timeout, force_build=force_build, mounts=mounts, network_file_systems=network_file_systems, secrets=secrets)
+            self.addImageOp("run_function", function_, gpu=gpu, cpu=cpu, memory=memory, timeout=timeout, force_build=force_build, mounts=mounts, network_file_systems=network_file_systems, secrets=secrets)
         return self
 
+    @buildStep
     def installFirebase(self, serviceFile:str):
         """
         Installs Firebase and copies the service account file to the image.
@@ -272,12 +1015,158 @@ class UAIModal():
         Returns:
             Image: The updated image with Firebase installed.
         """
-        (self.image
-                .pip_install(["firebase_admin"])
-                .copy_local_file(serviceFile, "/root/serviceAccount.json")
-        )
+        self.installPackages(["firebase_admin"])
+        self.addFirebaseServiceFile(serviceFile)
+        return self
+
+    @buildStep
+    def addFirebaseServiceFile(self, serviceFile:str):
+        """
+        Copies the Firebase service account file to the image, for images that already have firebase_admin installed.
+
+        Args:
+            serviceFile (str): The path to the service account file.
+
+        Returns:
+            UAIModal: The UAIModal object.
+        """
+        self.addImageOp("copy_local_file", serviceFile, "/root/serviceAccount.json")
         return self
         
+    def useWheelhouse(self, volumeName:str = "uaimodal-wheelhouse", localPath:str = ""):
+        """
+        Installs source-built packages (see `installWheels`) from a wheelhouse instead of compiling them on every uncached build.
+
+        Args:
+            volumeName (str, optional): The Modal volume that stores the wheels. Wheels missing from the volume are built once and added to it. Defaults to "uaimodal-wheelhouse".
+            localPath (str, optional): A local directory of prebuilt Linux wheels to install from instead of a volume. Defaults to "".
+
+        Returns:
+            UAIModal: The UAIModal object.
+        """
+        self.wheelhouse = {"volumeName": volumeName, "localPath": localPath}
+        return self
+
+    @buildStep
+    def installWheels(self, packages:list = []):
+        """
+        Installs packages that are usually compiled from source, such as dlib or git dependencies. With a wheelhouse
+        (see `useWheelhouse`) each package is built once per python version, platform and package spec, and later
+        builds install the cached wheel. Without a wheelhouse the packages are installed with pip as usual.
+
+        Git specs without a commit are pinned to the commit their branch or tag points to when the image is
+        defined locally (see `resolvePackageSpec`), so a new upstream commit changes the layer and the wheel
+        cache key. Dry runs and the image definition inside running containers skip the lookup.
+
+        Args:
+            packages (list): The pip requirement specs to install. Pin versions so cached wheels stay correct.
+
+        Returns:
+            UAIModal: The UAIModal object.
+        """
+        if not self.dryRun and modal.is_local():
+            packages = [resolvePackageSpec(package) for package in packages]
+        if self.wheelhouse is None:
+            self.addInstallCommands([self.pipCommand(package) for package in packages])
+        elif self.wheelhouse["localPath"] != "":
+            self.addImageOp("copy_local_dir", self.wheelhouse["localPath"], "/root/wheelhouse")
+            self.addImageOp("run_commands", [f"pip install --no-cache-dir --find-links /root/wheelhouse --prefer-binary {' '.join(packages)}"])
+        else:
+            self.addVolumeFunction(buildWheels, {"packages": packages, "volumeName": self.wheelhouse["volumeName"]}, self.wheelhouse["volumeName"], wheelhousePath)
+        return self
+
+    def addVolumeFunction(self, function, kwargs:dict, volumeName:str, mountPath:str):
+        """
+        Runs a uaimodal build helper inside the image with a Modal volume mounted, for build steps whose cache must outlive image layers.
+
+        Args:
+            function (callable): A module-level function from uaimodal.deploy.
+            kwargs (dict): Keyword arguments for the function.
+            volumeName (str): The Modal volume to mount. Created if missing.
+            mountPath (str): Where to mount the volume.
+
+        Returns:
+            UAIModal: The UAIModal object.
+        """
+        volumes = {mountPath: volumeName}
+        mounts = []
+        if not self.dryRun:
+            volumes = {mountPath: modal.Volume.from_name(volumeName, create_if_missing=True)}
+            # The function is imported from uaimodal inside the build container
+            mounts = [modal.Mount.from_local_python_packages("uaimodal")]
+        self.addImageOp("run_function", function, kwargs=kwargs, volumes=volumes, mounts=mounts)
+        return self
+
+    def setInstaller(self, installer:str = "pip", cacheVolume:str = ""):
+        """
+        Selects the tool used for every Python package install step.
+
+        Args:
+            installer (str, optional): "pip" or "uv". uv resolves and downloads packages in parallel, which is much faster for large stacks such as torch and diffusers. Defaults to "pip".
+            cacheVolume (str, optional): A Modal volume to keep the pip/uv download cache in. The cache is mounted only while install steps run, so it is shared across builds and apps but never stored in an image layer. Defaults to "" (no cache is kept and layers are built with --no-cache-dir).
+
+        Returns:
+            UAIModal: The UAIModal object.
+        """
+        if installer not in ["pip", "uv"]:
+            raise ValueError(f"Unknown installer: {installer}. Expected 'pip' or 'uv'")
+        self.installer = installer
+        self.installerCacheVolume = cacheVolume
+        self.installerReady = installer == "pip"
+        return self
+
+    def pipCommand(self, arguments:str) -> str:
+        """
+        Returns the install command for the selected installer.
+
+        Args:
+            arguments (str): The arguments after "pip install", for example "-r /root/requirements.txt".
+
+        Returns:
+            str: The shell command.
+        """
+        noCache = self.installerCacheVolume == ""
+        if self.installer == "uv":
+            return f"uv pip install --system {'--no-cache ' if noCache else ''}{arguments}"
+        return f"pip install {'--no-cache-dir ' if noCache else ''}{arguments}"
+
+    def addInstallCommands(self, commands:list):
+        """
+        Adds install commands to the image, with the installer cache volume mounted when one is set.
+
+        Args:
+            commands (list): The shell commands to run.
+
+        Returns:
+            UAIModal: The UAIModal object.
+        """
+        if not self.installerReady:
+            self.installerReady = True
+            self.addImageOp("run_commands", ["pip install --no-cache-dir uv"])
+        if self.installerCacheVolume == "":
+            self.addImageOp("run_commands", commands)
+        else:
+            self.addVolumeFunction(runCachedCommands, {"commands": commands, "volumeName": self.installerCacheVolume}, self.installerCacheVolume, installerCachePath)
+        return self
+
+    def installPackages(self, packages:list = []):
+        """
+        Installs Python packages with the selected installer. With the default pip installer and no cache volume this
+        is Modal's own pip_install step.
+
+        Args:
+            packages (list): The pip requirement specs to install.
+
+        Returns:
+            UAIModal: The UAIModal object.
+        """
+        if self.installer == "pip" and self.installerCacheVolume == "":
+            self.addImageOp("pip_install", packages, extra_options="--no-cache-dir")
+        else:
+            self.addInstallCommands([self.pipCommand(" ".join(f"'{package}'" for package in packages))])
+        return self
+
+    @buildStep
     def installCMake(self):
         """
         Installs CMake and dlib on the given image.
@@ -286,12 +1175,12 @@ class UAIModal():
         Returns:
             Image: The updated image with CMake and dlib installed.
         """
-        (self.image
-                .run_commands("apt install -y cmake")
-            .pip_install(["cmake", "dlib"])
-        )
+        self.addImageOp("run_commands", "apt install -y cmake")
+        self.installPackages(["cmake"])
+        self.installWheels([dlibPackage])
         return self
 
+    @buildStep
     def installFFMPEG(self):
         """
         Installs FFMPEG and required libraries in the given Docker image.
@@ -300,17 +1189,15 @@ class UAIModal():
         Returns:
             Image: The modified Docker image with FFMPEG installed.
         """
-        (self.image
-                .run_commands(["apt install -y ffmpeg libsm6 libxext6 "])
-        )
+        self.addImageOp("run_commands", ["apt install -y ffmpeg libsm6 libxext6 "])
         return self
 
+    @buildStep
     def installUAIDiffusers(self):
         """
         Installs the UAIDiffusers library.
         """
-        (self.image
-            .pip_install( "numpy", "pillow", 
+        self.installPackages(["numpy", "pillow", 
             "opencv-python",
             "flask",
             "flask_cors",
@@ -329,13 +1216,13 @@ class UAIModal():
             "onnx",
             "uaiDiffusers",
             "imageio",
-            "accelerate")
-            .run_commands(["pip uninstall basicsr -y"])
-            .run_commands(["pip install git+https://github.com/vltmedia/BasicSR.git"])
-        )
+            "accelerate"])
+        self.addImageOp("run_commands", ["pip uninstall basicsr -y"])
+        self.installWheels([basicsrPackage])
         return self
 
 
+    @buildStep
     def installPytorch(self, cudaVersion:int = 12.4,  customCommand:str = ""):
         """
         Installs PyTorch with the specified CUDA version or a custom command.
@@ -347,18 +1234,21 @@ class UAIModal():
         Returns:
             Image: The updated image with PyTorch installed.
         """
-        command = "pip3 install torch torchvision torchaudio --index-url https://download.pytorch.org/whl/cu118"
+        command = self.pipCommand("torch torchvision torchaudio --index-url https://download.pytorch.org/whl/cu118")
         if cudaVersion == 12.1:
-            command = "pip3 install torch torchvision torchaudio --index-url https://download.pytorch.org/whl/cu121"
+            command = self.pipCommand("torch torchvision torchaudio --index-url https://download.pytorch.org/whl/cu121")
         if cudaVersion == 12.4:
-            command = "pip3 install torch torchvision torchaudio --index-url https://download.pytorch.org/whl/cu124"
+            command = self.pipCommand("torch torchvision torchaudio --index-url https://download.pytorch.org/whl/cu124")
         if cudaVersion == 0:
-            command = "pip3 install torch torchvision torchaudio"
+            command = self.pipCommand("torch torchvision torchaudio")
         if customCommand != "":
             command = customCommand
-        self.image.run_commands([command])
+        self.torchCudaVersion = getPytorchCudaVersion(cudaVersion, customCommand)
+        self.checkCudaCompatibility()
+        self.addInstallCommands([command])
         return self
         
+    @buildStep
     def installGitModule(self, gitUrl:str, outputPath = "/root"):
         """
         Clones a git repository from the specified URL and copies its contents to the specified output path.
@@ -370,12 +1260,10 @@ class UAIModal():
         Returns:
             Image: The updated image object after the installation.
         """
-        (
-            self.image
-            .run_commands([f"git clone --recursive {gitUrl} /root/tempDir && cp -r /root/tempDir/. {outputPath}/ && rm -rf /root/tempDir"])
-        )
+        self.addImageOp("run_commands", [f"git clone --recursive {gitUrl} /root/tempDir && cp -r /root/tempDir/. {outputPath}/ && rm -rf /root/tempDir"])
         return self
 
+    @buildStep
     def installOpenCV(self):
         """
         Installs OpenCV and its dependencies on the provided image.
@@ -384,14 +1272,13 @@ class UAIModal():
         Returns:
             Image: The updated image with OpenCV installed.
         """
-        (self.image
-                .run_commands(["apt-get install -y libgl1-mesa-glx libglib2.0-0"])
-                .pip_install(["opencv-python"])
-        )
+        self.addImageOp("run_commands", ["apt-get install -y libgl1-mesa-glx libglib2.0-0"])
+        self.installPackages(["opencv-python"])
         return self
 
 
 
+    @buildStep
     def installMoviePy(self):
         """
         Installs the MoviePy library in the given image.
@@ -400,14 +1287,13 @@ class UAIModal():
         Returns:
             Image: The updated image with MoviePy installed.
         """
-        (self.image
-                .pip_install(["moviepy"])
-        )
+        self.installPackages(["moviepy"])
         return self
 
 
 
 
+    @buildStep
     def installMediaPipe(self):
         """
         Installs the MediaPipe library.
@@ -417,34 +1303,125 @@ class UAIModal():
             Image: The input image.
 
         """
-        (self.image
-                .pip_install(["mediapipe"])
-        )
+        self.installPackages(["mediapipe"])
+        return self
+
+    def checkCudaCompatibility(self):
+        """
+        Checks that the CUDA installed by `installCuda` and the CUDA of the torch wheel installed by `installPytorch`
+        have the same major version. torch loads its own bundled CUDA libraries, but extensions compiled against the
+        system CUDA and libraries shared between the two fail on a major version mismatch.
+
+        Raises:
+            ValueError: If the major versions differ.
+        """
+        if self.cudaVersion is None or self.torchCudaVersion is None:
+            return
+        if str(self.cudaVersion).split(".")[0] != str(self.torchCudaVersion).split(".")[0]:
+            raise ValueError(f"CUDA {self.cudaVersion} does not match the CUDA {self.torchCudaVersion} torch wheel. Use the same major version in installCuda and installPytorch")
+
+    @buildStep
+    def installCuda(self, cudaVersion:float = 12.4, profile:str = "runtime", distro:str = "debian12"):
+        """
+        Installs a CUDA profile from NVIDIA's network apt repository, in a single layer that also removes the apt lists and installer files.
+
+        Profiles:
+            - runtime: The CUDA runtime libraries (cuBLAS, cuFFT, cuRAND, cuSOLVER, cuSPARSE, NPP, NVRTC, nvJPEG). No compilers.
+            - cudnn: The runtime libraries and the cuDNN 9 runtime.
+            - devel: The full CUDA toolkit, including nvcc, for images that compile CUDA extensions.
+
+        torch wheels bundle the CUDA libraries they need, so images that only run torch usually need no CUDA profile at all.
+        For a smaller image that starts from NVIDIA's own runtime image, see `cudaBaseImage` and `initCudaContainer`.
+
+        Args:
+            cudaVersion (float, optional): The CUDA version. Defaults to 12.4.
+            profile (str, optional): "runtime", "cudnn" or "devel". Defaults to "runtime".
+            distro (str, optional): The NVIDIA repository distribution, matching the base image. Defaults to "debian12".
+
+        Returns:
+            UAIModal: The UAIModal object.
+        """
+        if profile not in cudaProfiles:
+            raise ValueError(f"Unknown CUDA profile: {profile}. Expected one of {list(cudaProfiles)}")
+        self.cudaVersion = str(cudaVersion)
+        self.checkCudaCompatibility()
+        major, minor = self.cudaVersion.split(".")[:2]
+        packages = " ".join(package.format(version=f"{major}-{minor}", major=major) for package in cudaProfiles[profile])
+        repository = f"https://developer.download.nvidia.com/compute/cuda/repos/{distro}/x86_64"
+        self.addImageOp("run_commands", [
+            "apt-get update && apt-get install -y --no-install-recommends wget ca-certificates"
+            f" && wget -q {repository}/cuda-keyring_1.1-1_all.deb && dpkg -i cuda-keyring_1.1-1_all.deb && rm cuda-keyring_1.1-1_all.deb"
+            f" && apt-get update && apt-get install -y --no-install-recommends {packages}"
+            " && apt-get clean && rm -rf /var/lib/apt/lists/*"
+        ])
+        environment = {"LD_LIBRARY_PATH": f"/usr/local/cuda-{major}.{minor}/lib64"}
+        if profile == "devel":
+            environment["CUDA_HOME"] = f"/usr/local/cuda-{major}.{minor}"
+            environment["PATH"] = f"/usr/local/cuda-{major}.{minor}/bin:/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"
+        self.addImageOp("env", environment)
         return self
 
+    @buildStep
     def installCuda12_4(self):
         """
-        Installs CUDA 12.4 on the specified image.
+        Installs CUDA 12.4 on the specified image. Equivalent to installCuda(12.4, "devel"), which installs the full
+        toolkit from the network repository instead of the multi-GB local installer.
 
 
         Returns:
             Image: The modified image with CUDA 12.4 installed.
         """
-        (self.image
-        .pip_install(["cuda-python"])
-        .copy_local_file("cuda-keyring_1.1-1_all.deb", "/root/cuda-keyring_1.1-1_all.deb")
-        .run_commands(["apt-get install wget","wget https://developer.download.nvidia.com/compute/cuda/12.4.1/local_installers/cuda-repo-debian11-12-4-local_12.4.1-550.54.15-1_amd64.deb",
-    "dpkg -i cuda-repo-debian11-12-4-local_12.4.1-550.54.15-1_amd64.deb",
-    "cp /var/cuda-repo-debian11-12-4-local/cuda-*-keyring.gpg /usr/share/keyrings/",
-    "apt-get -y install software-properties-common",
-    "add-apt-repository contrib",
-    "apt-get update",
-    "apt-get -y install cuda-toolkit-12-4"
-                    ])
-        .env({"CUDA_HOME": "/usr/local/cuda-12"})
-        )
+        self.installPackages(["cuda-python"])
+        self.installCuda(12.4, "devel")
+        return self
+
+    @buildStep
+    def optimizeColdStart(self, preloadModules:list = None, appPaths:list = None, stripPackages:list = None, preloadMinMs:float = 5.0):
+        """
+        Final build stage that reduces container cold start. Call it after every other step.
+
+        - Strips test suites, docs and stale __pycache__ directories from heavy packages in site-packages.
+        - Precompiles site-packages to bytecode, with unchecked hash-based .pyc files so imports skip the source timestamp checks,
+          and precompiles the copied app code, with regular timestamp-based .pyc files so replaced or mounted code is recompiled.
+        - Records an import profile and a preload list, see `recordImportProfile`. Load it in a container-enter hook:
+
+        ```
+        @app.cls(image=uModal.image, gpu="A10G")
+        class Model:
+            @modal.enter()
+            def load(self):
+                from uaimodal.utils import PreloadModules
+                PreloadModules()
+        ```
+
+        Args:
+            preloadModules (list, optional): Modules to profile. Defaults to None (coldStartModules).
+            appPaths (list, optional): App code paths to precompile. Defaults to None (the paths copied with copyLocalFiles and copyLocalDirectories).
+            stripPackages (list, optional): Packages to strip. Defaults to None (coldStartStripPackages).
+            preloadMinMs (float, optional): Minimum import time for a module to be preloaded. Defaults to 5.0.
+
+        Returns:
+            UAIModal: The UAIModal object.
+        """
+        preloadModules = coldStartModules if preloadModules is None else preloadModules
+        appPaths = self.appPaths if appPaths is None else appPaths
+        stripPackages = coldStartStripPackages if stripPackages is None else stripPackages
+        site = "SITE=$(python -c 'import sysconfig; print(sysconfig.get_paths()[\"purelib\"])')"
+        # Some packages ship files that are not valid Python, for example templates, so compile errors are not fatal
+        commands = [
+            f"{site} && for package in {' '.join(stripPackages)}; do if [ -d \"$SITE/$package\" ]; then "
+            "find \"$SITE/$package\" -type d \\( -name tests -o -name docs \\) -prune -exec rm -rf {} +; fi; done"
+            " && find \"$SITE\" -type d -name __pycache__ -prune -exec rm -rf {} +",
+            f"{site} && (python -m compileall -q -j 0 --invalidation-mode unchecked-hash \"$SITE\" || true)",
+        ]
+        if len(appPaths) > 0:
+            commands.append(f"python -m compileall -q -j 0 {' '.join(appPaths)} || true")
+        self.addImageOp("run_commands", commands)
+        mounts = [] if self.dryRun else [modal.Mount.from_local_python_packages("uaimodal")]
+        self.addImageOp("run_function", recordImportProfile, kwargs={"modules": preloadModules, "path": preloadListPath, "minMs": preloadMinMs}, mounts=mounts)
         return self
 
+    @buildStep
     def downloadFile(self, url:str, outputPath:str):
         """
         Downloads a file from the specified URL and saves it to the specified output path.
@@ -456,10 +1433,11 @@ class UAIModal():
         Returns:
             Image: The updated image with the downloaded file.
         """
-        self.image.run_commands(["ls /root/",f"wget -O {outputPath} \"{url}\" " ])
+        self.addImageOp("run_commands", ["ls /root/",f"wget -O {outputPath} \"{url}\" " ])
 
         return self
 
+    @buildStep
     def unzipFile(self, filePath:str, outputPath:str, removeOriginal:bool = True):
         """
         Unzips a file at the specified path and saves it to the specified output path.
@@ -474,12 +1452,134 @@ class UAIModal():
         command = f"unzip {filePath} -d {outputPath}"
         if removeOriginal:
             command += f" && rm {filePath}"
-        self.image.run_commands([command])
+        self.addImageOp("run_commands", [command])
         return self
         
 
 
-def initContainer(appName:str="untitled", baseClass: Image =Image.debian_slim, python_version:str="3.11" )-> UAIModal:
+def initCudaContainer(appName:str="untitled", cudaVersion:float=12.4, profile:str="runtime", python_version:str="3.11", dryRun:bool=False, profileBuild:bool=False) -> UAIModal:
+    """
+    Initializes a container from NVIDIA's CUDA base image for the given profile, see `cudaBaseImage`.
+
+    Parameters:
+        appName (str): The name of the app. Default is "untitled".
+        cudaVersion (float): The CUDA version. Default is 12.4.
+        profile (str): "runtime", "cudnn" or "devel". Default is "runtime".
+        python_version (str): The Python version added to the image. Default is "3.11".
+        dryRun (bool): Only record the build steps, without creating a Modal image or app. Default is False.
+        profileBuild (bool): Add per-step timing and size markers to the image, see `readBuildProfile`. Default is False.
+
+    Returns:
+        UAIModal: The initialized UAIModal object.
+    """
+    uModal = UAIModal(appName=appName, pythonVersion=python_version, baseClass=Image.from_registry, dryRun=dryRun, profileBuild=profileBuild,
+                      tag=cudaBaseImage(cudaVersion, profile), add_python=python_version)
+    uModal.cudaVersion = str(cudaVersion)
+    return uModal
+
+def getBaseImageName(python_version:str = "3.11", cudaVersion:float = 12.4, ffmpeg:bool = True, firebase:bool = True) -> str:
+    """
+    Returns the catalog name of the base image for the given options, for example "uai-py3.11-cu12.4-ffmpeg-firebase-v1".
+
+    Args:
+        python_version (str, optional): The Python version. Defaults to "3.11".
+        cudaVersion (float, optional): The CUDA version of the PyTorch wheels, 0 for CPU wheels. Defaults to 12.4.
+        ffmpeg (bool, optional): Whether the image includes FFmpeg. Defaults to True.
+        firebase (bool, optional): Whether the image includes firebase_admin. Defaults to True.
+
+    Returns:
+        str: The base image name.
+    """
+    cuda = f"cu{cudaVersion}" if cudaVersion != 0 else "cpu"
+    return f"uai-py{python_version}-{cuda}{'-ffmpeg' if ffmpeg else ''}{'-firebase' if firebase else ''}-v{baseImageVersion}"
+
+def registerBaseImage(python_version:str = "3.11", cudaVersion:float = 12.4, ffmpeg:bool = True, firebase:bool = True) -> str:
+    """
+    Adds a base image to the catalog, so `warmBaseImages` builds it.
+
+    Args:
+        python_version (str, optional): The Python version. Defaults to "3.11".
+        cudaVersion (float, optional): The CUDA version of the PyTorch wheels, 0 for CPU wheels. Defaults to 12.4.
+        ffmpeg (bool, optional): Whether the image includes FFmpeg. Defaults to True.
+        firebase (bool, optional): Whether the image includes firebase_admin. Defaults to True.
+
+    Returns:
+        str: The base image name.
+    """
+    name = getBaseImageName(python_version, cudaVersion, ffmpeg, firebase)
+    baseImageCatalog[name] = {"python_version": python_version, "cudaVersion": cudaVersion, "ffmpeg": ffmpeg, "firebase": firebase}
+    return name
+
+def initBaseImage(python_version:str = "3.11", cudaVersion:float = 12.4, ffmpeg:bool = True, firebase:bool = True, appName:str = "", dryRun:bool = False, profileBuild:bool = False) -> UAIModal:
+    """
+    Initializes a container from a catalog base image: debian_slim, the UAI utils, FFmpeg, Flask, PyTorch, MoviePy and firebase_admin.
+
+    Modal caches image layers by their definition, so the base image is only built once and every app that
+    starts from it reuses the same layers. The base is always built the same way, with the pip installer
+    and no app-specific settings, so that its definition is identical across apps. App-specific steps,
+    such as the Firebase service account file, go after it.
+
+    Args:
+        python_version (str, optional): The Python version. Defaults to "3.11".
+        cudaVersion (float, optional): The CUDA version of the PyTorch wheels, 0 for CPU wheels. Defaults to 12.4.
+        ffmpeg (bool, optional): Whether the image includes FFmpeg. Defaults to True.
+        firebase (bool, optional): Whether the image includes firebase_admin. Defaults to True.
+        appName (str, optional): The name of the app. Defaults to "" (the base image name).
+        dryRun (bool, optional): Only record the build steps, without creating a Modal image or app. Defaults to False.
+        profileBuild (bool, optional): Add per-step timing and size markers to the image, see `readBuildProfile`. Defaults to False.
+
+    Returns:
+        UAIModal: The UAIModal object, with `baseImage` set to the base image name.
+    """
+    name = registerBaseImage(python_version, cudaVersion, ffmpeg, firebase)
+    uModal = initContainer(appName=appName if appName != "" else name, baseClass=modal.Image.debian_slim, python_version=python_version, dryRun=dryRun, profileBuild=profileBuild)
+    uModal.installUtils()
+    if ffmpeg:
+        uModal.installFFMPEG()
+    uModal.installFlask()
+    uModal.installPytorch(cudaVersion=cudaVersion)
+    uModal.installMoviePy()
+    if firebase:
+        uModal.installPackages(["firebase_admin"])
+    uModal.setEnvironmentVariable({"UAIMODAL_BASE_IMAGE": name})
+    uModal.baseImage = name
+    return uModal
+
+def warmBaseImages(names:list = None, rebuild:bool = False) -> list:
+    """
+    Builds the catalog base images on Modal, so apps that start from them find every layer cached.
+
+    Args:
+        names (list, optional): The base image names to build. Defaults to None (every image in the catalog).
+        rebuild (bool, optional): Rebuild the images even if they are cached. Defaults to False.
+
+    Returns:
+        list: The names of the images that were built.
+    """
+    names = list(baseImageCatalog) if names is None else names
+    for name in names:
+        if name not in baseImageCatalog:
+            raise ValueError(f"Unknown base image: {name}. Expected one of {list(baseImageCatalog)}")
+    previous = os.environ.get("MODAL_FORCE_BUILD")
+    if rebuild:
+        os.environ["MODAL_FORCE_BUILD"] = "1"
+    try:
+        app = modal.App("uaimodal-base-images")
+        images = [initBaseImage(**baseImageCatalog[name]).image for name in names]
+        with modal.enable_output():
+            with app.run():
+                for name, image in zip(names, images):
+                    print(f"Building {name}")
+                    image.build(app)
+    finally:
+        # Only these images are rebuilt, not the ones built later in the same process
+        if rebuild and previous is None:
+            os.environ.pop("MODAL_FORCE_BUILD", None)
+        elif rebuild:
+            os.environ["MODAL_FORCE_BUILD"] = previous
+    return names
+
+def initContainer(appName:str="untitled", baseClass: Image =Image.debian_slim, python_version:str="3.11", dryRun:bool=False, profileBuild:bool=False )-> UAIModal:
     """
     Initializes a container for the given app name, base class, and Python version.
 
@@ -487,17 +1587,19 @@ def initContainer(appName:str="untitled", baseClass: Image =Image.debian_slim, p
         appName (str): The name of the app. Default is "untitled".
         baseClass (Image): The base class for the container. Default is Image.debian_slim.
         python_version (str): The Python version to use. Default is "3.11".
+        dryRun (bool): Only record the build steps, without creating a Modal image or app. Default is False.
+        profileBuild (bool): Add per-step timing and size markers to the image, see `readBuildProfile`. Default is False.
 
     Returns:
         tuple (App, UAIModal): A tuple containing the initialized app and image objects.
     """
     
-    uModal = UAIModal(appName=appName,python_version=python_version,baseClass=baseClass)
+    uModal = UAIModal(appName=appName,python_version=python_version,baseClass=baseClass, dryRun=dryRun, profileBuild=profileBuild)
     return uModal
 
 
  
-def initUAIContainer(appName="untitled", python_version = "3.11", firebaseServiceJson = "", cudaVersion=12.4, pytorchCustom = "",ffmpeg=True, newDirectories=[]) -> UAIModal:
+def initUAIContainer(appName="untitled", python_version = "3.11", firebaseServiceJson = "", cudaVersion=12.4, pytorchCustom = "",ffmpeg=True, newDirectories=[], dryRun=False, profileBuild=False, installer="pip", installerCacheVolume="", useBaseImage=False) -> UAIModal:
     """
     Create a new container that UAI usually uses for its applications.
 
@@ -509,12 +1611,25 @@ def initUAIContainer(appName="untitled", python_version = "3.11", firebaseServic
         pytorchCustom (str, optional): Custom command for installing PyTorch. Defaults to "".
         ffmpeg (bool, optional): Whether to install FFMPEG. Defaults to True.
         newDirectories (list, optional): List of new directories to be created in the container. Defaults to [].
+        dryRun (bool, optional): Only record the build steps, without creating a Modal image or app. Defaults to False.
+        profileBuild (bool, optional): Add per-step timing and size markers to the image, see `readBuildProfile`. Defaults to False.
+        installer (str, optional): The Python package installer, "pip" or "uv", see `UAIModal.setInstaller`. Defaults to "pip".
+        installerCacheVolume (str, optional): A Modal volume for the installer download cache, see `UAIModal.setInstaller`. Defaults to "".
+        useBaseImage (bool, optional): Start from the shared catalog base image instead of building the same layers per app, see `initBaseImage`. Ignored with pytorchCustom. Defaults to False.
 
     Returns:
         UAIModal: The initialized UAIModal object.
     """
     
-    uModal = initContainer(appName=appName, baseClass= modal.Image.debian_slim, python_version = python_version)
+    if useBaseImage and pytorchCustom == "":
+        uModal = initBaseImage(python_version=python_version, cudaVersion=cudaVersion, ffmpeg=ffmpeg, firebase=firebaseServiceJson != "", appName=appName, dryRun=dryRun, profileBuild=profileBuild)
+        uModal.setInstaller(installer, installerCacheVolume)
+        uModal.makeDirectories(newDirectories)
+        if firebaseServiceJson != "":
+            uModal.addFirebaseServiceFile(firebaseServiceJson)
+        return uModal
+    uModal = initContainer(appName=appName, baseClass= modal.Image.debian_slim, python_version = python_version, dryRun=dryRun, profileBuild=profileBuild)
+    uModal.setInstaller(installer, installerCacheVolume)
     uModal.makeDirectories(newDirectories)
     uModal.installUtils()
     if ffmpeg:
@@ -526,7 +1641,7 @@ def initUAIContainer(appName="untitled", python_version = "3.11", firebaseServic
         uModal.installFirebase( firebaseServiceJson)
     return uModal
 
-def initFullAppContainer(appName="untitled", python_version="3.11", firebaseServiceJson="", cudaVersion=12.4, fileDirectories=[], cmake=False, filesToDownload=[], filesToUnzip=[], gitModules=[], requirementsLocal="", requirementsServer="", postFunctions=[], pytorchCustom="", ffmpeg=True, newDirectories=[]) -> UAIModal:
+def initFullAppContainer(appName="untitled", python_version="3.11", firebaseServiceJson="", cudaVersion=12.4, fileDirectories=[], cmake=False, filesToDownload=[], filesToUnzip=[], gitModules=[], requirementsLocal="", requirementsServer="", postFunctions=[], pytorchCustom="", ffmpeg=True, newDirectories=[], dryRun=False, profileBuild=False, wheelhouseVolume="", installer="pip", installerCacheVolume="", useBaseImage=False, coldStart=False, devMode=False) -> UAIModal:
     """
     Initializes a full application container with the specified configurations.
 
@@ -546,12 +1661,24 @@ def initFullAppContainer(appName="untitled", python_version="3.11", firebaseServ
         pytorchCustom (str, optional): The path to the custom PyTorch installation. Defaults to "".
         ffmpeg (bool, optional): Whether to install FFmpeg. Defaults to True.
         newDirectories (list, optional): A list of new directories to create in the container. Defaults to [].
+        dryRun (bool, optional): Only record the build steps, without creating a Modal image or app. Defaults to False.
+        profileBuild (bool, optional): Add per-step timing and size markers to the image, see `readBuildProfile`. Defaults to False.
+        wheelhouseVolume (str, optional): The Modal volume used to cache source-built wheels such as dlib, see `UAIModal.useWheelhouse`. Defaults to "" (build from source).
+        installer (str, optional): The Python package installer, "pip" or "uv", see `UAIModal.setInstaller`. Defaults to "pip".
+        installerCacheVolume (str, optional): A Modal volume for the installer download cache, see `UAIModal.setInstaller`. Defaults to "".
+        useBaseImage (bool, optional): Start from the shared catalog base image, see `initBaseImage`. Defaults to False.
+        coldStart (bool, optional): Finish with the cold-start optimization stage, see `UAIModal.optimizeColdStart`. Defaults to False.
+        devMode (bool, optional): Mount fileDirectories at runtime instead of copying them into the image, see `UAIModal.setDevMode`. Defaults to False.
 
     Returns:
         UAIModal: The initialized UAIModal object.
     """
     
-    uModal = initUAIContainer(appName=appName, python_version=python_version, firebaseServiceJson=firebaseServiceJson, cudaVersion=cudaVersion, pytorchCustom=pytorchCustom, ffmpeg=ffmpeg, newDirectories=newDirectories)
+    uModal = initUAIContainer(appName=appName, python_version=python_version, firebaseServiceJson=firebaseServiceJson, cudaVersion=cudaVersion, pytorchCustom=pytorchCustom, ffmpeg=ffmpeg, newDirectories=newDirectories, dryRun=dryRun, profileBuild=profileBuild, installer=installer, installerCacheVolume=installerCacheVolume, useBaseImage=useBaseImage)
+    if devMode:
+        uModal.setDevMode()
+    if wheelhouseVolume != "":
+        uModal.useWheelhouse(volumeName=wheelhouseVolume)
     for gitModule in gitModules:
         uModal.installGitModule(gitModule[0], gitModule[1])
     if cmake:
@@ -567,4 +1694,12 @@ def initFullAppContainer(appName="untitled", python_version="3.11", firebaseServ
     if requirementsServer != "":
         uModal.installPythonRequirementsServer(requirementsServer)
     uModal.runFunctions(postFunctions)
-    return uModal
\ No newline at end of file
+    if coldStart:
+        uModal.optimizeColdStart()
+    return uModal
+
+
+# The default catalog, one base image per CUDA version supported by installPytorch
+registerBaseImage(python_version="3.11", cudaVersion=12.4, ffmpeg=True, firebase=True)
+registerBaseImage(python_version="3.11", cudaVersion=12.1, ffmpeg=True, firebase=True)
+registerBaseImage(python_version="3.11", cudaVersion=11.8, ffmpeg=True, firebase=True)
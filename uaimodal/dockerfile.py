@@ -0,0 +1,228 @@
+import os
+import re
+import json
+import shlex
+import inspect
+import warnings
+
+# BuildKit cache mounts, so package downloads are reused across builds without ending up in a layer
+aptCacheMounts = "--mount=type=cache,target=/var/cache/apt,sharing=locked --mount=type=cache,target=/var/lib/apt,sharing=locked"
+pipCacheMount = "--mount=type=cache,target=/root/.cache/pip"
+uvCacheMount = "--mount=type=cache,target=/root/.cache/uv"
+
+# Lets apt keep downloaded packages in the cache mount. The Debian images delete them after every install by default
+aptCacheSetup = "rm -f /etc/apt/apt.conf.d/docker-clean && echo 'Binary::apt::APT::Keep-Downloaded-Packages \"true\";' > /etc/apt/apt.conf.d/keep-cache"
+
+
+def getCacheMounts(command:str) -> str:
+    """
+    Returns the BuildKit cache mounts for a shell command, based on the package managers it runs.
+
+    Args:
+        command (str): The shell command.
+
+    Returns:
+        str: The --mount options, or "" if the command needs none.
+    """
+    mounts = []
+    if "apt-get " in command or "apt " in command:
+        mounts.append(aptCacheMounts)
+    if "pip install" in command or "pip wheel" in command:
+        mounts.append(uvCacheMount if "uv pip" in command else pipCacheMount)
+    return " ".join(mounts)
+
+def removeNoCacheOptions(command:str) -> str:
+    """
+    Removes the options that disable the pip and uv caches, since the exported builds keep their caches in cache mounts.
+
+    Args:
+        command (str): The shell command.
+
+    Returns:
+        str: The command without --no-cache-dir and --no-cache.
+    """
+    return command.replace("--no-cache-dir ", "").replace(" --no-cache-dir", "").replace("--no-cache ", "")
+
+def renderRun(command:str, extraMounts:str = "") -> str:
+    mounts = " ".join(mount for mount in [extraMounts, getCacheMounts(command)] if mount != "")
+    return f"RUN {mounts + ' ' if mounts != '' else ''}{removeNoCacheOptions(command)}"
+
+def renderBase(step:dict, pythonVersion:str) -> list:
+    """
+    Renders the FROM instructions of the first build step.
+
+    Args:
+        step (dict): The "__init__" build step.
+        pythonVersion (str): The Python version of the image.
+
+    Returns:
+        list: The Dockerfile lines.
+    """
+    op = step["ops"][0]
+    kwargs = op["kwargs"]
+    if op["op"] == "debian_slim":
+        version = kwargs.get("python_version", pythonVersion)
+        return [f"FROM python:{version}-slim-bookworm"]
+    if op["op"] == "from_registry":
+        tag = kwargs.get("tag", op["args"][0] if len(op["args"]) > 0 else "")
+        if kwargs.get("add_python") is None:
+            return [f"FROM {tag}"]
+        # Like Modal's add_python, adds a standalone Python to an image that has none
+        return [f"FROM python:{kwargs['add_python']}-slim-bookworm AS python", f"FROM {tag}",
+                "COPY --from=python /usr/local /usr/local", "RUN ldconfig"]
+    return [f"# The base image was built with {op['op']}({json.dumps(kwargs)}). Pass its tag as BASE_IMAGE", "ARG BASE_IMAGE", "FROM ${BASE_IMAGE}"]
+
+def toContextPath(path:str) -> str:
+    """
+    Returns a local path relative to the Docker build context, the current directory.
+
+    Args:
+        path (str): The local path.
+
+    Returns:
+        str: The relative path, with / separators.
+    """
+    relative = os.path.relpath(os.path.abspath(path)).replace(os.sep, "/")
+    if relative.startswith(".."):
+        raise ValueError(f"{path} is outside the build context {os.getcwd()}. Export the Dockerfile from a parent directory")
+    return relative
+
+def toDockerignore(local:str, patterns:list) -> list:
+    """
+    Converts gitignore-style patterns relative to a copied directory to .dockerignore patterns relative to the build context.
+
+    Args:
+        local (str): The copied directory.
+        patterns (list): The gitignore-style patterns, see `uaimodal.utils.IgnoreMatcher`.
+
+    Returns:
+        list: The .dockerignore lines.
+    """
+    lines = []
+    for pattern in patterns:
+        negate = "!" if pattern.startswith("!") else ""
+        pattern = pattern.lstrip("!").rstrip("/")
+        anchored = "/" in pattern
+        pattern = pattern.lstrip("/")
+        for suffix in ["", "/**"]:
+            lines.append(f"{negate}{local}/{'' if anchored else '**/'}{pattern}{suffix}")
+    return lines
+
+def isInstallStep(op:dict) -> bool:
+    """
+    Returns True if an operation is rendered as plain RUN instructions that can take a bind mount: shell commands,
+    or the installer cache helper that runs them with a volume mounted.
+    """
+    if op["op"] == "run_commands":
+        return True
+    return op["op"] == "run_function" and op["args"][0] == "runCachedCommands"
+
+def renderFunction(op:dict, extraMounts:str = "") -> list:
+    """
+    Renders a build-time `run_function` step as RUN instructions. The uaimodal build helpers get equivalent
+    commands with cache mounts, other module-level functions are inlined with a BuildKit heredoc.
+
+    Args:
+        op (dict): The recorded run_function operation.
+        extraMounts (str, optional): Mounts added to the install commands, for example a bind mounted requirements file. Defaults to "".
+
+    Returns:
+        list: The Dockerfile lines, or None if the function is not a uaimodal.deploy function and cannot be exported.
+    """
+    import uaimodal.deploy as deploy
+    name = op["args"][0] if isinstance(op["args"][0], str) else op["args"][0].__name__
+    kwargs = op["kwargs"].get("kwargs") or {}
+    if name == "buildWheels":
+        # The pip cache mount keeps the wheels pip builds, so it replaces the wheelhouse volume
+        return [renderRun(f"pip install {' '.join(shlex.quote(package) for package in kwargs['packages'])}", extraMounts)]
+    if name == "runCachedCommands":
+        return [renderRun(command, extraMounts) for command in kwargs["commands"]]
+    function = getattr(deploy, name, None)
+    if function is None or not inspect.isfunction(function):
+        return None
+    arguments = ", ".join(f"{key}={value!r}" for key, value in kwargs.items())
+    source = inspect.getsource(function)
+    # Module constants the function uses, for example as argument defaults
+    constants = [f"{key} = {value!r}" for key, value in vars(deploy).items()
+                 if isinstance(value, (str, int, float, bool)) and not key.startswith("_") and re.search(rf"\b{key}\b", source)]
+    return ["RUN python <<'EOF'", "import os, json, time"] + constants + [source.rstrip("\n"), f"{name}({arguments})", "EOF"]
+
+def renderDockerfile(uModal, strict:bool = True) -> tuple:
+    """
+    Renders the build steps recorded on a UAIModal object as a Dockerfile for BuildKit.
+
+    apt and pip steps use cache mounts instead of Modal's no-cache options. Requirements files that are only
+    needed by the install that uses them, with or without the installer cache volume, are bind mounted
+    instead of copied. Other local files and directories are copied, with the ignore patterns of copied
+    directories written to a .dockerignore file.
+
+    Steps that cannot be exported, such as user functions passed to `runFunctions`, would make the Dockerfile
+    build a different image, so they raise unless `strict` is False.
+
+    Args:
+        uModal (UAIModal): The UAIModal object. Dry runs work too.
+        strict (bool, optional): Raises a ValueError listing the steps that cannot be exported. When False, they
+            are left as comments in the Dockerfile and reported with a warning. Defaults to True.
+
+    Returns:
+        tuple: The Dockerfile and the .dockerignore content.
+    """
+    ops = [op for step in uModal.steps[1:] for op in step["ops"]]
+    lines = ["# syntax=docker/dockerfile:1.7", f"# Exported from the UAIModal recipe of {uModal.appName}"]
+    lines += renderBase(uModal.steps[0], uModal.pythonVersion)
+    lines.append(f"RUN {aptCacheSetup}")
+    ignore = []
+    binds = {}
+    skipped = []
+
+    def skip(message):
+        skipped.append(message)
+        lines.append(f"# {message}")
+
+    for index, op in enumerate(ops):
+        args = op["args"]
+        kwargs = op["kwargs"]
+        name = op["op"]
+        if name == "run_commands":
+            commands = args[0] if isinstance(args[0], list) else list(args)
+            lines += [renderRun(command, binds.get(index, "")) for command in commands]
+        elif name == "pip_install":
+            packages = args[0] if isinstance(args[0], list) else list(args)
+            lines.append(renderRun(f"pip install {' '.join(shlex.quote(str(package)) for package in packages)}"))
+        elif name == "env":
+            lines += [f"ENV {key}={json.dumps(str(value))}" for key, value in args[0].items()]
+        elif name == "copy_local_file":
+            # The install may not follow the copy directly, for example when the installer itself is installed in between
+            users = [later for later in range(index + 1, len(ops)) if args[1] in json.dumps(ops[later])]
+            if args[1].endswith(".txt") and len(users) == 1 and isInstallStep(ops[users[0]]):
+                binds[users[0]] = f"--mount=type=bind,source={toContextPath(args[0])},target={args[1]}"
+            else:
+                lines.append(f"COPY {toContextPath(args[0])} {args[1]}")
+        elif name == "copy_local_dir":
+            lines.append(f"COPY {toContextPath(args[0])} {args[1]}")
+        elif name == "copy_mount":
+            source = op.get("source", args[0] if isinstance(args[0], dict) else None)
+            if source is None:
+                skip(f"copy_mount to {kwargs.get('remote_path')} is not exported: its source was not recorded")
+                continue
+            local = toContextPath(source["local"])
+            ignore += toDockerignore(local, source["ignore"])
+            lines.append(f"COPY {local} {kwargs.get('remote_path', '/')}")
+        elif name == "mount":
+            # Dev mode mounts are not part of the image, so the exported image copies them
+            lines.append(f"COPY {toContextPath(args[0])} {args[1]}")
+        elif name == "run_function":
+            rendered = renderFunction(op, binds.get(index, ""))
+            if rendered is None:
+                skip(f"run_function {args[0]} is not exported: it is not a uaimodal.deploy function")
+            else:
+                lines += rendered
+        else:
+            skip(f"{name} is not exported")
+    if len(skipped) > 0:
+        if strict:
+            raise ValueError("The Dockerfile would not reproduce the image, these steps cannot be exported: " + "; ".join(skipped)
+                             + ". Pass strict=False to export the other steps anyway")
+        for message in skipped:
+            warnings.warn(f"The exported Dockerfile differs from the image: {message}")
+    return "\n".join(lines) + "\n", "\n".join(ignore) + ("\n" if len(ignore) > 0 else "")
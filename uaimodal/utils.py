@@ -7,6 +7,9 @@ pythonPath = "python"
 
 projectDir = f"{rootPath}"
 
+# Written by the optimizeColdStart build stage, read by PreloadModules
+preloadListPath = "/root/.uaimodal/preload.json"
+
 def getRootPath(defaultPath = "/root"):
     """
     Returns the root path.
@@ -229,4 +232,220 @@ def SanitizeURL(url):
     """
     if "dropbox.com" in url:
         url = url.replace("www.dropbox.com", "dl.dropboxusercontent.com")
-    return url
\ No newline at end of file
+    return url
+
+def PreloadModules(path: str = preloadListPath, modules: list = None):
+    """
+    Imports the modules recorded by the `optimizeColdStart` build stage, in the recorded order.
+    Call it from a container-enter hook so the first request does not pay for the imports.
+
+    Args:
+        path (str, optional): The preload list written at build time. Defaults to preloadListPath.
+        modules (list, optional): Modules to import instead of the preload list. Defaults to None.
+
+    Returns:
+        dict: The import time in seconds per module. Modules that failed to import are left out.
+    """
+    import json
+    import time
+    import importlib
+    if modules is None:
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            modules = json.load(f)["preload"]
+    timings = {}
+    for module in modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(module)
+        except Exception:
+            continue
+        timings[module] = time.perf_counter() - start
+    return timings
+
+
+class IgnoreMatcher():
+    """
+    Matches paths against gitignore-style patterns.
+
+    Supported syntax: blank lines and # comments, ! negation, a trailing / for directories only, a leading or
+    inner / to anchor the pattern to the root, and the *, ?, [abc] and ** wildcards. A path inside an ignored
+    directory is always ignored, like in git.
+
+    Example:
+        >>> matcher = IgnoreMatcher([".git/", "*.pyc", "data/", "!data/config.json"], root="app")
+        >>> matcher.include("app/main.py")
+        True
+    """
+    def __init__(self, patterns: list = [], root: str = ""):
+        """
+        Args:
+            patterns (list, optional): The patterns, one per item. Defaults to [].
+            root (str, optional): The directory the patterns are relative to. Defaults to "".
+        """
+        self.root = root
+        self.patterns = []
+        self.rules = []
+        for pattern in patterns:
+            self.addPattern(pattern)
+
+    @classmethod
+    def fromDirectory(cls, root: str, patterns: list = [], ignoreFiles: list = [".gitignore", ".modalignore"]):
+        """
+        Creates a matcher from `patterns` and the ignore files found at the top of `root`.
+
+        Args:
+            root (str): The directory.
+            patterns (list, optional): Patterns applied before the ignore files. Defaults to [].
+            ignoreFiles (list, optional): Ignore file names read from `root`. Defaults to [".gitignore", ".modalignore"].
+
+        Returns:
+            IgnoreMatcher: The matcher.
+        """
+        matcher = cls(patterns, root)
+        for name in ignoreFiles:
+            path = os.path.join(root, name)
+            if os.path.isfile(path):
+                with open(path) as f:
+                    for line in f:
+                        matcher.addPattern(line)
+        return matcher
+
+    def addPattern(self, pattern: str):
+        """
+        Adds a pattern. Later patterns take precedence over earlier ones.
+
+        Args:
+            pattern (str): The pattern.
+        """
+        import re
+        pattern = pattern.rstrip("\r\n").rstrip(" ")
+        if pattern == "" or pattern.startswith("#"):
+            return
+        self.patterns.append(pattern)
+        negate = pattern.startswith("!")
+        if negate:
+            pattern = pattern[1:]
+        directoryOnly = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        anchored = "/" in pattern
+        pattern = pattern.lstrip("/")
+        regex = ""
+        i = 0
+        while i < len(pattern):
+            if pattern.startswith("**/", i):
+                regex += "(?:.*/)?"
+                i += 3
+            elif pattern.startswith("**", i):
+                regex += ".*"
+                i += 2
+            elif pattern[i] == "*":
+                regex += "[^/]*"
+                i += 1
+            elif pattern[i] == "?":
+                regex += "[^/]"
+                i += 1
+            elif pattern[i] == "[" and "]" in pattern[i + 1:]:
+                end = pattern.index("]", i + 1)
+                regex += "[" + pattern[i + 1:end].replace("!", "^", 1) + "]"
+                i = end + 1
+            else:
+                regex += re.escape(pattern[i])
+                i += 1
+        if not anchored:
+            regex = "(?:.*/)?" + regex
+        self.rules.append((re.compile("^" + regex + "$"), negate, directoryOnly))
+
+    def matches(self, path: str, isDirectory: bool = False) -> bool:
+        """
+        Args:
+            path (str): The path, relative to the root.
+            isDirectory (bool, optional): Whether the path is a directory. Defaults to False.
+
+        Returns:
+            bool: True if the path is ignored.
+        """
+        parts = [part for part in path.replace(os.sep, "/").split("/") if part not in ["", "."]]
+        for i in range(1, len(parts) + 1):
+            current = "/".join(parts[:i])
+            currentIsDirectory = isDirectory or i < len(parts)
+            ignored = False
+            for regex, negate, directoryOnly in self.rules:
+                if directoryOnly and not currentIsDirectory:
+                    continue
+                if regex.match(current):
+                    ignored = not negate
+            if ignored:
+                return True
+        return False
+
+    def include(self, path: str) -> bool:
+        """
+        Returns True if the file at `path` is not ignored. Can be used as the `condition` of a Modal mount.
+
+        Args:
+            path (str): The file path, absolute or relative to the current directory.
+
+        Returns:
+            bool: True if the file is included.
+        """
+        relative = os.path.relpath(os.path.abspath(path), os.path.abspath(self.root)) if self.root != "" else path
+        return not self.matches(relative, os.path.isdir(path))
+
+def HashLocalFiles(root: str, matcher: IgnoreMatcher = None) -> dict:
+    """
+    Returns the SHA-256 of every file under `root` that the matcher includes. Ignored directories are not walked.
+
+    Args:
+        root (str): The directory to hash.
+        matcher (IgnoreMatcher, optional): The files to leave out. Defaults to None (every file).
+
+    Returns:
+        dict: The hex digest per path relative to `root`, with / separators.
+    """
+    import hashlib
+    hashes = {}
+    for directory, directories, files in os.walk(root):
+        relativeDirectory = os.path.relpath(directory, root)
+        if matcher is not None:
+            directories[:] = [name for name in directories if not matcher.matches(os.path.join(relativeDirectory, name), True)]
+        for name in files:
+            relative = os.path.normpath(os.path.join(relativeDirectory, name)).replace(os.sep, "/")
+            if matcher is not None and matcher.matches(relative):
+                continue
+            digest = hashlib.sha256()
+            with open(os.path.join(directory, name), "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            hashes[relative] = digest.hexdigest()
+    return hashes
+
+def ConcatVideos(paths: list, outputPath: str, reencode: bool = False) -> str:
+    """
+    Joins video files end to end with FFmpeg's concat demuxer, for example the shards of a sharded job.
+
+    Without re-encoding the streams are copied, which is fast but requires every file to use the same codecs
+    and encoding settings, as shards rendered by the same worker code do.
+
+    Args:
+        paths (list): The video files, in playback order.
+        outputPath (str): The joined video file.
+        reencode (bool, optional): Re-encode with libx264 and AAC instead of copying the streams. Defaults to False.
+
+    Returns:
+        str: The output path.
+    """
+    import subprocess
+    import tempfile
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+        listPath = f.name
+    codecs = ["-c:v", "libx264", "-c:a", "aac"] if reencode else ["-c", "copy"]
+    try:
+        subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", listPath] + codecs + [outputPath], check=True)
+    finally:
+        os.remove(listPath)
+    return outputPath
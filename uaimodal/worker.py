@@ -0,0 +1,356 @@
+import threading
+import queue
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from uaimodal.api.job import getPendingJobs, claimJob, requeueJob, setJobFinished, updateJobResults, finishCancelledJob, JobWatcher, JobCancelled
+
+
+class JobWorker():
+    """
+    Runs uaimodal jobs through a pipelined worker loop.
+
+    A job goes through four stages: claim, prefetch, process and upload. Claiming and prefetching
+    run on background threads so the next job's inputs are already downloaded when the current job
+    finishes processing, and uploads run in the background so the processing thread can move straight
+    on to the next job. Processing always runs on the thread that calls `run()`, which keeps GPU work
+    on a single thread.
+
+    Each stage is a callable:
+        - prefetch(job) -> inputs: Downloads or prepares the job inputs. Defaults to returning the job's `request`.
+        - process(job, inputs) -> outputs: Runs the model.
+        - upload(job, outputs) -> result: Stores the outputs and returns the result saved on the job. Defaults to returning `outputs`.
+
+    When a `batcher` is given, compatible jobs are claimed together and `process` is called once per
+    batch as process(jobs, inputs) with lists of jobs and inputs, and must return a list of outputs in
+    the same order. Prefetch and upload still run per job, and the results of a batch are written
+    with a single batched write.
+
+    Claimed jobs are watched for cancellation, preemption and deletion, see `JobWatcher`. A job that is
+    signalled before it is processed is skipped, and its outputs are never written if it is signalled
+    while it is processed or uploaded. To stop sooner, `process` checks `worker.isCancelled(job)` or calls
+    `worker.checkCancelled(job)` between steps, and `onCancel` can interrupt work from another thread.
+    Cancelled jobs are moved to the finished collection with status 'cancelled', and preempted jobs are
+    returned to the pending collection.
+
+    Example:
+        >>> worker = JobWorker(process=runModel, prefetch=downloadInputs, upload=uploadOutputs, names=["sadtalker"])
+        >>> worker.installSignalHandlers()
+        >>> worker.run()
+    """
+    def __init__(self, process, prefetch=None, upload=None, names=None, pollInterval=2.0, prefetchDepth=2, prefetchWorkers=2, uploadWorkers=2, maxPendingUploads=4, batcher=None, scheduler=None, cancelInterval=2.0, onCancel=None):
+        """
+        Args:
+            process (callable): The processing stage, called as process(job, inputs).
+            prefetch (callable, optional): The prefetch stage, called as prefetch(job). Defaults to None.
+            upload (callable, optional): The upload stage, called as upload(job, outputs). Defaults to None.
+            names (list, optional): Only claim jobs whose `name` is in this list. Defaults to None (claim any job).
+            pollInterval (float, optional): Seconds to wait between polls when the queue is empty. Defaults to 2.0.
+            prefetchDepth (int, optional): Maximum number of claimed jobs (or batches) waiting to be processed. Defaults to 2.
+            prefetchWorkers (int, optional): Maximum number of concurrent prefetches. Defaults to 2.
+            uploadWorkers (int, optional): Maximum number of concurrent uploads. Defaults to 2.
+            maxPendingUploads (int, optional): Maximum number of jobs (or batches) uploading before processing waits. Defaults to 4.
+            batcher (JobBatcher, optional): Groups compatible jobs into batches. Defaults to None (one job at a time).
+            scheduler (JobScheduler, optional): Chooses the next job by priority and fair share between users, when there is no batcher. Defaults to None (any pending job).
+            cancelInterval (float, optional): Seconds between checks for cancelled jobs. Defaults to 2.0. None disables the checks.
+            onCancel (callable, optional): Called as onCancel(job, reason) from the watcher thread when a claimed job is cancelled, preempted or deleted. Defaults to None.
+        """
+        self.process = process
+        self.prefetch = prefetch if prefetch is not None else self.defaultPrefetch
+        self.upload = upload if upload is not None else self.defaultUpload
+        self.names = names
+        self.pollInterval = pollInterval
+        self.prefetchDepth = prefetchDepth
+        self.prefetchWorkers = prefetchWorkers
+        self.uploadWorkers = uploadWorkers
+        self.maxPendingUploads = maxPendingUploads
+        self.batcher = batcher
+        self.scheduler = scheduler
+        self.cancelInterval = cancelInterval
+        self.onCancel = onCancel
+        self.watcher = None
+        self.stopEvent = threading.Event()
+        self.processed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self._countLock = threading.Lock()
+        self._ready = None
+        self._backlog = []
+
+    def defaultPrefetch(self, job):
+        return job.get("request", "")
+
+    def defaultUpload(self, job, outputs):
+        return outputs
+
+    def stop(self):
+        """
+        Asks the worker to stop. No new jobs are claimed, the job being processed is finished, claimed
+        jobs that have not started are returned to the pending collection, and pending uploads are
+        flushed before `run()` returns.
+        """
+        self.stopEvent.set()
+
+    def stopped(self) -> bool:
+        """
+        Returns:
+            bool: True if `stop()` has been called.
+        """
+        return self.stopEvent.is_set()
+
+    def installSignalHandlers(self):
+        """
+        Stops the worker gracefully on SIGINT and SIGTERM. Must be called from the main thread.
+        """
+        import signal
+        def handler(signum, frame):
+            self.stop()
+        signal.signal(signal.SIGINT, handler)
+        signal.signal(signal.SIGTERM, handler)
+        return self
+
+    def isCancelled(self, job) -> bool:
+        """
+        Returns:
+            bool: True if the job was cancelled, preempted or deleted since it was claimed.
+        """
+        return self.watcher is not None and self.watcher.isCancelled(job)
+
+    def checkCancelled(self, job):
+        """
+        Call from `process` between steps to stop a job that was cancelled, preempted or deleted.
+
+        Raises:
+            JobCancelled: If the job was signalled.
+        """
+        if self.watcher is not None:
+            self.watcher.checkCancelled(job)
+
+    def getSignal(self, job) -> str:
+        return self.watcher.getSignal(job) if self.watcher is not None else None
+
+    def unwatch(self, job) -> str:
+        return self.watcher.unwatch(job) if self.watcher is not None else None
+
+    def stopJob(self, job, reason):
+        """
+        Settles a job that was stopped because of a signal, see `finishCancelledJob`.
+
+        Args:
+            job (dict): The job.
+            reason (str): "cancelled", "preempted" or "deleted". None returns a job that was stopped along with
+                a signalled job of the same batch to the pending collection.
+        """
+        self.unwatch(job)
+        with self._countLock:
+            self.cancelled += 1 if reason is not None else 0
+        try:
+            finishCancelledJob(job, reason if reason is not None else "preempted")
+        except Exception:
+            traceback.print_exc()
+
+    def markFailed(self, job, error):
+        """
+        Marks a job as failed without writing it.
+
+        Args:
+            job (dict): The job that failed.
+            error (Exception): The error raised by one of the stages.
+        """
+        with self._countLock:
+            self.failed += 1
+        job["status"] = "error"
+        job["messages"] = "".join(traceback.format_exception(type(error), error, error.__traceback__))
+
+    def failJob(self, job, error):
+        """
+        Marks a job as failed and moves it to the finished collection with status 'error'.
+
+        Args:
+            job (dict): The job that failed.
+            error (Exception): The error raised by one of the stages.
+        """
+        reason = self.unwatch(job)
+        if reason is not None:
+            # The error came from stopping a signalled job, for example in onCancel
+            self.stopJob(job, reason)
+            return
+        self.markFailed(job, error)
+        try:
+            setJobFinished(job["id"], job)
+        except Exception:
+            traceback.print_exc()
+
+    def nextPendingJobs(self) -> list:
+        """
+        Claims the next pending job, or the next batch of jobs when a batcher is set, or the job chosen by
+        the scheduler when one is set. Otherwise the pending collection is read once and the local backlog is used for subsequent claims, so the
+        collection is only streamed again once the backlog is empty.
+
+        Returns:
+            list: The claimed jobs, or an empty list if there is nothing to claim.
+        """
+        if self.batcher is not None:
+            return self.batcher.nextBatch(names=self.names, stopEvent=self.stopEvent)
+        if self.scheduler is not None:
+            job = self.scheduler.nextJob(names=self.names, stopEvent=self.stopEvent)
+            return [job] if job is not None else []
+        if len(self._backlog) == 0:
+            jobs = getPendingJobs()
+            if self.names is not None:
+                jobs = [job for job in jobs if job.get("name") in self.names]
+            self._backlog = jobs
+        while len(self._backlog) > 0 and not self.stopped():
+            candidate = self._backlog.pop(0)
+            job = claimJob(candidate["id"])
+            if job is not None:
+                return [job]
+        return []
+
+    def claimLoop(self, prefetchPool):
+        while not self.stopped():
+            try:
+                jobs = self.nextPendingJobs()
+            except Exception:
+                traceback.print_exc()
+                jobs = []
+            if len(jobs) == 0:
+                self.stopEvent.wait(self.pollInterval)
+                continue
+            if self.watcher is not None:
+                self.watcher.watch(jobs)
+            futures = [prefetchPool.submit(self.prefetch, job) for job in jobs]
+            # Blocks while prefetchDepth items are already waiting to be processed
+            self._ready.put((jobs, futures))
+        self._ready.put(None)
+
+    def dropCancelled(self, jobs, values) -> tuple:
+        """
+        Stops the jobs that were signalled, and returns the other jobs with their values.
+
+        Returns:
+            tuple: The remaining jobs and values.
+        """
+        remaining = []
+        for job, value in zip(jobs, values):
+            reason = self.getSignal(job)
+            if reason is not None:
+                self.stopJob(job, reason)
+            else:
+                remaining.append((job, value))
+        return [job for job, value in remaining], [value for job, value in remaining]
+
+    def finishJobs(self, jobs, outputs, uploadPool, uploadSlots):
+        try:
+            jobs, outputs = self.dropCancelled(jobs, outputs)
+            futures = [uploadPool.submit(self.upload, job, output) for job, output in zip(jobs, outputs)]
+            results = []
+            for job, future in zip(jobs, futures):
+                try:
+                    results.append((job, future.result()))
+                    job["status"] = "finished"
+                except Exception as error:
+                    self.markFailed(job, error)
+                    results.append((job, ""))
+            # Jobs signalled during their upload are stopped instead of written
+            finished = []
+            for job, result in results:
+                reason = self.unwatch(job)
+                if reason is not None:
+                    self.stopJob(job, reason)
+                else:
+                    finished.append((job, result))
+            if len(finished) == 0:
+                return
+            updateJobResults(finished)
+            with self._countLock:
+                self.processed += len([job for job, result in finished if job["status"] == "finished"])
+        except Exception:
+            traceback.print_exc()
+        finally:
+            uploadSlots.release()
+
+    def processJobs(self, jobs, futures) -> list:
+        inputs = [future.result() for future in futures]
+        if self.batcher is None:
+            return [self.process(jobs[0], inputs[0])]
+        outputs = list(self.process(jobs, inputs))
+        if len(outputs) != len(jobs):
+            raise ValueError(f"process returned {len(outputs)} outputs for a batch of {len(jobs)} jobs")
+        return outputs
+
+    def run(self, maxJobs=None):
+        """
+        Runs the worker loop until `stop()` is called.
+
+        Args:
+            maxJobs (int, optional): Stop after this many jobs have been processed. Defaults to None (run until stopped).
+
+        Returns:
+            JobWorker: The worker, with `processed` and `failed` counts updated.
+        """
+        self._ready = queue.Queue(maxsize=self.prefetchDepth)
+        if self.cancelInterval is not None:
+            self.watcher = JobWatcher(self.cancelInterval, self.onCancel)
+        uploadSlots = threading.BoundedSemaphore(self.maxPendingUploads)
+        prefetchPool = ThreadPoolExecutor(max_workers=self.prefetchWorkers, thread_name_prefix="uaimodal-prefetch")
+        uploadPool = ThreadPoolExecutor(max_workers=self.uploadWorkers, thread_name_prefix="uaimodal-upload")
+        # Waits on uploads and writes results, so it never occupies an upload worker
+        commitPool = ThreadPoolExecutor(max_workers=self.maxPendingUploads, thread_name_prefix="uaimodal-commit")
+        claimThread = threading.Thread(target=self.claimLoop, args=(prefetchPool,), name="uaimodal-claim", daemon=True)
+        claimThread.start()
+        started = 0
+        claimDone = False
+        try:
+            while not self.stopped():
+                item = self._ready.get()
+                if item is None:
+                    claimDone = True
+                    break
+                jobs, futures = item
+                started += len(jobs)
+                if maxJobs is not None and started >= maxJobs:
+                    self.stop()
+                jobs, futures = self.dropCancelled(jobs, futures)
+                if len(jobs) == 0:
+                    continue
+                try:
+                    outputs = self.processJobs(jobs, futures)
+                except JobCancelled as error:
+                    for job in jobs:
+                        self.stopJob(job, self.getSignal(job) or (error.reason if job is error.job else None))
+                    continue
+                except Exception as error:
+                    for job in jobs:
+                        self.failJob(job, error)
+                    continue
+                uploadSlots.acquire()
+                commitPool.submit(self.finishJobs, jobs, outputs, uploadPool, uploadSlots)
+        finally:
+            self.stop()
+            if not claimDone:
+                self.requeueUnstarted()
+            claimThread.join()
+            prefetchPool.shutdown(wait=True)
+            commitPool.shutdown(wait=True)
+            uploadPool.shutdown(wait=True)
+            if self.watcher is not None:
+                self.watcher.close()
+        return self
+
+    def requeueUnstarted(self):
+        """
+        Returns claimed jobs that were never processed to the pending collection. Keeps reading until
+        the claim thread signals it has stopped, so a job it is still handing over is not lost.
+        """
+        while True:
+            item = self._ready.get()
+            if item is None:
+                return
+            jobs, futures = item
+            for job in jobs:
+                self.unwatch(job)
+                job["status"] = "pending"
+                try:
+                    requeueJob(job["id"])
+                except Exception:
+                    traceback.print_exc()